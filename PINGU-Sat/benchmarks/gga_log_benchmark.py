@@ -0,0 +1,99 @@
+"""Times the bulk GGA decoder against per-line parse_gga on a _gps.txt log.
+
+A synthetic log is written to a temporary file if no log is given. The
+per-line decoder is timed on the first --sample lines and scaled up. Run
+from the PINGU-Sat directory:
+
+    python -m benchmarks.gga_log_benchmark --lines 1000000
+    python -m benchmarks.gga_log_benchmark --log 2022-01-01-10-00-00_gps.txt
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import numpy as np
+from sensors.gps.gps_utils import parse_gga
+from sensors.gps.gga_log import load_gga_log
+
+
+#-------------------------------------------
+
+def checksum(body):
+    value = 0
+    for c in body.encode():
+        value ^= c
+    return f'{value:02X}'
+
+
+def write_synthetic_log(f, lines, seed=1):
+
+    """Writes a 1 Hz ascent with GPS dropouts in the write_gps_data layout,
+       in every hemisphere so the signs are compared too"""
+
+    rng = random.Random(seed)
+    for i in range(lines):
+        if rng.random() < 0.05:
+            f.write('No GPS\n')
+            continue
+        t = i % 86400
+        alt = min(5*i, 30000) + rng.gauss(0, 2)
+        body = (f'GPGGA,{t//3600:02d}{t//60 % 60:02d}{t % 60:02d}.00,'
+                f'{5213.2 + rng.gauss(0, 1):09.4f},{"NS"[i % 2]},'
+                f'{127.5 + rng.gauss(0, 1):010.4f},{"WE"[i//2 % 2]},'
+                f'1,08,{rng.uniform(0.5, 2):.1f},{alt:.1f},M,46.9,M,,')
+        f.write(f'${body}*{checksum(body)}\r\n')
+
+
+def per_line(lines):
+    result = []
+    for line in lines:
+        line = line.strip()
+        result.append(parse_gga(None if line == 'No GPS' else line))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--log')
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--sample', type=int, default=50000)
+    args = parser.parse_args()
+
+    filename = args.log
+    if filename is None:
+        fd, filename = tempfile.mkstemp(suffix='_gps.txt')
+        with os.fdopen(fd, 'w', newline='') as f:
+            write_synthetic_log(f, args.lines)
+
+    try:
+        start = time.perf_counter()
+        columns = load_gga_log(filename)
+        bulk = time.perf_counter() - start
+
+        with open(filename) as f:
+            lines = f.readlines()
+        sample = lines[:args.sample]
+        start = time.perf_counter()
+        parsed = per_line(sample)
+        line_time = (time.perf_counter() - start)*len(lines)/len(sample)
+    finally:
+        if args.log is None:
+            os.remove(filename)
+
+    for i, d in enumerate(parsed):
+        if d['altitude'] is None:
+            assert not columns['has_fix'][i]
+        else:
+            assert columns['altitude'][i] == d['altitude']
+            assert abs(columns['latitude'][i] - d['latitude']) <= 1.01e-5
+
+    print(f'{len(lines)} lines, {int(columns["has_fix"].sum())} fixes')
+    print(f'{"decoder":<22} {"seconds":>9} {"us/line":>9}')
+    print(f'{"parse_gga per line":<22} {line_time:>9.2f} {line_time/len(lines)*1e6:>9.2f}  (from {len(sample)} lines)')
+    print(f'{"load_gga_log":<22} {bulk:>9.2f} {bulk/len(lines)*1e6:>9.2f}')
+    print(f'speed-up: {line_time/bulk:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Compares the storage of the records as plain OutputFile text against the
+RotatingFile modes: compression of the closed segments in the background,
+and stream compression in frames.
+
+A synthetic flight's worth of _enviroment.txt records is written through
+each file, as fast as it is accepted, and the report gives the bytes left
+on disk, the writes of records or frames to the card, the CPU time of
+writing (with the background compression, which is waited for) and the
+time to read every record back. Run from the PINGU-Sat directory:
+
+    python -m benchmarks.log_compression_benchmark --records 100000
+"""
+import argparse
+import glob
+import os
+import random
+import tempfile
+import time
+from data_utils.thread_utils import OutputFile
+from data_utils.rotating_log import RotatingFile, read_rotated_lines
+
+
+#file options of each configuration, a None factory for plain OutputFile
+CONFIGURATIONS = [
+    ('OutputFile', None, {}),
+    ('compress zlib', RotatingFile, {'compress': 'zlib'}),
+    ('compress lzma', RotatingFile, {'compress': 'lzma'}),
+    ('stream zlib', RotatingFile, {'stream': 'zlib'}),
+    ('stream lzma', RotatingFile, {'stream': 'lzma'}),
+]
+
+
+#-------------------------------------------
+
+def synthetic_records(count, seed=0):
+
+    """Lines in the layout of write_enviroment_data, one a second"""
+
+    rng = random.Random(seed)
+    start = 1_650_000_000.0
+    lines = []
+    for i in range(count):
+        altitude = min(30000.0, 5.0*i)
+        pressure = 1013.25*(1 - 2.25577e-5*altitude)**5.25588
+        lines.append(f'{start + i:.6f},{21.5 + rng.gauss(0, 0.1):.3f},'
+                     f'{15.0 - 0.0065*altitude + rng.gauss(0, 0.1):.3f},'
+                     f'({rng.gauss(20, 0.2):.2f}, {pressure + rng.gauss(0, 0.05):.2f})')
+    return lines
+
+
+def write_records(factory, options, filename, lines, segment_bytes):
+    if factory is None:
+        f = OutputFile(filename)
+        writes = lambda: f.stats.records
+    else:
+        if 'compress' in options:
+            options = dict(options, max_bytes=segment_bytes)
+        f = factory(filename, **options)
+        writes = lambda: f.frames if f.frames else f.stats.records
+
+    f.open()
+    for line in lines:
+        f.writeline(line)
+    if factory is not None and 'compress' in options:
+        #the last segment is rotated out by one more record, and every
+        #closed segment compressed before the file is closed
+        wait_for(lambda: not f.queue_depth)
+        f.writeline(lines[-1])
+        wait_for(lambda: not f.queue_depth and f.compressed == f.rotations)
+    f.close()
+    return writes()
+
+
+def wait_for(condition):
+    while not condition():
+        time.sleep(0.01)
+
+
+def read_records(factory, filename):
+    if factory is None:
+        with open(filename) as f:
+            return sum(1 for _ in f)
+    return len(read_rotated_lines(filename))
+
+
+def disk_bytes(directory):
+    return sum(os.path.getsize(p) for p in glob.glob(os.path.join(directory, '*')))
+
+
+#-------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--segment', type=int, default=1024*1024,
+                        help='bytes of records per segment when compressing closed segments')
+    args = parser.parse_args()
+
+    lines = synthetic_records(args.records)
+    text = sum(len(line) + 1 for line in lines)
+    print(f'{args.records} records, {text} bytes of text')
+    print(f"{'storage':<16}{'on disk':>10}{'ratio':>8}{'card writes':>13}{'write cpu s':>13}{'read s':>9}{'read':>9}")
+    for name, factory, options in CONFIGURATIONS:
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'bench_enviroment.txt')
+            cpu = time.process_time()
+            writes = write_records(factory, options, filename, lines, args.segment)
+            cpu = time.process_time() - cpu
+            size = disk_bytes(tmp)
+
+            start = time.perf_counter()
+            read = read_records(factory, filename)
+            elapsed = time.perf_counter() - start
+        print(f'{name:<16}{size:>10}{text/size:>8.1f}{writes:>13}{cpu:>13.3f}{elapsed:>9.3f}{read:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""Microbenchmark of the single-pass NMEA parser against gps_utils.parse_gga.
+
+Run from the PINGU-Sat directory:
+
+    python -m benchmarks.nmea_benchmark
+"""
+import argparse
+import timeit
+from sensors.gps.gps_utils import parse_gga
+from sensors.gps.nmea import parse_nmea, parse_gga_dict
+
+
+GGA = '$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    assert parse_gga_dict(GGA)['altitude'] == parse_gga(GGA)['altitude']
+
+    cases = [
+        ('gps_utils.parse_gga', lambda: parse_gga(GGA)),
+        ('nmea.parse_nmea', lambda: parse_nmea(GGA)),
+        ('nmea.parse_gga_dict', lambda: parse_gga_dict(GGA)),
+    ]
+    baseline = None
+    print(f'{"parser":<22} {"us/sentence":>12} {"speed-up":>9}')
+    for name, func in cases:
+        t = min(timeit.repeat(func, number=args.number, repeat=5))/args.number
+        baseline = baseline or t
+        print(f'{name:<22} {t*1e6:>12.2f} {baseline/t:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Compares sensor read jitter of the single-process runtime against the
+offloaded runtime, with the data handling under load.
+
+Timer sensors are read at a fixed rate by RunSensor, and the start jitter
+of their reads (how late each read starts after its deadline) is taken
+from their FixedRate schedules. Each read gives the raw frame a sensor run
+raw gives: a GGA sentence as bytes, the MS5611 ADC and PROM words, or a
+temperature. A load process does the work of the data handling processes
+(NMEA parsing, telemetry and payload formatting, record strings and
+compression) for a set fraction of the time. The runtimes are:
+
+    single process   the sensors process their frames (FixTracker, MS5611
+                     compensation) and the load runs in the same
+                     interpreter, where it holds the GIL
+    offload parsed   the sensors process their frames and the values are
+                     sent through a SharedRing to the load in a worker
+    offloaded        the raw frames are sent through the SharedRing, and
+                     the worker processes them with the sensors of
+                     build_raw_processors before the load, as
+                     pingu_main --offload does
+
+Run from the PINGU-Sat directory (the gap shows best on a multi-core Pi):
+
+    python -m benchmarks.offload_benchmark --duration 20 --load 0.5
+"""
+import argparse
+import functools
+import io
+import multiprocessing
+import time
+import zlib
+from data_utils.process_handling import RunSensor, RunProcesses
+from data_utils.snapshot import SnapshotBus
+from data_utils.latency import LatencyHistogram
+from data_utils.offload import SharedRing, RingPublisher, RingReader, RunWorker, wait_for_stop
+from data_utils.data_handling import (generate_data_dict, generate_telem_dict, generate_payload_dict,
+                                      format_payload_data, write_enviroment_data)
+from pingu_main import build_raw_processors
+from simulation.flight import DATASHEET_CONSTANTS
+
+
+GGA = b'$GPGGA,123519,5320.420,N,00615.580,W,1,08,0.9,545.4,M,46.9,M,,*47'
+#the datasheet example conversions, 20.07 C and 1000.09 mbar
+D1, D2 = 9085466, 8569150
+
+
+#-------------------------------------------
+
+class PacedSensor:
+
+    """Sensor read at a fixed rate, whose read takes a short fixed time
+       like an I2C transfer and gives the raw frame made by frame. Given a
+       processor (a sensor of build_raw_processors) the frame is processed
+       in the read, as a sensor that is not run raw does"""
+
+    def __init__(self, frame, rate, processor=None, work=0.0005):
+        self.rate = rate
+        self._frame = frame
+        self._processor = processor
+        self._work = work
+        self._data = None
+
+    def setup(self):
+        pass
+
+    def teardown(self):
+        pass
+
+    def update(self):
+        end = time.perf_counter() + self._work
+        while time.perf_counter() < end:
+            pass
+        frame = self._frame()
+        if self._processor is None:
+            self._data = frame
+        else:
+            for value in self._processor.process_raw(frame):
+                self._data = value
+
+    @property
+    def data(self):
+        return self._data
+
+
+def make_processors():
+    return build_raw_processors(geiger_port=None)
+
+
+def make_sensors(rate, processors=None):
+    processors = processors if processors else {}
+    reads = iter(range(1 << 62))
+    #each read gives a new frame object, so that every read is published
+    frames = {
+        'gps': lambda: (GGA,),
+        'pressure': lambda: (D1, D2, *DATASHEET_CONSTANTS[1:]),
+        't_internal': lambda: 21.5 + next(reads) % 10/1000,
+        't_external': lambda: -40.25 + next(reads) % 10/1000,
+    }
+    return {key: PacedSensor(frame, rate, processors.get(key)) for key, frame in frames.items()}
+
+
+class FormattingLoad:
+
+    """Process doing the data handling work on the latest frame for load
+       of every period"""
+
+    def __init__(self, bus, load, rate=10):
+        self.rate = rate
+        self._bus = bus
+        self._work = load/rate
+        self.iterations = 0
+
+    def setup(self):
+        pass
+
+    def teardown(self):
+        pass
+
+    def update(self):
+        data = generate_data_dict(self._bus)
+        if any(data.get(k) is None for k in ('gps', 'pressure', 't_internal', 't_external')):
+            return
+        records = RecordBuffer()
+        end = time.perf_counter() + self._work
+        while time.perf_counter() < end:
+            generate_telem_dict(data)
+            format_payload_data(generate_payload_dict(data))
+            write_enviroment_data(data, records)
+            self.iterations += 1
+        zlib.compress(records.getvalue().encode())
+
+
+class RecordBuffer(io.StringIO):
+
+    """In-memory stand-in for the OutputFile records are written to"""
+
+    def writeline(self, msg, newline='\n'):
+        self.write(msg + newline)
+
+
+def schedule_jitter(runner):
+
+    """Merged start jitter and total overruns of every sensor schedule"""
+
+    jitter = LatencyHistogram(highest=60.0)
+    overruns = 0
+    for thread in runner.threads:
+        jitter.merge(thread.schedule.jitter)
+        overruns += thread.schedule.overruns
+    return jitter, overruns
+
+
+#-------------------------------------------
+
+def run_single(duration, rate, load):
+    bus = SnapshotBus()
+    runner = RunSensor(bus.attach(make_sensors(rate, make_processors())))
+    with runner:
+        processes = [FormattingLoad(bus, load)] if load else []
+        with RunProcesses(processes):
+            time.sleep(duration)
+    jitter, overruns = schedule_jitter(runner)
+    return jitter, overruns, None
+
+
+def load_worker(ring, load, raw, results, stop_event):
+
+    """Worker process running the load on the samples from the ring,
+       processing them first if they are raw"""
+
+    bus = SnapshotBus()
+    reader = RingReader(ring, bus, make_processors() if raw else None)
+    with RunProcesses([reader, FormattingLoad(bus, load)]):
+        wait_for_stop(stop_event)
+    results.put(reader.transit.summary())
+    ring.close()
+
+
+def run_offload(duration, rate, load, raw=True):
+    results = multiprocessing.Queue()
+    with SharedRing() as ring:
+        with RunWorker(load_worker, ring, load, raw, results):
+            processors = None if raw else make_processors()
+            runner = RunSensor(RingPublisher(ring).attach(make_sensors(rate, processors)))
+            with runner:
+                time.sleep(duration)
+        transit = results.get(timeout=10)
+        transit['dropped'] = ring.stats()['dropped']
+    jitter, overruns = schedule_jitter(runner)
+    return jitter, overruns, transit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--rate', type=float, default=50, help='sensor reads per second')
+    parser.add_argument('--load', type=float, default=0.5, help='fraction of time spent on data handling')
+    args = parser.parse_args()
+
+    print(f"{'runtime':<16}{'reads':>7}{'jitter p50 ms':>15}{'p99 ms':>9}{'max ms':>9}{'overruns':>10}"
+          f"{'transit p50 ms':>16}{'p99 ms':>9}{'dropped':>9}")
+    runs = [('idle', run_single, 0.0), ('single process', run_single, args.load),
+            ('offload parsed', functools.partial(run_offload, raw=False), args.load),
+            ('offloaded', run_offload, args.load)]
+    for name, run, load in runs:
+        jitter, overruns, transit = run(args.duration, args.rate, load)
+        s = jitter.summary()
+        row = f"{name:<16}{s['count']:>7}{s['p50']*1000:>15.3f}{s['p99']*1000:>9.3f}{s['max']*1000:>9.3f}{overruns:>10}"
+        if transit and transit['count']:
+            row += f"{transit['p50']*1000:>16.3f}{transit['p99']*1000:>9.3f}{transit['dropped']:>9}"
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Round-trips replayed flight data through the PayloadCodec and compares
+its size with the fixed-width text payload.
+
+Flight data is replayed from a binary log, from a pair of StoreData text
+logs, or if neither is given from a synthetic 1 Hz ascent to 30 km. Run
+from the PINGU-Sat directory:
+
+    python -m benchmarks.payload_codec_benchmark --binary-log 2022-01-01-10-00-00_flight.bin
+    python -m benchmarks.payload_codec_benchmark --text-logs env.txt gps.txt
+"""
+import argparse
+import ast
+import math
+import random
+import sys
+from data_utils.data_handling import format_payload_data, counter
+from data_utils.payload_codec import PayloadCodec
+from sensors.gps.gps_utils import alt_from_gps
+
+
+#-------------------------------------------
+
+def _value(v):
+    v = float(v)
+    return None if math.isnan(v) else v
+
+
+def samples_from_binary_log(filename):
+    from data_utils.binary_log import read_binary_log
+    return [{
+        'time': float(r['timestamp']),
+        'pressure': _value(r['pressure']),
+        't_external': _value(r['t_external']),
+        'alt': _value(r['altitude']),
+    } for r in read_binary_log(filename)]
+
+
+def samples_from_text_logs(env_filename, gps_filename):
+    samples = []
+    with open(env_filename) as env_file, open(gps_filename) as gps_file:
+        for env_line, gga in zip(env_file, gps_file):
+            timestamp, t_external, _, pressure = env_line.strip().split(',', 3)
+            gga = gga.strip()
+            samples.append({
+                'time': float(timestamp),
+                'pressure': ast.literal_eval(pressure)[1],
+                't_external': ast.literal_eval(t_external),
+                'alt': None if gga == 'No GPS' else alt_from_gps(gga),
+            })
+    return samples
+
+
+def synthetic_ascent(duration=7200, rate=5, seed=1):
+
+    """1 Hz samples of a balloon ascent using the barometric formula"""
+
+    rng = random.Random(seed)
+    samples = []
+    for i in range(duration):
+        alt = min(rate*i, 30000) + rng.gauss(0, 2)
+        temp = max(15 - 0.0065*alt, -56.5) + rng.gauss(0, 0.05)
+        pressure = 1013.25*math.exp(-alt/7400) + rng.gauss(0, 0.02)
+        samples.append({
+            'time': 1.6e9 + i,
+            'pressure': round(pressure, 2),
+            't_external': round(temp, 3),
+            'alt': None if rng.random() < 0.02 else round(alt, 1),
+        })
+    return samples
+
+
+#-------------------------------------------
+
+def text_size(samples, per_packet):
+    size = 0
+    for index, start in enumerate(range(0, len(samples), per_packet)):
+        chunk = samples[start:start + per_packet]
+        data_list = [format_payload_data({k: s[k] for k in ('pressure', 't_external', 'alt')}) for s in chunk]
+        size += len(';'.join([counter(index), *data_list]).encode())
+    return size
+
+
+def codec_size(codec, samples, per_packet):
+
+    """Encodes the samples in packets, checks every packet decodes back to
+       within half a resolution step and returns the total size"""
+
+    size = 0
+    for index, start in enumerate(range(0, len(samples), per_packet)):
+        chunk = samples[start:start + per_packet]
+        packet = codec.encode(index, chunk)
+        size += len(packet)
+
+        decoded_index, decoded = codec.decode(packet)
+        assert decoded_index == index
+        for original, sample in zip(chunk, decoded):
+            for name, resolution in codec.fields:
+                if original.get(name) is None:
+                    assert sample[name] is None, (name, original, sample)
+                else:
+                    assert abs(sample[name] - original[name]) <= resolution/2 + 1e-9, (name, original, sample)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--binary-log')
+    parser.add_argument('--text-logs', nargs=2, metavar=('ENV', 'GPS'))
+    parser.add_argument('--per-packet', type=int, nargs='+', default=[2, 10, 20, 50])
+    args = parser.parse_args()
+
+    if args.binary_log:
+        samples = samples_from_binary_log(args.binary_log)
+    elif args.text_logs:
+        samples = samples_from_text_logs(*args.text_logs)
+    else:
+        samples = synthetic_ascent()
+    if not samples:
+        sys.exit('No samples to replay')
+
+    codec = PayloadCodec()
+    print(f'{len(samples)} samples')
+    print(f'{"per packet":>10} {"text B/sample":>14} {"codec B/sample":>15} {"ratio":>7}')
+    for n in args.per_packet:
+        text = text_size(samples, n)
+        binary = codec_size(codec, samples, n)
+        print(f'{n:>10} {text/len(samples):>14.2f} {binary/len(samples):>15.2f} {text/binary:>7.2f}')
+
+
+if __name__ == '__main__':
+    main()
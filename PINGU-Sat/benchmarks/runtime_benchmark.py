@@ -0,0 +1,182 @@
+"""Compares CPU and memory use of the threaded flight runtime against the
+asyncio runtime.
+
+Both runtimes run the same simulated sensors, a fake radio and a StoreData
+process writing to a temporary directory. Each runtime is measured in its
+own interpreter so that peak RSS is not shared. Run from the PINGU-Sat
+directory:
+
+    python -m benchmarks.runtime_benchmark --duration 20
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from benchmarks.scheduler_benchmark import FakeSerialSensor, FakeTimerSensor, writer
+from data_utils.process_handling import RunSensor, RunProcesses
+from data_utils.data_handling import HandleTelemetry, HandleData, StoreData
+from data_utils.async_handling import AsyncRunSensor, AsyncRunProcesses
+from data_utils.async_handling import AsyncHandleTelemetry, AsyncHandleData, AsyncStoreData
+
+
+GGA = b'$GPGGA,123519,5320.420,N,00615.580,W,1,08,0.9,545.4,M,46.9,M,,*47'
+
+
+#-------------------------------------------
+
+class FakeGPS(FakeSerialSensor):
+
+    @property
+    def data(self):
+        return self._data.decode('ascii').strip('\r\n') if self._data else None
+
+
+class FakePressure(FakeTimerSensor):
+
+    @property
+    def data(self):
+        return (21.5, 1013.25) if self._data else (None, None)
+
+
+class FakeTemperature(FakeTimerSensor):
+
+    @property
+    def data(self):
+        return 21.5 if self._data else None
+
+
+class FakeRadio:
+
+    def __init__(self):
+        self.packets = 0
+
+    def send_data(self, msg):
+        self.packets += 1
+
+    def send_telemetry_packet(self, dictionary):
+        self.packets += 1
+
+
+#-------------------------------------------
+
+def make_sensors(pace, work):
+    gps_r, gps_w = os.pipe()
+    sensors = {
+        'gps': FakeGPS(gps_r, b'$GPGGA'),
+        't_internal': FakeTemperature(work, pace),
+        't_external': FakeTemperature(work, pace),
+        'pressure': FakePressure(work, pace),
+    }
+    stop = threading.Event()
+    feed = threading.Thread(target=writer, args=(gps_w, [GGA, b'$GPGSV', b'$GPRMC'], 1, stop))
+    return sensors, feed, stop, gps_w
+
+
+def pauses(scale):
+    return {'telemetry': 20/scale, 'data': 10/scale, 'store': 1/scale}
+
+
+def run_threads(duration, period, work, scale, directory):
+    sensors, feed, stop, fd = make_sensors(period - work, work)
+    radio = FakeRadio()
+    p = pauses(scale)
+    processes = [
+        HandleData(sensors, radio, pause=p['data']),
+        HandleTelemetry(sensors, radio, pause=p['telemetry']),
+        StoreData(sensors, directory, pause=p['store']),
+    ]
+    feed.start()
+    with RunSensor(sensors):
+        with RunProcesses(processes):
+            threads = threading.active_count()
+            time.sleep(duration)
+    stop.set()
+    feed.join()
+    os.close(fd)
+    return threads, radio.packets
+
+
+def run_asyncio(duration, period, work, scale, directory):
+    sensors, feed, stop, fd = make_sensors(None, work)
+    radio = FakeRadio()
+    p = pauses(scale)
+    processes = [
+        AsyncHandleData(sensors, radio, pause=p['data']),
+        AsyncHandleTelemetry(sensors, radio, pause=p['telemetry']),
+        AsyncStoreData(sensors, directory, pause=p['store']),
+    ]
+
+    async def _run():
+        async with AsyncRunSensor(sensors, default_period=period, offload=['pressure']):
+            async with AsyncRunProcesses(processes):
+                await asyncio.sleep(0)
+                threads = threading.active_count()
+                await asyncio.sleep(duration)
+        return threads
+
+    feed.start()
+    threads = asyncio.run(_run())
+    stop.set()
+    feed.join()
+    os.close(fd)
+    return threads, radio.packets
+
+
+def measure(backend, duration, period, work, scale):
+    run = run_threads if backend == 'threads' else run_asyncio
+    with tempfile.TemporaryDirectory() as directory:
+        tracemalloc.start()
+        cpu_start, wall_start = time.process_time(), time.monotonic()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            threads, packets = run(duration, period, work, scale, directory + os.sep)
+        cpu = time.process_time() - cpu_start
+        wall = time.monotonic() - wall_start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'backend': backend,
+        'threads': threads,
+        'packets': packets,
+        'cpu_percent': 100*cpu/wall,
+        'py_peak_kib': peak/1024,
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--period', type=float, default=0.5)
+    parser.add_argument('--work', type=float, default=0.01)
+    parser.add_argument('--scale', type=float, default=10,
+                        help='divides the 20 s, 10 s and 1 s process pauses')
+    parser.add_argument('--backend', choices=('threads', 'asyncio'))
+    args = parser.parse_args()
+
+    if args.backend:
+        print(json.dumps(measure(args.backend, args.duration, args.period, args.work, args.scale)))
+        return
+
+    print(f'{"backend":<8} {"threads":>7} {"packets":>7} {"cpu %":>7} {"py peak KiB":>12} {"max RSS KiB":>12}')
+    for backend in ('threads', 'asyncio'):
+        out = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.runtime_benchmark', '--backend', backend,
+             '--duration', str(args.duration), '--period', str(args.period),
+             '--work', str(args.work), '--scale', str(args.scale)],
+            capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f'{backend:<8} {r["threads"]:>7} {r["packets"]:>7} {r["cpu_percent"]:>7.2f} '
+              f'{r["py_peak_kib"]:>12.1f} {r["max_rss_kib"]:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Compares CPU use and sample jitter of the thread-per-sensor model
+against the single SensorScheduler thread.
+
+Serial sensors are simulated with pipes fed by writer threads at the GPS
+and Geiger rates, timer sensors with a short blocking read. Run from the
+PINGU-Sat directory:
+
+    python -m benchmarks.scheduler_benchmark --duration 10
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from data_utils.process_handling import RunSensor
+
+
+#-------------------------------------------
+
+class FakeSerial:
+
+    """Unbuffered read end of a pipe that behaves like a serial port"""
+
+    def __init__(self, fd):
+        self._file = os.fdopen(fd, 'rb', buffering=0)
+
+    def readline(self):
+        return self._file.readline()
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+
+class FakeSerialSensor:
+
+    """Serial sensor that keeps the lines starting with prefix and records
+       the delay between each line being written and it being read"""
+
+    def __init__(self, fd, prefix):
+        self._fd = fd
+        self._prefix = prefix
+        self.serial = None
+        self._data = None
+        self.delays = []
+
+    def setup(self):
+        self.serial = FakeSerial(self._fd)
+
+    def teardown(self):
+        self.serial.close()
+
+    def update(self):
+        while self.read_line() is False:
+            pass
+
+    def on_readable(self):
+        #False at EOF, as for the flight sensors
+        return self.read_line() is not None
+
+    def read_line(self):
+
+        """Reads a line and returns True if it matched the prefix, or None
+           at EOF"""
+
+        line = self.serial.readline()
+        if not line:
+            return None
+        if line.startswith(self._prefix):
+            sent = float(line.split(b',')[1])
+            self.delays.append(time.monotonic() - sent)
+            self._data = line
+            return True
+        return False
+
+    @property
+    def data(self):
+        return self._data
+
+
+class FakeTimerSensor:
+
+    """Sensor whose read blocks for a fixed time, like an I2C conversion.
+
+       With pace set the sensor sleeps after each read, which is how a
+       periodic read is done in the thread-per-sensor model"""
+
+    def __init__(self, work, pace=None):
+        self._work = work
+        self._pace = pace
+        self._data = None
+        self.times = []
+
+    def setup(self):
+        pass
+
+    def teardown(self):
+        pass
+
+    def update(self):
+        self.times.append(time.monotonic())
+        time.sleep(self._work)
+        self._data = self.times[-1]
+        if self._pace:
+            time.sleep(self._pace)
+
+    @property
+    def data(self):
+        return self._data
+
+
+def writer(fd, sentences, interval, stop_event):
+
+    """Writes a burst of sentences to a pipe every interval seconds"""
+
+    deadline = time.monotonic()
+    while not stop_event.is_set():
+        try:
+            for s in sentences:
+                os.write(fd, s + b',' + f'{time.monotonic():.6f}'.encode() + b'\n')
+        except BrokenPipeError:
+            #the sensor closed its end when it was torn down
+            return
+        deadline += interval
+        stop_event.wait(max(0.0, deadline - time.monotonic()))
+
+
+#-------------------------------------------
+
+def make_sensors(backend, period, work):
+
+    """Builds a GPS-like and a Geiger-like serial sensor plus three timer
+       sensors, with the writer threads that feed the serial ones"""
+
+    gps_r, gps_w = os.pipe()
+    geiger_r, geiger_w = os.pipe()
+
+    pace = period - work if backend == 'threads' else None
+    sensors = {
+        'gps': FakeSerialSensor(gps_r, b'$GPGGA'),
+        'geiger': FakeSerialSensor(geiger_r, b'CPS'),
+        't_internal': FakeTimerSensor(work, pace),
+        't_external': FakeTimerSensor(work, pace),
+        'pressure': FakeTimerSensor(work, pace),
+    }
+
+    gps_burst = [b'$GPGGA', b'$GPGSA', b'$GPGSV', b'$GPGSV', b'$GPRMC', b'$GPVTG']
+    writer_stop = threading.Event()
+    writers = [
+        threading.Thread(target=writer, args=(gps_w, gps_burst, 1, writer_stop)),
+        threading.Thread(target=writer, args=(geiger_w, [b'CPS'], 1, writer_stop)),
+    ]
+    return sensors, writers, writer_stop, (gps_r, gps_w, geiger_r, geiger_w)
+
+
+def jitter(times, period):
+    intervals = [b - a for a, b in zip(times, times[1:])]
+    if len(intervals) < 2:
+        return float('nan'), float('nan')
+    return statistics.pstdev(intervals), max(abs(i - period) for i in intervals)
+
+
+def run_backend(backend, duration, period, work):
+    sensors, writers, writer_stop, fds = make_sensors(backend, period, work)
+    for w in writers:
+        w.start()
+
+    kwargs = {'default_period': period} if backend == 'scheduler' else {}
+    runner = RunSensor(sensors, backend=backend, **kwargs)
+
+    cpu_start, wall_start = time.process_time(), time.monotonic()
+    with runner:
+        threads = threading.active_count()
+        time.sleep(duration)
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+
+    writer_stop.set()
+    for w in writers:
+        w.join()
+    for fd in fds[1::2]:
+        os.close(fd)
+
+    timer_stats = [jitter(sensors[k].times, period) for k in ('t_internal', 't_external', 'pressure')]
+    serial_delays = sensors['gps'].delays + sensors['geiger'].delays
+
+    return {
+        'threads': threads,
+        'cpu_percent': 100*cpu/wall,
+        'timer_std_ms': 1e3*max(s[0] for s in timer_stats),
+        'timer_max_ms': 1e3*max(s[1] for s in timer_stats),
+        'serial_mean_ms': 1e3*statistics.fmean(serial_delays),
+        'serial_max_ms': 1e3*max(serial_delays),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--period', type=float, default=0.5)
+    parser.add_argument('--work', type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(f'{"backend":<10} {"threads":>7} {"cpu %":>7} {"timer std ms":>13} '
+          f'{"timer max ms":>13} {"serial mean ms":>15} {"serial max ms":>14}')
+    for backend in ('threads', 'scheduler'):
+        r = run_backend(backend, args.duration, args.period, args.work)
+        print(f'{backend:<10} {r["threads"]:>7} {r["cpu_percent"]:>7.2f} {r["timer_std_ms"]:>13.3f} '
+              f'{r["timer_max_ms"]:>13.3f} {r["serial_mean_ms"]:>15.3f} {r["serial_max_ms"]:>14.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Measures CPU time per sentence of the LineFramer against the readline and
+decode loop it replaced, for GPS and Geiger traffic on a fake serial port.
+
+The fake port holds a recording of 1 Hz GPS bursts (GGA with RMC, GSA, VTG
+and a run of GSV sentences, plus the odd line of line noise) and Geiger
+readings, handed out in chunks as if they had just arrived. Run from the
+PINGU-Sat directory:
+
+    python -m benchmarks.serial_framer_benchmark --seconds 5000
+"""
+import argparse
+import io
+import random
+import time
+from sensors.geiger import parse_geiger
+from sensors.gps import check_sentence
+from sensors.gps.nmea import FixTracker, PARSERS
+from sensors.serial_framer import LineFramer
+
+
+#-------------------------------------------
+
+class FakeSerial(io.RawIOBase):
+
+    """In-memory serial port that makes up to chunk bytes available at a
+       time, like a UART FIFO being drained. As with pyserial, readline is
+       the io.RawIOBase one, which calls read once per byte"""
+
+    def __init__(self, data, chunk=64):
+        self._data = data
+        self._pos = 0
+        self._chunk = chunk
+        self.reads = 0
+
+    def readable(self):
+        return True
+
+    @property
+    def in_waiting(self):
+        return min(self._chunk, len(self._data) - self._pos)
+
+    def readinto(self, b):
+        self.reads += 1
+        data = self._data[self._pos:self._pos + len(b)]
+        if not data:
+            raise EOFError
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def checksum(body):
+    value = 0
+    for c in body.encode():
+        value ^= c
+    return f'{value:02X}'
+
+
+def nmea(body):
+    return f'${body}*{checksum(body)}\r\n'.encode()
+
+
+def gps_recording(seconds, seed=1):
+    rng = random.Random(seed)
+    out = bytearray()
+    for i in range(seconds):
+        t = f'{i//3600 % 24:02d}{i//60 % 60:02d}{i % 60:02d}.00'
+        out += nmea(f'GPRMC,{t},A,5213.2000,N,00127.5000,W,12.5,84.4,010122,,,A')
+        out += nmea(f'GPVTG,84.4,T,,M,12.5,N,23.2,K,A')
+        out += nmea(f'GPGGA,{t},5213.2000,N,00127.5000,W,1,08,0.9,{5*i:.1f},M,46.9,M,,')
+        out += nmea('GPGSA,A,3,04,05,09,12,24,25,29,31,,,,,1.8,0.9,1.5')
+        for j in range(4):
+            out += nmea(f'GPGSV,4,{j+1},14,04,{j*10:02d},090,42,05,45,120,40,09,30,200,38,12,15,300,35')
+        if rng.random() < 0.05:
+            out += bytes(rng.randrange(256) for _ in range(rng.randrange(1, 40)))
+    return bytes(out)
+
+
+def geiger_recording(seconds):
+    return b''.join(f'CPS, {i % 50}, CPM, {i % 3000}, uSv/hr, 0.{i % 99:02d}, SLOW\r\n'.encode()
+                    for i in range(seconds))
+
+
+#-------------------------------------------
+
+def legacy_gps(port):
+    tracker = FixTracker()
+    while True:
+        sentence = port.readline().decode('ascii', 'replace')
+        if sentence[3:6] in PARSERS:
+            tracker.update(sentence)
+        if check_sentence(sentence, 'GGA'):
+            yield sentence.strip('\r\n')
+
+
+def framer_gps(port):
+    tracker = FixTracker()
+    framer = LineFramer(port, match=[s.encode() for s in PARSERS], offset=3, start=b'$')
+    while True:
+        sentence = framer.readline()
+        tracker.update(sentence)
+        if check_sentence(sentence, 'GGA'):
+            yield sentence
+
+
+def legacy_geiger(port):
+    while True:
+        yield parse_geiger(port.readline().decode('ascii'))['CPS']
+
+
+def framer_geiger(port):
+    framer = LineFramer(port, match=[b'CPS'])
+    while True:
+        yield parse_geiger(framer.readline())['CPS']
+
+
+def run(reader, data, chunk):
+
+    """Returns (sentences kept, read calls, CPU seconds) for reading all
+       the data"""
+
+    port = FakeSerial(data, chunk)
+    kept = 0
+    start = time.process_time()
+    try:
+        for _ in reader(port):
+            kept += 1
+    except (EOFError, IndexError, ValueError):
+        pass
+    return kept, port.reads, time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=int, default=5000)
+    parser.add_argument('--chunk', type=int, default=64)
+    args = parser.parse_args()
+
+    gps = gps_recording(args.seconds)
+    geiger = geiger_recording(args.seconds)
+    cases = [
+        ('gps', 'readline+decode', legacy_gps, gps),
+        ('gps', 'LineFramer', framer_gps, gps),
+        ('geiger', 'readline+decode', legacy_geiger, geiger),
+        ('geiger', 'LineFramer', framer_geiger, geiger),
+    ]
+    print(f'{len(gps)} bytes of GPS and {len(geiger)} bytes of Geiger data, {args.chunk} bytes per read')
+    print(f'{"sensor":<8} {"reader":<16} {"kept":>7} {"reads":>9} {"us/kept sentence":>17}')
+    for sensor, name, reader, data in cases:
+        kept, reads, cpu = run(reader, data, args.chunk)
+        print(f'{sensor:<8} {name:<16} {kept:>7} {reads:>9} {cpu/kept*1e6:>17.2f}')
+
+
+if __name__ == '__main__':
+    main()
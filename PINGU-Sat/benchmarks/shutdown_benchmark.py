@@ -0,0 +1,127 @@
+"""Measures how long the flight runtime takes to shut down, and checks it
+against a bound.
+
+The sensors, radio, LinkScheduler and processes from pingu_main are run on
+the simulated hardware at 1x, then each context is exited in turn, as when
+the main loop is interrupted, and timed. The runs cover a normal flight, a
+GPS that has gone silent (the sensor is blocked in a serial read) and a GPS
+that has been unplugged (the sensor is in its pause after a
+SerialException), on both sensor backends. The processes are stopped in the
+middle of their pauses, up to 20 s for HandleTelemetry. The exit status is
+1 if any RunProcesses exit, or any whole shutdown, takes longer than the
+bound. Run from the PINGU-Sat directory:
+
+    python -m benchmarks.shutdown_benchmark --bound 0.2
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import pingu_main
+from data_utils.process_handling import RunSensor, RunProcesses
+from data_utils.radio_utils import RunRadio
+from data_utils.snapshot import SnapshotBus
+from data_utils.link_scheduler import LinkScheduler
+from simulation.clock import ReplayClock
+from simulation.fake_serial import ReplayPorts
+from simulation.fake_smbus import FakeMS5611
+from simulation.fake_w1 import FakeW1Tree
+from simulation.fake_radio import FakeSatRadio
+from simulation.flight import SyntheticFlight
+from simulation.replay import GEIGER_PORT, device_id
+
+
+SCENARIOS = ('flight', 'silent_gps', 'unplugged_gps')
+STAGES = ('RunProcesses', 'LinkScheduler', 'RunRadio', 'RunSensor')
+
+
+#-------------------------------------------
+
+def streams(flight, scenario):
+
+    """Serial streams of a scenario, and whether they loop"""
+
+    gps = flight.gps_stream(duration=600)
+    if scenario == 'silent_gps':
+        #one burst of sentences, then nothing for an hour
+        return {pingu_main.GPS_PORT: gps[:3] + [(3600.0, gps[3][1])],
+                GEIGER_PORT: flight.geiger_stream(duration=600)}, True
+    if scenario == 'unplugged_gps':
+        #the port fails once the first burst has been read
+        return {pingu_main.GPS_PORT: gps[:3]}, False
+    return {pingu_main.GPS_PORT: gps, GEIGER_PORT: flight.geiger_stream(duration=600)}, True
+
+
+def shutdown_times(scenario, backend, run_time):
+
+    """Runs the flight software for run_time s and returns the time each
+       context took to exit, in s"""
+
+    flight = SyntheticFlight()
+    clock = ReplayClock(1.0)
+    port_streams, loop = streams(flight, scenario)
+    ports = ReplayPorts(clock, port_streams, loop=loop)
+    smbus = FakeMS5611(clock, *flight.pressure_recording())
+    probes = {
+        device_id(pingu_main.EXT_ADDRESS): flight.temperature,
+        device_id(pingu_main.INT_ADDRESS): flight.internal_temperature,
+    }
+
+    clock.start()
+    with tempfile.TemporaryDirectory() as tmp, FakeW1Tree(clock, probes) as w1:
+        sensors = pingu_main.build_sensors(
+            serial_factory=ports,
+            smbus=smbus,
+            w1_root=w1.root,
+            geiger_port=GEIGER_PORT if GEIGER_PORT in port_streams else None,
+        )
+        bus = SnapshotBus()
+
+        entered = []
+        def enter(name, context):
+            value = context.__enter__()
+            entered.append((name, context))
+            return value
+
+        times = {}
+        try:
+            enter('RunSensor', RunSensor(bus.attach(sensors), backend=backend))
+            radio = enter('RunRadio', RunRadio(pingu_main.RADIO_PORT, serial_factory=ports,
+                                               radio_factory=FakeSatRadio))
+            link = enter('LinkScheduler', LinkScheduler(radio))
+            enter('RunProcesses', RunProcesses(pingu_main.build_processes(
+                bus, link, tmp + os.sep, geiger='geiger' in sensors)))
+            time.sleep(run_time)
+        finally:
+            for name, context in reversed(entered):
+                start = time.monotonic()
+                context.__exit__(None, None, None)
+                times[name] = time.monotonic() - start
+            ports.close()
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--run', type=float, default=3.0, help='seconds to run before stopping')
+    parser.add_argument('--bound', type=float, default=0.2, help='longest acceptable shutdown in s')
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'scenario':<15}{'backend':<11}" + ''.join(f'{s:>15}' for s in STAGES) + f"{'total':>10}")
+    for scenario in SCENARIOS:
+        for backend in ('threads', 'scheduler'):
+            times = shutdown_times(scenario, backend, args.run)
+            total = sum(times.values())
+            slow = times.get('RunProcesses', 0.0) > args.bound or total > args.bound
+            failed = failed or slow
+            print(f'{scenario:<15}{backend:<11}' + ''.join(f'{1000*times[s]:>12.1f} ms' for s in STAGES)
+                  + f'{1000*total:>7.1f} ms' + ('  SLOW' if slow else ''))
+
+    print(f'bound {1000*args.bound:.0f} ms: ' + ('FAILED' if failed else 'ok'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import math
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+from sensors.gps.nmea import parse_gga_dict
+
+
+#-------------------------------------------
+
+def pressure_altitude(pressure, p0=1013.25):
+
+    """Altitude in m of a pressure in mbar in the International Standard
+       Atmosphere, for the troposphere and the isothermal layer above 11 km"""
+
+    if pressure is None or not pressure > 0:
+        return None
+    if pressure > 226.32:
+        return 44330.8*(1 - (pressure/p0)**0.190263)
+    return 11000 + 6341.62*math.log(226.32/pressure)
+
+
+def pressure_altitude_slope(pressure, p0=1013.25):
+
+    """|d altitude/d pressure| in m/mbar at a pressure in mbar"""
+
+    if pressure > 226.32:
+        return 44330.8*0.190263*(pressure/p0)**(0.190263 - 1)/p0
+    return 6341.62/pressure
+
+
+#altitude: m, ascent_rate: m/s, error: 1 sigma of the altitude in m
+AltitudeEstimate = namedtuple('AltitudeEstimate', ['altitude', 'ascent_rate', 'error'])
+
+
+#-------------------------------------------
+
+class AltitudeFilter:
+
+    """Kalman filter for altitude and vertical rate from the barometer and
+       the GPS
+
+       The state is [altitude, vertical rate, barometric bias] with a
+       constant velocity model driven by white acceleration noise. The GPS
+       measures the altitude and the barometer measures the altitude plus a
+       slowly wandering bias, so the smooth pressure altitude carries the
+       estimate between (and through gaps in) the noisy GPS fixes while the
+       GPS pins down the absolute level. The state and covariance are fixed
+       size arrays and each update is a scalar measurement, so every step
+       is constant time.
+
+       INPUTS:
+       accel_sigma: float, m/s^2, process noise of the vertical acceleration
+       bias_sigma: float, m/sqrt(s), random walk of the barometric bias
+       pressure_sigma: float, mbar, noise of a pressure reading
+       gps_sigma: float, m per unit of HDOP, noise of the GPS altitude"""
+
+    def __init__(self, accel_sigma=0.5, bias_sigma=1.0, pressure_sigma=0.025, gps_sigma=7.5):
+
+        self.accel_sigma = accel_sigma
+        self.bias_sigma = bias_sigma
+        self.pressure_sigma = pressure_sigma
+        self.gps_sigma = gps_sigma
+
+        self.x = np.zeros(3)
+        self.P = np.zeros((3, 3))
+        self._F = np.eye(3)
+        self._Q = np.zeros((3, 3))
+        self.time = None
+
+    def __repr__(self):
+        return f'AltitudeFilter(altitude={self.x[0]:.1f}, ascent_rate={self.x[1]:.2f})'
+
+    @property
+    def initialised(self):
+        return self.time is not None
+
+    def _start(self, altitude, variance, timestamp):
+        self.x[:] = (altitude, 0.0, 0.0)
+        self.P[:] = np.diag((variance, 25.0, 500.0**2))
+        self.time = timestamp
+
+    def predict(self, timestamp):
+
+        """Advances the state to timestamp (monotonic seconds)"""
+
+        dt = timestamp - self.time
+        if dt <= 0:
+            return
+        self._F[0, 1] = dt
+        q = self.accel_sigma**2
+        self._Q[0, 0] = q*dt**4/4
+        self._Q[0, 1] = self._Q[1, 0] = q*dt**3/2
+        self._Q[1, 1] = q*dt**2
+        self._Q[2, 2] = self.bias_sigma**2*dt
+
+        self.x = self._F @ self.x
+        self.P = self._F @ self.P @ self._F.T + self._Q
+        self.time = timestamp
+
+    def _correct(self, h, z, variance):
+
+        """Scalar measurement update, z = h.x + noise"""
+
+        Ph = self.P @ h
+        s = h @ Ph + variance
+        gain = Ph/s
+        self.x += gain*(z - h @ self.x)
+        self.P -= np.outer(gain, Ph)
+
+    def update_pressure(self, pressure, timestamp=None):
+
+        """Updates with a pressure reading in mbar"""
+
+        altitude = pressure_altitude(pressure)
+        if altitude is None:
+            return False
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        variance = (self.pressure_sigma*pressure_altitude_slope(pressure))**2
+
+        if not self.initialised:
+            self._start(altitude, variance, timestamp)
+        self.predict(timestamp)
+        self._correct(np.array((1.0, 0.0, 1.0)), altitude, variance)
+        return True
+
+    def update_gps(self, altitude, hdop=None, timestamp=None):
+
+        """Updates with a GPS altitude in m"""
+
+        if altitude is None:
+            return False
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        variance = (self.gps_sigma*max(hdop or 1.0, 1.0))**2
+
+        if not self.initialised:
+            self._start(altitude, variance, timestamp)
+        self.predict(timestamp)
+        self._correct(np.array((1.0, 0.0, 0.0)), altitude, variance)
+        return True
+
+    def estimate(self):
+        if not self.initialised:
+            return None
+        return AltitudeEstimate(float(self.x[0]), float(self.x[1]), float(np.sqrt(self.P[0, 0])))
+
+
+#-------------------------------------------
+
+class AltitudeEstimator:
+
+    """Feeds an AltitudeFilter with the pressure and GPS samples published
+       to a SnapshotBus, and publishes an AltitudeEstimate under its own key
+       after every sample it uses
+
+       INPUTS:
+       key: str, key the estimate is published under
+       pressure_key, gps_key: str, keys of the PressureSensor and GPSSensor
+       filter_kwargs: passed to the AltitudeFilter"""
+
+    def __init__(self, key='altitude', pressure_key='pressure', gps_key='gps', **filter_kwargs):
+
+        self.key = key
+        self.pressure_key = pressure_key
+        self.gps_key = gps_key
+        self.filter = AltitudeFilter(**filter_kwargs)
+        self._lock = threading.Lock()
+        self._bus = None
+
+    def __repr__(self):
+        return f'AltitudeEstimator(key={self.key!r}, {self.filter!r})'
+
+    def attach(self, bus):
+
+        """Subscribes to a SnapshotBus and publishes an empty estimate"""
+
+        self._bus = bus
+        bus.publish(self.key, None)
+        bus.subscribe(self.on_sample)
+        return self
+
+    def on_sample(self, key, value, timestamp):
+
+        """Bus callback, runs in the thread of the publishing sensor"""
+
+        if value is None or key not in (self.pressure_key, self.gps_key):
+            return
+        estimate = self.update(key, value, timestamp)
+        if estimate is not None and self._bus is not None:
+            self._bus.publish(self.key, estimate, timestamp)
+
+    def update(self, key, value, timestamp=None):
+
+        """Passes a sensor value to the filter. Returns the new estimate,
+           or None if the value held no altitude"""
+
+        with self._lock:
+            if key == self.pressure_key:
+                used = self.filter.update_pressure(value[1], timestamp)
+            else:
+                gga = parse_gga_dict(value)
+                used = self.filter.update_gps(gga['altitude'], gga['hdop'], timestamp)
+            return self.filter.estimate() if used else None
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import threading
+import time
+from .data_handling import HandleTelemetry, HandleData, StoreData, TrackProfile, ReportLatency
+from .thread_utils import FixedRate, bind_stop_event, cancel_wait
+from .scheduler import sensor_fileno, sensor_delay, service
+
+
+#-------------------------------------------
+
+async def sleep_until(loop, deadline):
+
+    """Sleeps until an absolute loop.time() deadline"""
+
+    delay = deadline - loop.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+def uses_smbus(sensor):
+
+    """Returns True if the sensor talks to an smbus, whose calls block"""
+
+    return hasattr(sensor, '_bus')
+
+
+def waits_on_w1(sensor):
+
+    """Returns True if the sensor waits for a W1BusManager conversion"""
+
+    return getattr(sensor, 'manager', None) is not None
+
+
+def _service(k, sensor, readable=False):
+    try:
+        return service(sensor, readable)
+    except Exception as exc:
+        logging.info(f'Async Sensor - {k} {type(exc).__name__}')
+        return False
+
+
+#-------------------------------------------
+
+class AsyncRunSensor:
+
+    """Async context manager equivalent to RunSensor
+
+       Serial sensors are read from loop.add_reader callbacks, every other
+       sensor from a periodic coroutine. Only sensors in offload have their
+       reads sent to a worker thread. The sensors are given a stop event,
+       set on teardown, that ends their waits in the worker threads, and
+       teardown waits for those reads before tearing the sensors down. A
+       serial port that fails or reaches EOF has its reader removed, and
+       added again after backoff seconds.
+
+       INPUTS:
+       sensor_dict: dict, a dictionary of sensor objects
+       periods: dict [optional], read period in seconds per sensor key
+       default_period: float, read period for sensors not in periods
+       offload: iterable [optional], sensor keys whose calls block, by
+                default the sensors that use an smbus or a W1BusManager
+       backoff: float, seconds a failed serial port is left before it is
+                read again"""
+
+    def __init__(self, sensor_dict, periods=None, default_period=1, offload=None, backoff=5):
+
+        self._sensor_dict = sensor_dict
+        self._periods = periods if periods else {}
+        self._default_period = default_period
+        if offload is None:
+            offload = [k for k in sensor_dict if uses_smbus(sensor_dict[k]) or waits_on_w1(sensor_dict[k])]
+        self._offload = set(offload)
+        self._backoff = backoff
+
+        self._readers = []
+        #key: TimerHandle of the sensors waiting out a back-off
+        self._resumes = {}
+        self.tasks = []
+        #key: future of the read running in a worker thread
+        self._reads = {}
+        self._stop_event = threading.Event()
+        for sensor in sensor_dict.values():
+            bind_stop_event(sensor, self._stop_event)
+
+    async def __aenter__(self):
+        await self.setup()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.teardown()
+
+    async def setup(self):
+        loop = asyncio.get_running_loop()
+
+        for k, sensor in self._sensor_dict.items():
+            if k in self._offload:
+                await asyncio.to_thread(sensor.setup)
+            else:
+                sensor.setup()
+
+            fd = sensor_fileno(sensor)
+            if fd is None:
+                period = self._periods.get(k, self._default_period)
+                self.tasks.append(asyncio.create_task(self.poll(k, sensor, period)))
+            else:
+                loop.add_reader(fd, self.on_readable, k, sensor, fd)
+                self._readers.append(fd)
+
+    def on_readable(self, k, sensor, fd):
+        if _service(k, sensor, True) is not False:
+            return
+        #a failed port stays readable, stop reading it for a while
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(fd)
+        self._readers.remove(fd)
+        self._resumes[k] = loop.call_later(self._backoff, self.resume, k, sensor)
+
+    def resume(self, k, sensor):
+
+        """Reads a suspended port again, or waits another back-off if it
+           cannot be"""
+
+        loop = asyncio.get_running_loop()
+        fd = sensor_fileno(sensor)
+        try:
+            if fd is None:
+                raise ValueError('no file descriptor')
+            loop.add_reader(fd, self.on_readable, k, sensor, fd)
+            self._readers.append(fd)
+        except (OSError, ValueError) as exc:
+            logging.info(f'Async Sensor - {k} {type(exc).__name__}')
+            self._resumes[k] = loop.call_later(self._backoff, self.resume, k, sensor)
+
+    async def teardown(self):
+        loop = asyncio.get_running_loop()
+        for fd in self._readers:
+            loop.remove_reader(fd)
+        for handle in self._resumes.values():
+            handle.cancel()
+
+        #wake the reads running in worker threads, which cancelling the
+        #tasks waiting on them does not stop
+        self._stop_event.set()
+        for sensor in self._sensor_dict.values():
+            cancel = cancel_wait(sensor)
+            if cancel is not None:
+                cancel()
+        await cancel_tasks(self.tasks)
+        #the threads keep running, a sensor must not be closed mid-read
+        await asyncio.gather(*self._reads.values(), return_exceptions=True)
+
+        for k, sensor in self._sensor_dict.items():
+            if k in self._offload:
+                await asyncio.to_thread(sensor.teardown)
+            else:
+                sensor.teardown()
+
+    async def poll(self, k, sensor, period):
+
+        """Reads a sensor at a fixed period until cancelled, or when its
+           delay says the next reading is ready"""
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            if k in self._offload:
+                #shielded, so that cancelling the task leaves the future
+                #for teardown to wait on
+                self._reads[k] = loop.run_in_executor(None, _service, k, sensor)
+                await asyncio.shield(self._reads[k])
+            else:
+                _service(k, sensor)
+
+            delay = None if k in self._periods else sensor_delay(sensor, time.monotonic())
+            if delay is not None:
+                deadline = loop.time() + delay
+                await sleep_until(loop, deadline)
+                continue
+
+            deadline += period
+            #drop missed deadlines rather than reading in a burst
+            deadline = max(deadline, loop.time())
+            await sleep_until(loop, deadline)
+
+
+#----------------------------------------------------
+
+class AsyncRunProcesses:
+
+    """Async context manager equivalent to RunProcesses
+
+       Each process provides coroutine setup, update and teardown methods
+       and is run as its own task until the context exits"""
+
+    def __init__(self, processes):
+
+        self._processes = processes
+        self.tasks = []
+
+    async def __aenter__(self):
+        await self.setup()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.teardown()
+
+    async def setup(self):
+        self.tasks = [asyncio.create_task(run_process(p)) for p in self._processes]
+
+    async def teardown(self):
+        await cancel_tasks(self.tasks)
+
+
+async def run_process(process):
+
+    """Runs an async process with setup, update and teardown steps, at the
+       rate it declares (from a FixedRate schedule, kept in the process's
+       schedule attribute) or back to back if it has none"""
+
+    rate = getattr(process, 'rate', None)
+    schedule = FixedRate(1/rate) if rate else None
+    process.schedule = schedule
+
+    await process.setup()
+    try:
+        while True:
+            if schedule is not None:
+                await asyncio.sleep(schedule.delay())
+                schedule.start()
+            await process.update()
+
+    finally:
+        await process.teardown()
+
+
+async def cancel_tasks(tasks):
+
+    """Cancels tasks and waits for them to finish"""
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+#----------------------------------------------------
+
+class AsyncHandleTelemetry(HandleTelemetry):
+
+    """HandleTelemetry with coroutine steps, run at its rate by run_process"""
+
+    async def setup(self):
+        super().setup()
+
+    async def teardown(self):
+        super().teardown()
+
+    async def update(self):
+        super().update()
+
+
+class AsyncHandleData(HandleData):
+
+    """HandleData with coroutine steps, run at its rate by run_process"""
+
+    async def setup(self):
+        super().setup()
+
+    async def teardown(self):
+        super().teardown()
+
+    async def update(self):
+        super().update()
+
+
+class AsyncTrackProfile(TrackProfile):
+
+    """TrackProfile with coroutine steps, run at its rate by run_process"""
+
+    async def setup(self):
+        super().setup()
+
+    async def teardown(self):
+        super().teardown()
+
+    async def update(self):
+        super().update()
+
+
+class AsyncStoreData(StoreData):
+
+    """StoreData with coroutine steps, run at its rate by run_process"""
+
+    async def setup(self):
+        super().setup()
+
+    async def teardown(self):
+        super().teardown()
+
+    async def update(self):
+        super().update()
+
+
+class AsyncReportLatency(ReportLatency):
+
+    """ReportLatency with coroutine steps, run at its rate by run_process"""
+
+    async def setup(self):
+        super().setup()
+
+    async def teardown(self):
+        super().teardown()
+
+    async def update(self):
+        super().update()
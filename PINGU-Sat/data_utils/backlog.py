@@ -0,0 +1,242 @@
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+
+#-------------------------------------------
+#Journal layout
+#
+#The backlog is an append-only journal of records. A STORE record holds a
+#sequence number, the wall time the frame was stored and the frame, a SENT
+#record the sequence number of a frame that has been sent or evicted. Each
+#record ends with a CRC32 of the rest. Replaying the journal gives the
+#frames still waiting; a torn record at the end (a power loss during a
+#write) is cut off. The journal is rewritten with only the waiting frames
+#once it has grown well past them, and emptied when nothing is waiting.
+
+RECORD = struct.Struct('<BIdH')
+CRC = struct.Struct('<I')
+
+STORE = 1
+SENT = 2
+
+#largest frame a record holds
+MAX_FRAME = 0xFFFF
+
+
+def pack_record(op, seq, stored_at=0.0, data=b''):
+    record = RECORD.pack(op, seq, stored_at, len(data)) + data
+    return record + CRC.pack(zlib.crc32(record))
+
+
+def unpack_records(data):
+
+    """Yields (op, seq, stored_at, frame, end offset) for every complete
+       record, stopping at the first torn or damaged one"""
+
+    pos = 0
+    while pos + RECORD.size <= len(data):
+        op, seq, stored_at, length = RECORD.unpack_from(data, pos)
+        end = pos + RECORD.size + length + CRC.size
+        if op not in (STORE, SENT) or end > len(data):
+            return
+        crc, = CRC.unpack_from(data, end - CRC.size)
+        if crc != zlib.crc32(data[pos:end - CRC.size]):
+            return
+        yield op, seq, stored_at, data[pos + RECORD.size:end - CRC.size], end
+        pos = end
+
+
+#-------------------------------------------
+
+class PayloadBacklog:
+
+    """Disk-backed store-and-forward queue of payload frames that could not
+       be sent, kept across restarts
+
+       The LinkScheduler stores a payload frame here when sending it fails
+       or when it is pushed out of the full in-memory queue, and drains the
+       backlog when the link has room. A stored frame is fsynced before
+       store returns; a sent frame is only flushed, so after a power loss
+       it may be sent a second time (the packet counter tells them apart).
+       When more than max_bytes of frames are waiting the oldest are
+       evicted.
+
+       INPUTS:
+       filename: str, path of the journal
+       max_bytes: int, bytes of frames kept before the oldest is evicted
+       compact_bytes: int, journal size above which it is rewritten, once
+                      it is more than twice the frames waiting
+       fsync: bool, fsync each stored frame"""
+
+    def __init__(self, filename, max_bytes=4*1024*1024, compact_bytes=1024*1024, fsync=True):
+
+        self._filename = filename
+        self._max_bytes = max_bytes
+        self._compact_bytes = compact_bytes
+        self._fsync = fsync
+
+        self._lock = threading.Lock()
+        #seq: (stored_at, frame), in the order stored
+        self._frames = {}
+        self._bytes = 0
+        self._seq = 0
+        self._file = None
+        self._journal_bytes = 0
+
+        self.stored = 0
+        self.sent = 0
+        self.evicted = 0
+        self.recovered = 0
+
+        self._load()
+
+    def __repr__(self):
+        return f'PayloadBacklog({self._filename}, frames={len(self._frames)})'
+
+    def __len__(self):
+        return len(self._frames)
+
+    def _load(self):
+
+        """Replays the journal left by a previous run and opens it for
+           appending"""
+
+        try:
+            with open(self._filename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+
+        end = 0
+        for op, seq, stored_at, frame, end in unpack_records(data):
+            if op == STORE:
+                self._frames[seq] = (stored_at, frame)
+                self._bytes += len(frame)
+            elif seq in self._frames:
+                self._bytes -= len(self._frames.pop(seq)[1])
+            self._seq = max(self._seq, seq)
+
+        if end < len(data):
+            logging.info(f'Payload Backlog - {len(data) - end} torn bytes cut from the journal')
+        self.recovered = len(self._frames)
+        if self.recovered:
+            logging.info(f'Payload Backlog - {self.recovered} frames recovered')
+
+        self._file = open(self._filename, 'ab')
+        self._file.truncate(end)
+        self._journal_bytes = end
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    #---------------------------------------
+
+    def store(self, frame):
+
+        """Stores a frame that could not be sent, evicting the oldest frames
+           if the backlog is full"""
+
+        if isinstance(frame, str):
+            frame = frame.encode()
+        if len(frame) > MAX_FRAME:
+            raise ValueError(f'{len(frame)} byte frame does not fit the backlog')
+
+        with self._lock:
+            self._seq += 1
+            stored_at = time.time()
+            self._append(pack_record(STORE, self._seq, stored_at, frame))
+            self._frames[self._seq] = (stored_at, frame)
+            self._bytes += len(frame)
+            self.stored += 1
+
+            while self._bytes > self._max_bytes and len(self._frames) > 1:
+                seq = next(iter(self._frames))
+                self._remove(seq)
+                self.evicted += 1
+
+            if self._fsync:
+                os.fsync(self._file.fileno())
+
+    def peek(self, order='newest'):
+
+        """The next frame to send, newest or oldest first, as (seq,
+           stored_at, frame), or None if the backlog is empty"""
+
+        with self._lock:
+            if not self._frames:
+                return None
+            seq = next(reversed(self._frames)) if order == 'newest' else next(iter(self._frames))
+            stored_at, frame = self._frames[seq]
+            return seq, stored_at, frame
+
+    def ack(self, seq):
+
+        """Removes a frame once it has been sent"""
+
+        with self._lock:
+            if seq not in self._frames:
+                return
+            self._remove(seq)
+            self.sent += 1
+            self._compact()
+
+    #---------------------------------------
+
+    def _append(self, record):
+        self._file.write(record)
+        self._file.flush()
+        self._journal_bytes += len(record)
+
+    def _remove(self, seq):
+        self._bytes -= len(self._frames.pop(seq)[1])
+        self._append(pack_record(SENT, seq))
+
+    def _compact(self):
+
+        """Empties the journal when nothing is waiting, or rewrites it with
+           only the waiting frames once it has grown well past them"""
+
+        if not self._frames:
+            self._file.truncate(0)
+            self._journal_bytes = 0
+            return
+        if self._journal_bytes < self._compact_bytes or self._journal_bytes < 2*self._bytes:
+            return
+
+        tmp = f'{self._filename}.tmp'
+        with open(tmp, 'wb') as f:
+            for seq, (stored_at, frame) in self._frames.items():
+                f.write(pack_record(STORE, seq, stored_at, frame))
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp, self._filename)
+        self._file = open(self._filename, 'ab')
+        self._journal_bytes = self._file.tell()
+
+    def summary(self):
+
+        """Frames and bytes waiting, the age in s of the oldest and newest,
+           and the frames stored, sent and evicted so far"""
+
+        with self._lock:
+            now = time.time()
+            times = [stored_at for stored_at, _ in self._frames.values()]
+            return {
+                'frames': len(self._frames),
+                'bytes': self._bytes,
+                'oldest_age': now - min(times) if times else None,
+                'newest_age': now - max(times) if times else None,
+                'stored': self.stored,
+                'sent': self.sent,
+                'evicted': self.evicted,
+                'recovered': self.recovered,
+                'journal_bytes': self._journal_bytes,
+            }
@@ -0,0 +1,299 @@
+import logging
+import math
+import os
+import struct
+import time
+import zlib
+import numpy as np
+from .thread_utils import OutputFile
+from sensors.gps.nmea import parse_nmea
+
+
+#-------------------------------------------
+#Record and block layout
+#
+#A log is a sequence of fixed-size blocks. Each block has a header
+#(magic, records per block, number of valid records, CRC32 of the record
+#area) followed by records_per_block fixed-size records, zero padded if
+#the block was closed early. Missing floats are stored as NaN and missing
+#integers as -1.
+
+MAGIC = b'PNG1'
+
+HEADER = struct.Struct('<4sHHI')
+
+RECORD = struct.Struct('<dffffiddffBBii')
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('t_external', '<f4'),
+    ('t_internal', '<f4'),
+    ('ms5611_temp', '<f4'),
+    ('pressure', '<f4'),
+    ('gps_time', '<i4'),
+    ('latitude', '<f8'),
+    ('longitude', '<f8'),
+    ('altitude', '<f4'),
+    ('hdop', '<f4'),
+    ('fix_quality', 'u1'),
+    ('satellites', 'u1'),
+    ('cps', '<i4'),
+    ('counts', '<i4'),
+])
+
+assert RECORD_DTYPE.itemsize == RECORD.size
+
+
+def block_dtype(records_per_block):
+
+    """Returns the NumPy dtype of a whole block"""
+
+    return np.dtype([
+        ('magic', 'S4'),
+        ('records_per_block', '<u2'),
+        ('count', '<u2'),
+        ('crc', '<u4'),
+        ('records', RECORD_DTYPE, (records_per_block,)),
+    ])
+
+
+#-------------------------------------------
+
+def _float(value):
+    return math.nan if value is None else value
+
+
+def _int(value):
+    return -1 if value is None else value
+
+
+def _pair(value):
+    if value is None:
+        return (None, None)
+    return value
+
+
+def seconds_of_day(t):
+
+    """Converts a datetime.time to seconds since midnight"""
+
+    if t is None:
+        return -1
+    return t.hour*3600 + t.minute*60 + t.second
+
+
+def pack_record(sensor_dict, timestamp=None):
+
+    """Packs a dictionary of sensor data into a binary record"""
+
+    if timestamp is None:
+        timestamp = time.time()
+
+    fix = parse_nmea(sensor_dict['gps'])
+    gps = fix.gga_dict() if fix is not None and fix.sentence_id == 'GGA' else {}
+
+    ms5611_temp, pressure = _pair(sensor_dict['pressure'])
+    cps, counts = _pair(sensor_dict.get('geiger'))[:2]
+
+    return RECORD.pack(
+        timestamp,
+        _float(sensor_dict['t_external']),
+        _float(sensor_dict['t_internal']),
+        _float(ms5611_temp),
+        _float(pressure),
+        seconds_of_day(gps.get('timestamp')),
+        _float(gps.get('latitude')),
+        _float(gps.get('longitude')),
+        _float(gps.get('altitude')),
+        _float(gps.get('hdop')),
+        fix.fix_quality or 0 if gps else 0,
+        fix.satellites or 0 if gps else 0,
+        _int(cps),
+        _int(counts),
+    )
+
+
+#-------------------------------------------
+
+class BinaryLog:
+
+    """Writes sensor records to a binary log in fixed-size, CRC checked
+       blocks. Blocks are handed to a thread-safe OutputFile as they fill,
+       or zero padded once their oldest record is flush_interval s old, and
+       each block is flushed and fsynced as it is written. A power loss
+       drops at most the flush_interval s of records in the open block
+       (the bound is checked as each record is added), at the cost of a
+       padded block for every flush_interval s of records that do not fill
+       one.
+
+       INPUTS:
+       filename: str, path of the log
+       records_per_block: int, records written per block and CRC
+       flush_interval: float [optional], s a partial block is held before
+                       it is written, None to only write full blocks"""
+
+    def __init__(self, filename, records_per_block=32, flush_interval=10):
+
+        self._filename = filename
+        self._records_per_block = records_per_block
+        self._flush_interval = flush_interval
+        self._block = bytearray()
+        self._count = 0
+        #monotonic time the first record of the block was added
+        self._opened = None
+        self._file = OutputFile(filename, mode='wb', buffering=-1, group_commit=True, fsync_every=1)
+
+    def __repr__(self):
+        return f'BinaryLog({self._filename}, records_per_block={self._records_per_block})'
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def open(self):
+        self._file.open()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def write_record(self, sensor_dict, timestamp=None):
+
+        """Adds a record for a dictionary of sensor data, writing the block
+           once it is full or has been held for flush_interval s"""
+
+        now = time.monotonic()
+        if not self._count:
+            self._opened = now
+        self._block += pack_record(sensor_dict, timestamp)
+        self._count += 1
+        if self._count == self._records_per_block:
+            self.flush()
+        elif self._flush_interval is not None and now - self._opened >= self._flush_interval:
+            self.flush()
+
+    def flush(self):
+
+        """Writes the current block, zero padded if it is not full"""
+
+        if not self._count:
+            return
+        self._block += bytes(RECORD.size*(self._records_per_block - self._count))
+        header = HEADER.pack(MAGIC, self._records_per_block, self._count, zlib.crc32(self._block))
+        self._file.write(header + bytes(self._block))
+        self._block = bytearray()
+        self._count = 0
+
+
+#-------------------------------------------
+
+def read_binary_log(filename, check_crc=True):
+
+    """Memory-maps a binary log and returns its records as a NumPy
+       structured array with RECORD_DTYPE. Blocks with a bad magic or CRC
+       and any truncated block at the end of the file are skipped"""
+
+    size = os.path.getsize(filename)
+    if size < HEADER.size:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+
+    with open(filename, 'rb') as f:
+        _, records_per_block, _, _ = HEADER.unpack(f.read(HEADER.size))
+
+    dtype = block_dtype(records_per_block)
+    n_blocks = size//dtype.itemsize
+    if n_blocks == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    blocks = np.memmap(filename, dtype=dtype, mode='r', shape=(n_blocks,))
+
+    good = blocks['magic'] == MAGIC
+    if check_crc:
+        raw = blocks.view(np.uint8).reshape(n_blocks, dtype.itemsize)[:, HEADER.size:]
+        crcs = np.array([zlib.crc32(row) for row in raw], dtype=np.uint32)
+        good &= crcs == blocks['crc']
+
+    if not good.all():
+        logging.info(f'Binary Log - {np.count_nonzero(~good)} bad blocks in {filename}')
+
+    valid = np.arange(records_per_block) < blocks['count'][:, None]
+    return blocks['records'][good][valid[good]]
+
+
+#-------------------------------------------
+
+def nmea_checksum(body):
+
+    """XOR checksum of the characters between $ and *"""
+
+    checksum = 0
+    for c in body.encode('ascii'):
+        checksum ^= c
+    return f'{checksum:02X}'
+
+
+def ddmm(degrees, width):
+
+    """Converts decimal degrees to the NMEA ddmm.mmmmm format"""
+
+    degrees = abs(degrees)
+    whole = int(degrees)
+    return f'{whole:0{width}d}{(degrees - whole)*60:08.5f}'
+
+
+def gga_from_record(record):
+
+    """Rebuilds a GGA sentence from a binary record, or returns None if the
+       record has no GPS data"""
+
+    if record['gps_time'] < 0 and np.isnan(record['latitude']):
+        return None
+
+    secs = int(record['gps_time'])
+    hhmmss = f'{secs//3600:02d}{secs//60%60:02d}{secs%60:02d}' if secs >= 0 else ''
+
+    lat, lon = float(record['latitude']), float(record['longitude'])
+    lat_str = '' if math.isnan(lat) else ddmm(lat, 2)
+    lon_str = '' if math.isnan(lon) else ddmm(lon, 3)
+    ns = '' if math.isnan(lat) else ('S' if lat < 0 else 'N')
+    ew = '' if math.isnan(lon) else ('W' if lon < 0 else 'E')
+
+    alt, hdop = float(record['altitude']), float(record['hdop'])
+    body = ','.join([
+        'GPGGA', hhmmss, lat_str, ns, lon_str, ew,
+        str(record['fix_quality']), f'{record["satellites"]:02d}',
+        '' if math.isnan(hdop) else f'{hdop:.1f}',
+        '' if math.isnan(alt) else f'{alt:.1f}', 'M', '', 'M', '', ''
+    ])
+    return f'${body}*{nmea_checksum(body)}'
+
+
+def _text(value, digits):
+    value = float(value)
+    return None if math.isnan(value) else round(value, digits)
+
+
+def env_line_from_record(record):
+
+    """Rebuilds a line of the _enviroment.txt layout from a binary record"""
+
+    pressure = (_text(record['ms5611_temp'], 2), _text(record['pressure'], 2))
+    data = [str(_text(record['t_external'], 3)), str(_text(record['t_internal'], 3)), str(pressure)]
+    return f"{float(record['timestamp']): .6f},{','.join(data)}"
+
+
+def convert_to_text(filename, env_filename, gps_filename):
+
+    """Converts a binary log to the _enviroment.txt and _gps.txt layouts
+       written by StoreData"""
+
+    records = read_binary_log(filename)
+    with open(env_filename, 'w') as env_file, open(gps_filename, 'w') as gps_file:
+        for record in records:
+            env_file.write(env_line_from_record(record) + '\n')
+            gga = gga_from_record(record)
+            gps_file.write(('No GPS' if gga is None else gga) + '\n')
+    return len(records)
@@ -1,6 +1,9 @@
 from threading import Event
 from .thread_utils import OutputFile
-from sensors.gps.gps_utils import parse_gga
+from .snapshot import SnapshotBus, Frame, Sample
+from .latency import wall_time, epoch_time
+from .binary_log import BinaryLog
+from sensors.gps.nmea import parse_gga_dict
 from datetime import datetime as dt
 import time
 import logging
@@ -11,25 +14,58 @@ import logging
     
 def generate_data_dict(sensors): 
     
-    """Creates a dictionary of sensor data from a dictionary of sensors"""
+    """Creates a dictionary of sensor data from a dictionary of sensors,
+       or takes the latest consistent frame from a SnapshotBus"""
     
+    if isinstance(sensors, SnapshotBus):
+        return sensors.frame().data
+
     return {k:sensors[k].data for k in sensors}
 
 
+def read_frame(sensors):
+
+    """Returns the latest Frame from a SnapshotBus, or a Frame of the
+       current values of a dictionary of sensors stamped with the read time,
+       as their acquisition time is not known"""
+
+    if isinstance(sensors, SnapshotBus):
+        return sensors.frame()
+
+    now = time.monotonic()
+    return Frame(0, now, {k: Sample(sensors[k].data, now, 0) for k in sensors})
+
+
+def acquisition_time(frame, key):
+
+    """Monotonic time the sample of a key was read, or that of the newest
+       sample in the frame if the key has no value"""
+
+    sample = frame.samples.get(key)
+    if sample is None or sample.value is None:
+        return frame.timestamp
+    return sample.timestamp
+
+
 
-def generate_telem_dict(data_dict): 
+def generate_telem_dict(data_dict, timestamp=None): 
     
-    """Creates a dictionary of data to be sent as telemetry"""
+    """Creates a dictionary of data to be sent as telemetry. hhmmss is the
+       time the data was read, given as a monotonic timestamp, or the
+       current time if it is not given"""
     
     
-    gps_dict = parse_gga(data_dict['gps'])
+    gps_dict = parse_gga_dict(data_dict['gps'])
+    #the fused barometric/GPS altitude when an AltitudeEstimator is running
+    estimate = data_dict.get('altitude')
+    alt = estimate.altitude if estimate is not None else gps_dict['altitude']
 
     telem_dict = {
-        'hhmmss':dt.now(),
+        'hhmmss':wall_time(timestamp) if timestamp is not None else dt.now(),
         'lat_dec_deg':gps_dict['latitude'],
         'lon_dec_deg':gps_dict['longitude'],
         'lat_dil':gps_dict['hdop'],
-        'alt':gps_dict['altitude'],
+        'alt':alt,
         'temp1':data_dict['t_internal'],
         'temp2':data_dict['t_external'],
         'pressure':data_dict['pressure'][1]
@@ -42,8 +78,8 @@ def generate_telem_dict(data_dict):
 
 
 
-def generate_payload_dict(data_dict):
-    gps_dict = parse_gga(data_dict['gps'])
+def generate_payload_dict(data_dict, profile=None):
+    gps_dict = parse_gga_dict(data_dict['gps'])
 
     payload_dict = {
         'pressure':data_dict['pressure'][1],
@@ -51,6 +87,16 @@ def generate_payload_dict(data_dict):
         'alt': gps_dict['altitude'],
     }
 
+    #dead-time corrected 60 s count rate of the Geiger counter, if flown
+    if data_dict.get('geiger') is not None:
+        payload_dict['cps_60s'] = data_dict['geiger'].rate_60s
+        payload_dict['cps_60s_err'] = data_dict['geiger'].error_60s
+
+    #current estimate of the Pfotzer maximum from a PfotzerProfile
+    if profile is not None:
+        payload_dict['pfotzer_alt'] = profile.peak_altitude
+        payload_dict['pfotzer_cps'] = profile.peak_rate
+
     return payload_dict
 
 def format_payload_data(payload_dict):
@@ -58,7 +104,11 @@ def format_payload_data(payload_dict):
     formats = {
         'pressure':'09.04f',
         't_external': '+08.03f',
-        'alt': '08.02f'
+        'alt': '08.02f',
+        'cps_60s': '07.03f',
+        'cps_60s_err': '06.03f',
+        'pfotzer_alt': '07.0f',
+        'pfotzer_cps': '07.03f'
     }
     return ','.join([format(payload_dict[k],formats[k]) if payload_dict[k] != None else ' ' for k in payload_dict])
 
@@ -77,12 +127,19 @@ class HandleTelemetry:
        
        INPUTS: 
        sensors: dict, a dictionary of sensor objects
-       radio: object, a tuppersat radio object """
-    def __init__(self, sensors, radio): 
+       radio: object, a tuppersat radio object 
+       pause: float, seconds between telemetry packets, the process is
+              run at a fixed rate of one packet per pause
+       latency: object [optional], a LatencyTracker that the age of the
+                data in each packet is recorded in"""
+    def __init__(self, sensors, radio, pause = 20, latency = None): 
 
         self._sensors = sensors
         self._radio = radio
         self._data = None
+        self._frame = None
+        self.pause = pause
+        self.latency = latency
 
 
     def setup(self):
@@ -92,30 +149,63 @@ class HandleTelemetry:
         pass
 
     def read(self): 
-        self._data = generate_data_dict(self._sensors)
+        self._frame = read_frame(self._sensors)
+        self._data = self._frame.data
+
+    @property
+    def rate(self):
+        return 1/self.pause if self.pause else None
 
     def update(self):
+        self.send()
+
+    def send(self):
+        """Reads the sensors and sends a telemetry packet"""
         self.read()
-        telemetry_dict = generate_telem_dict(self._data)
+        #stamped with the time of the GPS fix it reports
+        telemetry_dict = generate_telem_dict(self._data, acquisition_time(self._frame, 'gps'))
         print(telemetry_dict)
         self._radio.send_telemetry_packet(telemetry_dict)
+        if self.latency is not None:
+            self.latency.record_frame('telemetry', self._frame)
         print("Telemetry Package sent")
         logging.info("Telemetry Packet Sent")
-        time.sleep(20)
 
 
 #-------------------------------------------------
 
 class HandleData:
 
-    """Class to handle the compiling and transmission of payload data"""
+    """Class to handle the compiling and transmission of payload data
 
-    def __init__(self, sensors, radio): 
+       INPUTS: 
+       sensors: dict, a dictionary of sensor objects
+       radio: object, a tuppersat radio object 
+       pause: float, seconds between the samples in a packet, the process
+              is run at a fixed rate of one sample per pause
+       codec: object [optional], a PayloadCodec used to pack the samples
+              into a binary packet instead of fixed-width text
+       samples_per_packet: int, number of samples in each packet
+       profile: object [optional], a PfotzerProfile whose maximum is added
+                to each sample
+       latency: object [optional], a LatencyTracker that the age of each
+                sample is recorded in when its packet is sent"""
+
+    def __init__(self, sensors, radio, pause = 10, codec = None, samples_per_packet = 2,
+                 profile = None, latency = None): 
 
         self.index = 0
         self._sensors = sensors
         self._radio = radio
         self._data = None
+        self.pause = pause
+        self.codec = codec
+        self.samples_per_packet = samples_per_packet
+        self.profile = profile
+        self.latency = latency
+        self._frame = None
+        self._frames = []
+        self._samples = []
 
 
     def setup(self):
@@ -125,76 +215,232 @@ class HandleData:
         pass   
 
     def read(self): 
-        self._data = generate_data_dict(self._sensors)
+        self._frame = read_frame(self._sensors)
+        self._data = self._frame.data
+
+    @property
+    def rate(self):
+        return 1/self.pause if self.pause else None
 
     def update(self):
-        data_packet = self.generate_payload_string()
+        """Takes one sample, and sends the packet once it is full"""
+        self._samples.append(self.sample())
+        if len(self._samples) >= self.samples_per_packet:
+            self.send(self.pack(self._samples))
+            self._samples = []
+
+    def send(self, data_packet):
+        """Sends a payload packet and advances the packet counter"""
         self._radio.send_data(data_packet)
         self.index+=1
+        if self.latency is not None:
+            now = time.monotonic()
+            for frame in self._frames:
+                self.latency.record_frame('payload', frame, now)
+        self._frames = []
         print("Payload Package sent")
         logging.info("Payload Package Sent")
 
-       
-    def generate_payload_string(self):
-
-        """Generates a byte string from compiled payload data"""
-
-        data_list =[]
-        #two sets of data
-        while len(data_list) < 2:
-            self.read()
-            payload_dict = generate_payload_dict(self._data)
-            data_list.append(format_payload_data(payload_dict))
-            time.sleep(10) 
+    def sample(self):
+        """Reads the sensors and returns one formatted payload sample, or
+           with a codec a timestamped payload dictionary"""
+        self.read()
+        self._frames.append(self._frame)
+        payload_dict = generate_payload_dict(self._data, self.profile)
+        if self.codec:
+            payload_dict['time'] = epoch_time(self._frame.timestamp)
+            return payload_dict
+        return format_payload_data(payload_dict)
+
+    def pack(self, data_list):
+        """Joins the packet counter and payload samples into a byte string"""
+        if self.codec:
+            return self.codec.encode(self.index, data_list)
         return ';'.join([counter(self.index),*data_list]).encode()
             
 
 
 
+#-------------------------------------------------
+
+class TrackProfile:
+
+    """Class to build the count rate against altitude profile on board
+
+       INPUTS:
+       sensors: dict, a dictionary of sensor objects, or a SnapshotBus
+       profile: object, a PfotzerProfile
+       pause: float, seconds between reads. Each Geiger reading is added
+              once, however often it is read"""
+
+    def __init__(self, sensors, profile, pause = 1):
+
+        self._sensors = sensors
+        self.profile = profile
+        self.pause = pause
+        self._data = None
+        self._reading = None
+
+    def setup(self):
+        pass
+
+    def teardown(self):
+        if self.profile.peak_altitude is not None:
+            logging.info(f'Pfotzer maximum - {self.profile.summary()}')
+
+    def read(self):
+        self._data = generate_data_dict(self._sensors)
+
+    @property
+    def rate(self):
+        return 1/self.pause if self.pause else None
+
+    def update(self):
+        self.track()
+
+    def track(self):
+        """Adds the latest Geiger reading to the profile if it is new"""
+        self.read()
+        reading = self._data.get('geiger')
+        if reading is None or reading is self._reading:
+            return
+        self._reading = reading
+        self.profile.update(self._data)
+
+
+#-------------------------------------------------
+
+class ReportLatency:
+
+    """Class to summarise the sample ages recorded by the sinks in the log
+
+       INPUTS:
+       latency: object, the LatencyTracker given to the sinks
+       pause: float, seconds between summaries
+       dump_file: str [optional], file the histograms are appended to at
+                  shutdown"""
+
+    def __init__(self, latency, pause = 300, dump_file = None):
+
+        self.latency = latency
+        self.pause = pause
+        self.dump_file = dump_file
+
+    def setup(self):
+        pass
+
+    def teardown(self):
+        self.report()
+        if self.dump_file is not None:
+            self.latency.dump(self.dump_file)
+
+    @property
+    def rate(self):
+        return 1/self.pause if self.pause else None
+
+    def update(self):
+        self.report()
+
+    def report(self):
+        self.latency.log_summary()
+
+
 #-------------------------------------------------
 
 class StoreData:
 
     """Class to store sensor data by writing it to a file using
-       the thread-safe OutputFile method""" 
-
-    def __init__(self, sensors, dir, pause = 1): 
+       the thread-safe OutputFile method
+
+       INPUTS:
+       sensors: dict, a dictionary of sensor objects, or a SnapshotBus
+       dir: str, directory the files are written to
+       pause: float, seconds between records, the process is run at a
+              fixed rate of one record per pause
+       log_format: str, 'text' writes the _enviroment.txt and _gps.txt
+                   files, 'binary' writes a single _flight.bin BinaryLog
+       file_options: dict [optional], passed to each text OutputFile, e.g.
+                     group_commit, fsync_every, maxsize, overflow
+       file_factory: class used for the text files, OutputFile or another
+                     class with the same interface such as RingLogFile or
+                     RotatingFile
+       latency: object [optional], a LatencyTracker that the age of each
+                record is recorded in once it is written""" 
+
+    def __init__(self, sensors, dir, pause = 1, log_format = 'text', file_options = None,
+                 file_factory = OutputFile, latency = None): 
 
         """Initialiser"""
 
+        if log_format not in ('text', 'binary'):
+            raise ValueError(f'Unknown log format: {log_format}')
+
         self.gps_file = None
         self.env_file = None
         self.geiger_file = None
+        self.binary_file = None
+        self.log_format = log_format
+        self.file_options = file_options if file_options else {}
+        self.file_factory = file_factory
         self.data = None
         self._sensors = sensors
         self._dir = dir
         self.pause = pause
+        self.latency = latency
+        self._frame = None
 
     def setup(self): 
 
         """Setup step which creates output files for data storage"""
-        self.env_file = OutputFile(f'{self._dir}{dt.now():%Y-%m-%d-%H-%M-%S}_enviroment.txt')
-        self.gps_file = OutputFile(f'{self._dir}{dt.now():%Y-%m-%d-%H-%M-%S}_gps.txt')
+        if self.log_format == 'binary':
+            self.binary_file = BinaryLog(f'{self._dir}{dt.now():%Y-%m-%d-%H-%M-%S}_flight.bin')
+            self.binary_file.open()
+            return
+
+        self.env_file = self.file_factory(f'{self._dir}{dt.now():%Y-%m-%d-%H-%M-%S}_enviroment.txt', **self.file_options)
+        self.gps_file = self.file_factory(f'{self._dir}{dt.now():%Y-%m-%d-%H-%M-%S}_gps.txt', **self.file_options)
         self.env_file.open()
         self.gps_file.open()
 
 
     def teardown(self): 
         """Teardown step which closes any open files"""
+        if self.log_format == 'binary':
+            self.binary_file.close()
+            return
+
         self.env_file.close()
         self.gps_file.close()
 
     
     def read(self): 
-        """Assigns a dictionary of payload data to the sensor attribute"""
-        self._data = generate_data_dict(self._sensors)
+        """Assigns the latest frame of sensor data to the data attribute.
+           It does not wait for new data, so a record is written at every
+           tick of the fixed rate"""
+        self._frame = read_frame(self._sensors)
+        self._data = self._frame.data
+
+    @property
+    def rate(self):
+        return 1/self.pause if self.pause else None
 
     def update(self):
         """Updates the class data attribute and writes contents to a file"""        
+        self.store()
+
+    def store(self):
+        """Reads the sensors and writes one record to each file"""
         self.read()
-        write_gps_data(self._data,  self.gps_file)
-        write_enviroment_data(self._data,  self.env_file)
-        time.sleep(self.pause)
+        #records are stamped with the time the newest value was read
+        timestamp = epoch_time(self._frame.timestamp)
+        if self.log_format == 'binary':
+            self.binary_file.write_record(self._data, timestamp)
+        else:
+            write_gps_data(self._data,  self.gps_file)
+            write_enviroment_data(self._data,  self.env_file, timestamp)
+
+        if self.latency is not None:
+            self.latency.record_frame('store', self._frame)
 
 
 #-----------------------------------------------------
@@ -209,9 +455,10 @@ def write_gps_data(sensor_dict, file):
     
         
 
-def write_enviroment_data(sensor_dict, file):
+def write_enviroment_data(sensor_dict, file, timestamp=None):
 
-    """Compliles enviromental sensor data and writes to a file"""
+    """Compliles enviromental sensor data and writes to a file, stamped
+       with timestamp (s since the epoch) or the current time"""
 
     env_sensors = [
         sensor_dict['t_external'],
@@ -219,6 +466,7 @@ def write_enviroment_data(sensor_dict, file):
         sensor_dict['pressure']
     ]
     data= [str(sensor) for sensor in env_sensors] 
-    data_str = f"{time.time(): .6f},{','.join(data)}"
+    timestamp = time.time() if timestamp is None else timestamp
+    data_str = f"{timestamp: .6f},{','.join(data)}"
     file.writeline(data_str)
      
@@ -0,0 +1,253 @@
+import array
+import logging
+import threading
+import time
+from datetime import datetime as dt, timedelta
+
+
+#-------------------------------------------
+
+def wall_time(timestamp):
+
+    """datetime of a monotonic timestamp, e.g. the acquisition time of a
+       Sample on the SnapshotBus"""
+
+    return dt.now() - timedelta(seconds=time.monotonic() - timestamp)
+
+
+def epoch_time(timestamp):
+
+    """Seconds since the epoch of a monotonic timestamp, or the current
+       time if it is None"""
+
+    if timestamp is None:
+        return time.time()
+    return time.time() - (time.monotonic() - timestamp)
+
+
+#-------------------------------------------
+
+class LatencyHistogram:
+
+    """HDR-style histogram of latencies with fixed relative resolution
+
+       Latencies are counted in integer units (microseconds by default) in
+       preallocated log-linear buckets: values below sub_buckets have a
+       bucket each and every power of two above is split into sub_buckets/2
+       buckets, so any value is held to within 2/sub_buckets of itself
+       (1.6% for 128) from microseconds up to highest, in a few thousand
+       counters. Recording is constant time and never allocates.
+
+       INPUTS:
+       highest: float, s, largest latency tracked. Larger ones are counted
+                in the top bucket
+       unit: float, s per count of the integer scale
+       sub_buckets: int, power of two, buckets per power of two"""
+
+    def __init__(self, highest=3600.0, unit=1e-6, sub_buckets=128):
+
+        if sub_buckets < 2 or sub_buckets & (sub_buckets - 1):
+            raise ValueError(f'sub_buckets must be a power of two: {sub_buckets}')
+
+        self.unit = unit
+        self.sub_buckets = sub_buckets
+        self._sub_bits = sub_buckets.bit_length() - 1
+        self._half = sub_buckets//2
+        self.highest = int(highest/unit)
+        self.counts = array.array('q', bytes(8*(self._index(self.highest) + 1)))
+
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.overflow = 0
+
+    def __repr__(self):
+        return f'LatencyHistogram(count={self.count}, buckets={len(self.counts)})'
+
+    def _index(self, value):
+        if value < self.sub_buckets:
+            return value
+        shift = value.bit_length() - self._sub_bits
+        return self.sub_buckets + (shift - 1)*self._half + (value >> shift) - self._half
+
+    def _upper(self, index):
+
+        """Largest value in a bucket, in units"""
+
+        if index < self.sub_buckets:
+            return index
+        shift, top = divmod(index - self.sub_buckets, self._half)
+        shift += 1
+        return ((top + self._half + 1) << shift) - 1
+
+    def record(self, latency):
+
+        """Counts a latency in s. Negative latencies count as 0"""
+
+        value = max(int(latency/self.unit), 0)
+        if value > self.highest:
+            self.overflow += 1
+            value = self.highest
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.overflow += other.overflow
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = self.total = self.overflow = 0
+        self.min = self.max = None
+
+    #---------------------------------------
+
+    def percentile(self, p):
+
+        """Latency in s that p percent of the recorded latencies are at or
+           below, to the resolution of the buckets. None if empty"""
+
+        if not self.count:
+            return None
+        target = max(1, -(-self.count*p//100))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self._upper(i), self.max)*self.unit
+        return self.max*self.unit
+
+    def summary(self, percentiles=(50, 90, 99)):
+
+        """Count, mean, min, max and percentiles in s"""
+
+        if not self.count:
+            return {'count': 0}
+        summary = {
+            'count': self.count,
+            'mean': self.total/self.count*self.unit,
+            'min': self.min*self.unit,
+            'max': self.max*self.unit,
+        }
+        for p in percentiles:
+            summary[f'p{p:g}'] = self.percentile(p)
+        return summary
+
+    def distribution(self):
+
+        """Rows of (latency in s, percentile, total count) for every
+           non-empty bucket, as in an HdrHistogram percentile dump"""
+
+        rows = []
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n:
+                seen += n
+                rows.append((min(self._upper(i), self.max)*self.unit, 100*seen/self.count, seen))
+        return rows
+
+
+#-------------------------------------------
+
+class LatencyTracker:
+
+    """One LatencyHistogram per sink and sensor key, recording the age of
+       each sample when a sink emits it
+
+       The sinks (StoreData, HandleData and HandleTelemetry) record the time
+       from the acquisition of each sample in the frame they emit to the
+       write or radio hand-off. summary and log_summary report the
+       percentiles, dump writes every histogram.
+
+       INPUTS:
+       histogram_kwargs: passed to each LatencyHistogram"""
+
+    def __init__(self, **histogram_kwargs):
+
+        self.histogram_kwargs = histogram_kwargs
+        self.histograms = {}
+        self.started = time.monotonic()
+        #re-entrant, dump can be called from a signal handler
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f'LatencyTracker(histograms={len(self.histograms)})'
+
+    def histogram(self, sink, key):
+        with self._lock:
+            if (sink, key) not in self.histograms:
+                self.histograms[(sink, key)] = LatencyHistogram(**self.histogram_kwargs)
+            return self.histograms[(sink, key)]
+
+    def record(self, sink, key, latency):
+        with self._lock:
+            self.histogram(sink, key).record(latency)
+
+    def record_frame(self, sink, frame, now=None):
+
+        """Records the age of every sample in a Frame. Samples without a
+           value are skipped"""
+
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            for key, sample in frame.samples.items():
+                if sample.value is not None and sample.timestamp is not None:
+                    self.histogram(sink, key).record(now - sample.timestamp)
+
+    def summary(self):
+
+        """{sink: {key: histogram summary}}"""
+
+        with self._lock:
+            summary = {}
+            for (sink, key), histogram in sorted(self.histograms.items()):
+                summary.setdefault(sink, {})[key] = histogram.summary()
+            return summary
+
+    def log_summary(self):
+
+        """Logs one line per sink and key with the age percentiles in ms"""
+
+        for sink, keys in self.summary().items():
+            for key, s in keys.items():
+                if s['count']:
+                    logging.info(f"Latency - {sink} {key} n={s['count']} p50={s['p50']*1000:.1f}ms "
+                                 f"p99={s['p99']*1000:.1f}ms max={s['max']*1000:.1f}ms")
+
+    def dump(self, file):
+
+        """Writes the percentile distribution of every histogram to a file
+           object or a path"""
+
+        if isinstance(file, str):
+            with open(file, 'a') as f:
+                return self.dump(f)
+
+        with self._lock:
+            file.write(f'# latency histograms at {dt.now():%Y-%m-%d %H:%M:%S}, '
+                       f'{time.monotonic() - self.started:.0f} s after start\n')
+            for (sink, key), histogram in sorted(self.histograms.items()):
+                file.write(f'# {sink} {key} count={histogram.count} overflow={histogram.overflow}\n')
+                file.write('value_s,percentile,total_count\n')
+                for value, percentile, seen in histogram.distribution():
+                    file.write(f'{value:.6f},{percentile:.4f},{seen}\n')
+
+    def reset(self):
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
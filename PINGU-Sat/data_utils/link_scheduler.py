@@ -0,0 +1,548 @@
+import logging
+import threading
+import time
+from collections import deque
+from .thread_utils import LoopThread
+from .payload_codec import join_frames
+
+
+#-------------------------------------------
+
+TELEMETRY = 'telemetry'
+PAYLOAD = 'payload'
+BACKLOG = 'backlog'
+
+
+class Frame:
+
+    """A queued radio frame. A frame from the backlog keeps its sequence
+       number there, and its queued_at is when it was stored"""
+
+    __slots__ = ('kind', 'message', 'size', 'queued_at', 'seq')
+
+    def __init__(self, kind, message, size, queued_at=None, seq=None):
+        self.kind = kind
+        self.message = message
+        self.size = size
+        self.queued_at = time.monotonic() if queued_at is None else queued_at
+        self.seq = seq
+
+
+class FrameQueue:
+
+    """Bounded queue for one class of frames, with its counters. When full
+       the oldest frame is dropped to make room for the newest"""
+
+    def __init__(self, kind, priority, maxsize):
+
+        self.kind = kind
+        self.priority = priority
+        self.maxsize = maxsize
+        self.frames = deque()
+
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.backlogged = 0
+        self.bytes_sent = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def put(self, frame):
+
+        """Queues a frame, and returns the oldest frame if it was pushed
+           out to make room"""
+
+        evicted = None
+        if len(self.frames) >= self.maxsize:
+            evicted = self.frames.popleft()
+        self.frames.append(frame)
+        self.queued += 1
+        return evicted
+
+    def record_sent(self, frames, size):
+        now = time.monotonic()
+        for frame in frames:
+            latency = now - frame.queued_at
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        self.sent += len(frames)
+        self.bytes_sent += size
+
+    def summary(self):
+        return {
+            'depth': len(self.frames),
+            'queued': self.queued,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'backlogged': self.backlogged,
+            'bytes_sent': self.bytes_sent,
+            'mean_latency': self.total_latency/self.sent if self.sent else None,
+            'max_latency': self.max_latency,
+        }
+
+
+#-------------------------------------------
+
+class LinkScheduler:
+
+    """Owns the radio transmit path and schedules frames onto the link
+
+       HandleTelemetry and HandleData are given a LinkScheduler in place of
+       the RunRadio object. Their send calls only queue a frame, and a
+       single thread sends them one at a time, highest priority first,
+       within a bytes-per-second budget (token bucket) and a duty-cycle
+       budget (airtime over a sliding window).
+
+       Given a PayloadBacklog, payload frames that fail to send, that are
+       pushed out of the full queue or that are still queued at shutdown
+       are stored in it instead of being lost. Backlog frames are sent
+       newest or oldest first (drain), one after every interleave live
+       payload frames or whenever no live payload is waiting, within the
+       same budgets. After a failed send the backlog waits retry_interval
+       s before trying again.
+
+       The queue latency and drops of each class (stats), and the size
+       and age of the backlog, are logged every report_interval s.
+
+       With send_timeout each send is made from a short-lived thread. A
+       send still blocked after send_timeout s (a radio write held up on
+       the serial port) holds the link: nothing else is sent until it
+       returns, and payload frames queued meanwhile go to the backlog
+       instead of waiting to be pushed out of the queue. Its own frames
+       are counted sent or failed once it returns, and are stored in the
+       backlog if it is still blocked at shutdown (so they may be sent
+       twice). The backlog is written outside the lock the callers of
+       send_data and send_telemetry_packet take, as it fsyncs.
+
+       INPUTS:
+       radio: object, a RunRadio
+       bytes_per_second: float [optional], long-run link budget
+       burst: float, seconds of budget that can be saved up
+       duty_cycle: float, largest fraction of the window spent transmitting
+       window: float, seconds over which the duty cycle is measured
+       baudrate: int, used to convert frame sizes into airtime
+       telemetry_size: int, estimated bytes on the link per telemetry frame
+       overhead: int, estimated radio framing bytes per payload frame
+       coalesce: bool, join queued payload frames with join_frames when
+                 the link is free, up to max_frame bytes
+       max_queue: int, frames kept per class before the oldest is dropped
+       backlog: object [optional], a PayloadBacklog, closed with the
+                scheduler
+       drain: str, 'newest' or 'oldest', order the backlog is sent in
+       interleave: int, live payload frames sent for each backlog frame
+                   while both are waiting, 0 to only send the backlog when
+                   no live payload is waiting
+       retry_interval: float, s between failed sends and backlog retries
+       report_interval: float, s between link and backlog reports in the
+                        log
+       send_timeout: float [optional], s a send may block before it fails,
+                     None to wait for it"""
+
+    def __init__(self, radio, bytes_per_second=None, burst=5, duty_cycle=1.0,
+                 window=60, baudrate=38400, telemetry_size=100, overhead=16,
+                 coalesce=False, max_frame=200, max_queue=32, timeout=1, backlog=None,
+                 drain='newest', interleave=1, retry_interval=10, report_interval=300,
+                 send_timeout=5):
+
+        if drain not in ('newest', 'oldest'):
+            raise ValueError(f'Unknown drain order: {drain}')
+
+        self._radio = radio
+        self._rate = bytes_per_second
+        self._capacity = bytes_per_second*burst if bytes_per_second else None
+        self._tokens = self._capacity
+        self._refilled = time.monotonic()
+
+        self._duty_cycle = duty_cycle
+        self._window = window
+        self._baudrate = baudrate
+        self._airtime = deque()
+
+        self._telemetry_size = telemetry_size
+        self._overhead = overhead
+        self._coalesce = coalesce
+        self._max_frame = max_frame
+        self._timeout = timeout
+
+        self._cond = threading.Condition()
+        self.queues = {
+            TELEMETRY: FrameQueue(TELEMETRY, 0, max_queue),
+            PAYLOAD: FrameQueue(PAYLOAD, 1, max_queue),
+        }
+
+        self.backlog = backlog
+        self._drain = drain
+        self._interleave = interleave
+        self._retry_interval = retry_interval
+        self._report_interval = report_interval
+        #holds the backlog frame being sent, at most one
+        self.queues[BACKLOG] = FrameQueue(BACKLOG, 2, 1)
+        self._live_run = 0
+        self._retry_at = 0.0
+        self._reported = time.monotonic()
+
+        self._send_timeout = send_timeout
+        #a send that timed out and has not returned yet
+        self._blocked = None
+        self.timeouts = 0
+
+        self._thread = None
+
+    def __repr__(self):
+        return f'LinkScheduler({self._radio!r}, bytes_per_second={self._rate})'
+
+    def __enter__(self):
+        self._thread = LoopThread(loop=self.update, setup=self.setup, teardown=self.teardown,
+                                  cancel=self.wake)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._thread.stop()
+        return False
+
+    def setup(self):
+        pass
+
+    def wake(self):
+
+        """Ends a wait for frames or budget early, e.g. to stop the thread"""
+
+        with self._cond:
+            self._cond.notify_all()
+
+    def _stopping(self):
+        return self._thread is not None and not self._thread.is_running()
+
+    def teardown(self):
+        with self._cond:
+            blocked, self._blocked = self._blocked, None
+        if blocked is not None:
+            done, error, queue, frames, size = blocked
+            if done.is_set():
+                self._settle(blocked)
+            else:
+                logging.info(f'Link Scheduler - {queue.kind} send still blocked at shutdown')
+                if queue.kind != BACKLOG:
+                    self._lost(queue, frames)
+        with self._cond:
+            queued = self._pop_queued()
+        self._lost(self.queues[PAYLOAD], queued)
+        with self._cond:
+            unsent = len(self.queues[TELEMETRY].frames) + len(self.queues[PAYLOAD].frames)
+        if unsent:
+            logging.info(f'Link Scheduler - {unsent} frames unsent at shutdown')
+        self.report_link()
+        if self.backlog is not None:
+            self.report_backlog()
+            self.backlog.close()
+
+    #---------------------------------------
+    #RunRadio interface
+
+    def send_data(self, msg):
+        self._put(Frame(PAYLOAD, msg, len(msg) + self._overhead))
+
+    def send_telemetry_packet(self, dictionary):
+        self._put(Frame(TELEMETRY, dictionary, self._telemetry_size))
+
+    def _put(self, frame):
+        with self._cond:
+            queue = self.queues[frame.kind]
+            evicted = queue.put(frame)
+            self._cond.notify()
+        if evicted is not None:
+            self._lost(queue, [evicted])
+
+    def stats(self):
+        with self._cond:
+            return {kind: q.summary() for kind, q in self.queues.items()}
+
+    def report_link(self):
+
+        """Logs the queue latency and drops of each class of frames"""
+
+        for kind, s in self.stats().items():
+            if kind == BACKLOG and self.backlog is None:
+                continue
+            latency = f"{s['mean_latency']:.1f}" if s['mean_latency'] is not None else '-'
+            logging.info(f"Link Scheduler - {kind} {s['depth']} queued, {s['sent']} sent, "
+                         f"{s['dropped']} dropped, {s['backlogged']} backlogged, "
+                         f"latency mean {latency} s max {s['max_latency']:.1f} s")
+
+    def report_backlog(self):
+
+        """Logs the size and age of the backlog"""
+
+        s = self.backlog.summary()
+        age = f", oldest {s['oldest_age']:.0f} s" if s['frames'] else ''
+        logging.info(f"Link Scheduler - backlog {s['frames']} frames, {s['bytes']} bytes{age}, "
+                     f"{s['stored']} stored, {s['sent']} sent, {s['evicted']} evicted")
+
+    #---------------------------------------
+
+    def update(self):
+
+        """Sends the next frame once the budget allows, or waits"""
+
+        if time.monotonic() - self._reported >= self._report_interval:
+            self._reported = time.monotonic()
+            self.report_link()
+            if self.backlog is not None:
+                self.report_backlog()
+
+        with self._cond:
+            blocked = self._blocked
+        if blocked is not None:
+            self._wait_blocked(blocked)
+            return
+
+        with self._cond:
+            queue = self._next_queue()
+            if queue is None:
+                self._cond.wait(self._timeout)
+                return
+
+            delay = self._budget_delay(queue.frames[0].size)
+            if delay > 0:
+                #a higher priority frame queued meanwhile is sent first
+                self._cond.wait(min(delay, self._timeout))
+                return
+
+            frames = self._take(queue)
+            size = sum(f.size for f in frames) - self._overhead*(len(frames) - 1)
+            self._spend(size)
+
+        self._transmit(queue, frames, size)
+
+    def _next_queue(self):
+        self._load_backlog()
+        waiting = [q for q in self.queues.values() if q.frames]
+        if not waiting:
+            return None
+        queue = min(waiting, key=lambda q: q.priority)
+        backlog = self.queues[BACKLOG]
+        if queue.kind == PAYLOAD and backlog.frames and self._interleave \
+                and self._live_run >= self._interleave:
+            return backlog
+        return queue
+
+    def _load_backlog(self):
+
+        """Moves the next backlog frame into memory, unless one is already
+           there or a send has failed in the last retry_interval s"""
+
+        backlog = self.queues[BACKLOG]
+        if self.backlog is None or backlog.frames or time.monotonic() < self._retry_at:
+            return
+        frame = self.backlog.peek(self._drain)
+        if frame is None:
+            return
+        seq, stored_at, message = frame
+        queued_at = time.monotonic() - max(0.0, time.time() - stored_at)
+        backlog.put(Frame(BACKLOG, message, len(message) + self._overhead, queued_at, seq))
+
+    def _take(self, queue):
+
+        """Pops the next frame, and with coalescing any payload frames that
+           fit alongside it in max_frame bytes and the current budget"""
+
+        frames = [queue.frames.popleft()]
+        if not (self._coalesce and queue.kind == PAYLOAD):
+            return frames
+
+        size = frames[0].size
+        while queue.frames:
+            extra = queue.frames[0].size - self._overhead + 2
+            if len(frames) == 1:
+                #the COALESCED byte and the first frame's length
+                extra += 3
+            if size + extra > self._max_frame or self._budget_delay(size + extra) > 0:
+                break
+            frames.append(queue.frames.popleft())
+            size += extra
+        return frames
+
+    def _send(self, queue, frames):
+        if queue.kind == TELEMETRY:
+            self._radio.send_telemetry_packet(frames[0].message)
+        elif len(frames) == 1:
+            self._radio.send_data(frames[0].message)
+        else:
+            self._radio.send_data(join_frames([f.message for f in frames]))
+
+    def _send_with_timeout(self, queue, frames, size):
+
+        """Sends from a thread. Returns True once the send has returned,
+           or raises its error. If it has not returned after send_timeout
+           s, or the scheduler is stopped meanwhile, the send is kept in
+           _blocked with its frames and False is returned"""
+
+        done = threading.Event()
+        error = []
+
+        def send():
+            try:
+                self._send(queue, frames)
+            except Exception as exc:
+                error.append(exc)
+            finally:
+                done.set()
+                self.wake()
+
+        thread = threading.Thread(target=send, name='LinkSend', daemon=True)
+        with self._cond:
+            thread.start()
+            self._cond.wait_for(lambda: done.is_set() or self._stopping(), self._send_timeout)
+            if not done.is_set():
+                self._blocked = (done, error, queue, frames, size)
+                self.timeouts += 1
+                self._retry_at = time.monotonic() + self._retry_interval
+        if not done.is_set():
+            logging.info(f'Link Scheduler - {queue.kind} send blocked for {self._send_timeout} s')
+            return False
+        if error:
+            raise error[0]
+        return True
+
+    def _wait_blocked(self, blocked):
+
+        """Waits for a send that timed out to return, storing the payload
+           frames queued meanwhile in the backlog, then settles it"""
+
+        done = blocked[0]
+        if not done.is_set():
+            with self._cond:
+                queued = self._pop_queued()
+                if not queued:
+                    self._cond.wait_for(lambda: done.is_set() or self._stopping(), self._timeout)
+            self._lost(self.queues[PAYLOAD], queued)
+            return
+        with self._cond:
+            self._blocked = None
+        self._settle(blocked)
+
+    def _settle(self, blocked):
+
+        """Counts the frames of a send that timed out as sent or failed,
+           once it has returned"""
+
+        done, error, queue, frames, size = blocked
+        if error:
+            self._failed(queue, frames, error[0])
+        else:
+            self._sent(queue, frames, size)
+
+    def _transmit(self, queue, frames, size):
+        try:
+            if self._send_timeout is None:
+                self._send(queue, frames)
+            elif not self._send_with_timeout(queue, frames, size):
+                return
+        except Exception as exc:
+            self._failed(queue, frames, exc)
+            return
+        self._sent(queue, frames, size)
+
+    def _sent(self, queue, frames, size):
+        with self._cond:
+            queue.record_sent(frames, size)
+            if queue.kind == BACKLOG:
+                self._live_run = 0
+            elif queue.kind == PAYLOAD:
+                self._live_run += 1
+        if queue.kind == BACKLOG:
+            self.backlog.ack(frames[0].seq)
+
+    def _failed(self, queue, frames, exc):
+        with self._cond:
+            self._retry_at = time.monotonic() + self._retry_interval
+        if queue.kind != BACKLOG:
+            self._lost(queue, frames)
+        logging.info(f'Link Scheduler - {queue.kind} {type(exc).__name__}')
+
+    def _pop_queued(self):
+
+        """Takes the queued payload frames to be stored in the backlog, if
+           there is one. Called with the lock held"""
+
+        payload = self.queues[PAYLOAD]
+        if self.backlog is None or not payload.frames:
+            return []
+        frames = list(payload.frames)
+        payload.frames.clear()
+        return frames
+
+    def _lost(self, queue, frames):
+
+        """Stores payload frames that could not be sent in the backlog,
+           or counts them as dropped. A backlog frame that failed stays in
+           the backlog. Called without the lock, as the backlog fsyncs"""
+
+        if not frames:
+            return
+        if self.backlog is None or queue.kind != PAYLOAD:
+            with self._cond:
+                queue.dropped += len(frames)
+            return
+        stored = 0
+        for frame in frames:
+            try:
+                self.backlog.store(frame.message)
+                stored += 1
+            except (OSError, ValueError) as exc:
+                logging.info(f'Link Scheduler - backlog {type(exc).__name__}')
+        with self._cond:
+            queue.backlogged += stored
+            queue.dropped += len(frames) - stored
+
+    #---------------------------------------
+    #Budgets
+
+    def _refill(self, now):
+        if self._rate is None:
+            return
+        self._tokens = min(self._capacity, self._tokens + (now - self._refilled)*self._rate)
+        self._refilled = now
+
+    def _budget_delay(self, size):
+
+        """Seconds until a frame of size bytes fits in both budgets"""
+
+        now = time.monotonic()
+        delay = 0.0
+
+        if self._rate is not None:
+            self._refill(now)
+            #frames larger than the burst are sent once the bucket is full
+            needed = min(size, self._capacity)
+            if self._tokens < needed:
+                delay = (needed - self._tokens)/self._rate
+
+        if self._duty_cycle < 1:
+            while self._airtime and self._airtime[0][0] <= now - self._window:
+                self._airtime.popleft()
+            allowed = self._duty_cycle*self._window
+            used = sum(a for _, a in self._airtime) + self.airtime(size)
+            for start, airtime in self._airtime:
+                if used <= allowed:
+                    break
+                used -= airtime
+                delay = max(delay, start + self._window - now)
+
+        return delay
+
+    def _spend(self, size):
+        now = time.monotonic()
+        if self._rate is not None:
+            self._refill(now)
+            self._tokens -= size
+        if self._duty_cycle < 1:
+            self._airtime.append((now, self.airtime(size)))
+
+    def airtime(self, size):
+
+        """Seconds on air for size bytes at 8N1"""
+
+        return size*10/self._baudrate
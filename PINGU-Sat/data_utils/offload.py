@@ -0,0 +1,396 @@
+import logging
+import multiprocessing
+import os
+import pickle
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from .latency import LatencyHistogram
+from .snapshot import PublishedSensor
+
+
+#-------------------------------------------
+#Ring layout: a header of three counters (samples written, samples read,
+#samples dropped because the ring was full) then slots of slot_size bytes,
+#each a length followed by that many bytes of data.
+
+HEADER = struct.Struct('QQQ')
+LENGTH = struct.Struct('I')
+
+
+#-------------------------------------------
+#Sample layout: the acquisition timestamp, the length of the key, the key,
+#a type byte and the value. The raw sensors publish bytes lines, tuples of
+#integers (the MS5611 ADC and PROM words) and floats, which are packed
+#without pickling, and a tuple of lines is sent as one sample per line.
+#Anything else is pickled.
+
+SAMPLE = struct.Struct('<dB')
+FLOAT = struct.Struct('<d')
+
+LINE = b'L'
+INTEGERS = b'I'
+NUMBER = b'F'
+NONE = b'N'
+PICKLED = b'P'
+
+
+def encode_samples(key, value, timestamp):
+
+    """Returns the ring items of a published sample"""
+
+    head = SAMPLE.pack(timestamp, len(key)) + key.encode()
+    if isinstance(value, tuple) and value and isinstance(value[0], bytes):
+        return [head + LINE + line for line in value]
+    if isinstance(value, tuple) and value and all(type(v) is int for v in value):
+        return [head + INTEGERS + struct.pack(f'<{len(value)}I', *value)]
+    if isinstance(value, tuple) and not value:
+        #a raw line sensor that has read nothing yet
+        return []
+    if value is None:
+        return [head + NONE]
+    if type(value) is float:
+        return [head + NUMBER + FLOAT.pack(value)]
+    return [head + PICKLED + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)]
+
+
+def decode_sample(data):
+
+    """Returns (key, value, timestamp) of a ring item. A line is given
+       as a tuple of one line, as the raw sensor published it"""
+
+    timestamp, length = SAMPLE.unpack_from(data)
+    pos = SAMPLE.size + length
+    key = data[SAMPLE.size:pos].decode()
+    kind, body = data[pos:pos + 1], data[pos + 1:]
+    if kind == LINE:
+        value = (body,)
+    elif kind == INTEGERS:
+        value = struct.unpack(f'<{len(body)//4}I', body)
+    elif kind == NUMBER:
+        value, = FLOAT.unpack(body)
+    elif kind == NONE:
+        value = None
+    else:
+        value = pickle.loads(body)
+    return key, value, timestamp
+
+
+#-------------------------------------------
+
+class SharedRing:
+
+    """Fixed-size ring of byte strings in multiprocessing.shared_memory,
+       passing samples from one process to another without a pipe
+
+       The producer copies each item into the next free slot and the
+       consumer copies it out. Two semaphores count the filled and the free
+       slots, which also makes each slot's contents visible to the other
+       process before it is used. put never blocks: when the ring is full
+       the item is dropped and counted. Created in the parent and passed to
+       the worker as a Process argument, which attaches it by name.
+
+       INPUTS:
+       slots: int, number of items the ring holds
+       slot_size: int, bytes per slot, including a 4 byte length"""
+
+    def __init__(self, slots=1024, slot_size=512):
+
+        if slot_size <= LENGTH.size:
+            raise ValueError(f'Slot size too small: {slot_size}')
+
+        self.slots = slots
+        self.slot_size = slot_size
+        self._shm = shared_memory.SharedMemory(create=True, size=HEADER.size + slots*slot_size)
+        #a forked worker has a copy of the ring, only the creator frees it
+        self._owner = os.getpid()
+        HEADER.pack_into(self._shm.buf, 0, 0, 0, 0)
+
+        self._filled = multiprocessing.Semaphore(0)
+        self._free = multiprocessing.Semaphore(slots)
+        self._head = 0
+        self._tail = 0
+        self._dropped = 0
+
+    def __repr__(self):
+        return f'SharedRing({self.name!r}, slots={self.slots}, slot_size={self.slot_size})'
+
+    def __getstate__(self):
+        return (self._shm.name, self.slots, self.slot_size, self._filled, self._free)
+
+    def __setstate__(self, state):
+        name, self.slots, self.slot_size, self._filled, self._free = state
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._owner = None
+        self._head, self._tail, self._dropped = HEADER.unpack_from(self._shm.buf, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def _offset(self, index):
+        return HEADER.size + (index % self.slots)*self.slot_size
+
+    #---------------------------------------
+    #producer side
+
+    def put(self, data):
+
+        """Copies a byte string into the ring. Returns False, without
+           waiting, if the ring is full"""
+
+        if len(data) > self.slot_size - LENGTH.size:
+            raise ValueError(f'{len(data)} bytes do not fit a {self.slot_size} byte slot')
+
+        if not self._free.acquire(False):
+            self._dropped += 1
+            struct.pack_into('Q', self._shm.buf, 16, self._dropped)
+            return False
+
+        offset = self._offset(self._head)
+        LENGTH.pack_into(self._shm.buf, offset, len(data))
+        start = offset + LENGTH.size
+        self._shm.buf[start:start + len(data)] = data
+        self._head += 1
+        struct.pack_into('Q', self._shm.buf, 0, self._head)
+        self._filled.release()
+        return True
+
+    #---------------------------------------
+    #consumer side
+
+    def get(self, timeout=None, stop_event=None):
+
+        """Returns the next byte string, waiting up to timeout s for one.
+           None if none arrived, or if the stop event is set when the wait
+           ends (wake ends the wait early)"""
+
+        if not self._filled.acquire(True, timeout):
+            return None
+        if stop_event is not None and stop_event.is_set():
+            return None
+
+        offset = self._offset(self._tail)
+        length, = LENGTH.unpack_from(self._shm.buf, offset)
+        start = offset + LENGTH.size
+        data = bytes(self._shm.buf[start:start + length])
+        self._tail += 1
+        struct.pack_into('Q', self._shm.buf, 8, self._tail)
+        self._free.release()
+        return data
+
+    def wake(self):
+
+        """Ends a consumer's wait in get, once its stop event is set"""
+
+        self._filled.release()
+
+    #---------------------------------------
+
+    def stats(self):
+
+        """Items written, read and dropped so far by either process"""
+
+        written, read, dropped = HEADER.unpack_from(self._shm.buf, 0)
+        return {
+            'slots': self.slots,
+            'written': written,
+            'read': read,
+            'dropped': dropped,
+            'depth': written - read,
+        }
+
+    def close(self):
+
+        """Detaches from the shared memory. The process that created the
+           ring also frees it"""
+
+        self._shm.close()
+        if self._owner == os.getpid():
+            self._shm.unlink()
+
+
+#-------------------------------------------
+
+class RingPublisher:
+
+    """Stands in for the SnapshotBus in the acquisition process, sending
+       every published sample through a SharedRing to a RingReader in the
+       worker process
+
+       The sensors of the acquisition process are run raw, so the samples
+       are the lines and ADC words they read, packed by encode_samples with
+       the acquisition time given by the sensor. Sensors publish from their
+       own threads, so puts are serialised by a lock.
+
+       INPUTS:
+       ring: SharedRing"""
+
+    def __init__(self, ring):
+
+        self.ring = ring
+        self.published = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'RingPublisher({self.ring!r}, published={self.published})'
+
+    def publish(self, key, value, timestamp=None):
+
+        """Sends a sensor value to the worker. Returns False if it was
+           dropped"""
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self._lock:
+            try:
+                items = encode_samples(key, value, timestamp)
+            except (struct.error, pickle.PicklingError) as exc:
+                logging.info(f'Ring Publisher - {key} {type(exc).__name__}')
+                items = [None]
+
+            sent = True
+            for item in items:
+                try:
+                    put = item is not None and self.ring.put(item)
+                except ValueError as exc:
+                    logging.info(f'Ring Publisher - {key} {type(exc).__name__}')
+                    put = False
+                if put:
+                    self.published += 1
+                else:
+                    self.dropped += 1
+                sent = sent and put
+        return sent
+
+    def attach(self, sensor_dict):
+
+        """Wraps every sensor in a dictionary so that it publishes to the
+           ring after each read, as SnapshotBus.attach does"""
+
+        for k in sensor_dict:
+            self.publish(k, sensor_dict[k].data)
+        return {k: PublishedSensor(sensor_dict[k], k, self) for k in sensor_dict}
+
+
+class RingReader:
+
+    """Process that republishes the samples arriving on a SharedRing to the
+       worker's SnapshotBus, for the data handling processes
+
+       The raw samples of a key with a sensor in sensors are passed to its
+       process_raw, which does the parsing, compensation and statistics the
+       sensor does when it is not run raw, and the values it returns are
+       published with the acquisition time. Their initial values are
+       published when the reader is created. The time each sample spent
+       between its acquisition and its publish in the worker is kept in the
+       transit LatencyHistogram.
+
+       INPUTS:
+       ring: SharedRing, as passed to the worker process
+       bus: SnapshotBus
+       sensors: dict [optional], key: sensor processing the raw samples of
+                that key, created without being set up
+       timeout: float, longest wait for a sample in each update"""
+
+    def __init__(self, ring, bus, sensors=None, timeout=1.0):
+
+        self.ring = ring
+        self.bus = bus
+        self.sensors = sensors if sensors else {}
+        self.timeout = timeout
+        for key, sensor in self.sensors.items():
+            bus.publish(key, sensor.data)
+        self.transit = LatencyHistogram(highest=60.0)
+        #replaced by the stop event of the thread running the process
+        self.stop_event = threading.Event()
+
+    def __repr__(self):
+        return f'RingReader({self.ring!r}, samples={self.transit.count})'
+
+    def setup(self):
+        pass
+
+    def update(self):
+        data = self.ring.get(self.timeout, self.stop_event)
+        if data is None:
+            return
+        key, value, timestamp = decode_sample(data)
+        sensor = self.sensors.get(key)
+        if sensor is None:
+            self.bus.publish(key, value, timestamp)
+        else:
+            for value in sensor.process_raw(value):
+                self.bus.publish(key, value, timestamp)
+        self.transit.record(time.monotonic() - timestamp)
+
+    def cancel(self):
+        self.ring.wake()
+
+    def teardown(self):
+        pass
+
+
+#-------------------------------------------
+
+class RunWorker:
+
+    """Context manager running a function in a worker process
+
+       target is called in the new process as target(*args, stop_event)
+       and should return once the multiprocessing.Event stop_event is set,
+       which happens when the context exits. A worker that has not
+       finished after join_timeout s is terminated.
+
+       INPUTS:
+       target: callable, picklable (a module level function)
+       args: arguments passed before the stop event
+       join_timeout: float, s"""
+
+    def __init__(self, target, *args, join_timeout=5.0):
+
+        self._stop_event = multiprocessing.Event()
+        self._join_timeout = join_timeout
+        self.process = multiprocessing.Process(target=target, args=args + (self._stop_event,),
+                                               name='worker')
+
+    def __repr__(self):
+        return f'RunWorker({self.process!r})'
+
+    def __enter__(self):
+        self.setup()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.teardown()
+
+    def setup(self):
+        self.process.start()
+
+    def teardown(self):
+        self._stop_event.set()
+        self.process.join(self._join_timeout)
+        if self.process.is_alive():
+            logging.info('Worker - terminated after join timeout')
+            self.process.terminate()
+            self.process.join()
+
+
+def wait_for_stop(stop_event, interval=1.0):
+
+    """Waits in a worker process until the stop event is set, or the
+       process that started it has died"""
+
+    parent = multiprocessing.parent_process()
+    while not stop_event.wait(interval):
+        if parent is not None and not parent.is_alive():
+            logging.info('Worker - parent process died')
+            return
@@ -0,0 +1,195 @@
+import math
+
+
+#-------------------------------------------
+#Packet layout
+#
+#    version (1 byte)
+#    packet counter (varint)
+#    number of samples (varint)
+#    for each sample:
+#        presence mask (varint, one bit per field)
+#        for each present field: zigzag varint of the quantized value minus
+#        the previous value of that field in the packet (0 for the first)
+#
+#Deltas never reach across packets so every packet decodes on its own.
+#
+#A coalesced packet, several payload frames sent as one by the
+#LinkScheduler, starts with the COALESCED byte instead, followed by each
+#frame prefixed by its length (varint). Neither a codec packet (VERSION)
+#nor a text payload (an ASCII packet counter) starts with that byte, so
+#the ground can tell the three apart from the first byte.
+
+VERSION = 1
+COALESCED = 0xC0
+
+#field name, resolution
+DEFAULT_FIELDS = (
+    ('time', 0.1),
+    ('pressure', 0.01),
+    ('t_external', 0.01),
+    ('alt', 0.1),
+    ('cps_60s', 0.001),
+    ('cps_60s_err', 0.001),
+    ('pfotzer_alt', 1),
+    ('pfotzer_cps', 0.001),
+)
+
+
+def zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def write_varint(buf, n):
+
+    """Appends an unsigned integer to a bytearray as a LEB128 varint"""
+
+    while n > 0x7F:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def read_varint(data, pos):
+
+    """Reads a varint from data at pos, returns (value, new pos)"""
+
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def join_frames(frames):
+
+    """Joins payload frames into one coalesced packet: the COALESCED byte,
+       then each frame prefixed by its varint length"""
+
+    buf = bytearray([COALESCED])
+    for frame in frames:
+        write_varint(buf, len(frame))
+        buf += frame
+    return bytes(buf)
+
+
+def split_frames(data):
+
+    """Splits a coalesced packet made by join_frames back into its payload
+       frames. Any other packet is returned as a single frame"""
+
+    if not data or data[0] != COALESCED:
+        return [bytes(data)]
+
+    frames = []
+    pos = 1
+    while pos < len(data):
+        length, pos = read_varint(data, pos)
+        if pos + length > len(data):
+            raise ValueError(f'Coalesced frame of {length} bytes overruns the packet')
+        frames.append(bytes(data[pos:pos + length]))
+        pos += length
+    return frames
+
+
+def decimals(resolution):
+
+    """Number of decimal places needed to show a resolution"""
+
+    return max(0, -math.floor(math.log10(resolution)))
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+#-------------------------------------------
+
+class PayloadCodec:
+
+    """Quantizing, delta-encoding, varint-packing codec for payload samples
+
+       INPUTS:
+       fields: sequence of (name, resolution) pairs. Each sample is a dict
+               keyed by these names, values are rounded to the resolution
+               and None values are marked missing"""
+
+    def __init__(self, fields=DEFAULT_FIELDS):
+
+        self.fields = tuple(fields)
+        if len(self.fields) > 63:
+            raise ValueError('PayloadCodec supports at most 63 fields')
+
+    def __repr__(self):
+        return f'PayloadCodec({self.fields})'
+
+    def encode(self, index, samples):
+
+        """Encodes a packet counter and a list of sample dicts into bytes"""
+
+        buf = bytearray([VERSION])
+        write_varint(buf, index)
+        write_varint(buf, len(samples))
+
+        previous = [0]*len(self.fields)
+        for sample in samples:
+            mask = 0
+            deltas = []
+            for i, (name, resolution) in enumerate(self.fields):
+                value = sample.get(name)
+                if _missing(value):
+                    continue
+                q = round(value/resolution)
+                mask |= 1 << i
+                deltas.append(zigzag(q - previous[i]))
+                previous[i] = q
+
+            write_varint(buf, mask)
+            for d in deltas:
+                write_varint(buf, d)
+        return bytes(buf)
+
+    def decode(self, data):
+
+        """Decodes a packet, returns (packet counter, list of sample dicts)"""
+
+        if data[0] == COALESCED:
+            raise ValueError('Coalesced packet, decode it with decode_packets')
+        if data[0] != VERSION:
+            raise ValueError(f'Unknown payload version: {data[0]}')
+
+        index, pos = read_varint(data, 1)
+        n, pos = read_varint(data, pos)
+
+        previous = [0]*len(self.fields)
+        samples = []
+        for _ in range(n):
+            mask, pos = read_varint(data, pos)
+            sample = {}
+            for i, (name, resolution) in enumerate(self.fields):
+                if not mask >> i & 1:
+                    sample[name] = None
+                    continue
+                d, pos = read_varint(data, pos)
+                previous[i] += unzigzag(d)
+                sample[name] = round(previous[i]*resolution, decimals(resolution))
+            samples.append(sample)
+
+        if pos != len(data):
+            raise ValueError(f'{len(data) - pos} trailing bytes in payload')
+        return index, samples
+
+    def decode_packets(self, data):
+
+        """Decodes a packet as received on the ground, single or coalesced.
+           Returns a list of (packet counter, list of sample dicts), one per
+           payload frame"""
+
+        return [self.decode(frame) for frame in split_frames(data)]
@@ -0,0 +1,196 @@
+import math
+import numpy as np
+from sensors.gps.nmea import parse_gga_dict
+from .altitude import pressure_altitude
+
+
+#-------------------------------------------
+
+def profile_point(data_dict):
+
+    """Returns (altitude, cps) from a sensor data dictionary, using the
+       fused AltitudeEstimate if there is one, else the GPS altitude or the
+       pressure altitude when there is no fix. Either is None when it is
+       missing"""
+
+    reading = data_dict.get('geiger')
+    cps = reading[0] if reading is not None else None
+
+    estimate = data_dict.get('altitude')
+    if estimate is not None:
+        return estimate.altitude, cps
+
+    altitude = parse_gga_dict(data_dict.get('gps'))['altitude']
+    if altitude is None:
+        pressure = data_dict.get('pressure')
+        altitude = pressure_altitude(pressure[1] if pressure is not None else None)
+    return altitude, cps
+
+
+#-------------------------------------------
+
+class PfotzerProfile:
+
+    """Count rate against altitude profile built as readings arrive, with
+       a running estimate of the Pfotzer-Regener maximum
+
+       Readings are put into fixed altitude bins. Each bin keeps its number
+       of readings, mean and sum of squared deviations (Welford) in
+       preallocated arrays. The maximum is the bin with the highest mean
+       after averaging each bin with its neighbours (weighted by readings),
+       refined by fitting a parabola through it and its neighbours. The
+       sums behind these averages are kept too, so a reading only updates
+       its bin and the two neighbours.
+
+       INPUTS:
+       bin_size: float, m per altitude bin
+       max_altitude: float, m, readings above it are ignored
+       min_samples: int, readings a bin needs before it is a candidate
+       confirm_margin: float, m the balloon has to climb past the maximum
+                       before it is marked as passed"""
+
+    def __init__(self, bin_size=250, max_altitude=40000, min_samples=10, confirm_margin=2000):
+
+        self.bin_size = bin_size
+        self.min_samples = min_samples
+        self.confirm_margin = confirm_margin
+
+        bins = int(math.ceil(max_altitude/bin_size))
+        self.n = np.zeros(bins, dtype=np.int64)
+        self.mean = np.zeros(bins)
+        self.m2 = np.zeros(bins)
+        #sum and number of the readings of each bin and its neighbours,
+        #and their mean
+        self._total = np.zeros(bins)
+        self._weight = np.zeros(bins)
+        self._rate = np.full(bins, np.nan)
+        self._peak = None
+
+        self.readings = 0
+        self.highest = None
+        self.peak_altitude = None
+        self.peak_rate = None
+        self.peak_error = None
+
+    def __repr__(self):
+        return f'PfotzerProfile(bin_size={self.bin_size}, bins={len(self.n)})'
+
+    def add(self, altitude, cps):
+
+        """Adds a reading of cps at an altitude in m. Returns False if it
+           is missing or out of range"""
+
+        if altitude is None or cps is None or not 0 <= altitude < len(self.n)*self.bin_size:
+            return False
+
+        i = int(altitude//self.bin_size)
+        self.n[i] += 1
+        delta = cps - self.mean[i]
+        self.mean[i] += delta/self.n[i]
+        self.m2[i] += delta*(cps - self.mean[i])
+
+        self.readings += 1
+        if self.highest is None or i > self.highest:
+            self.highest = i
+        self._update_peak(i, cps)
+        return True
+
+    def update(self, data_dict):
+
+        """Adds the reading in a sensor data dictionary"""
+
+        return self.add(*profile_point(data_dict))
+
+    def clear(self):
+        self.n[:] = 0
+        self.mean[:] = 0
+        self.m2[:] = 0
+        self._total[:] = 0
+        self._weight[:] = 0
+        self._rate[:] = np.nan
+        self._peak = None
+        self.readings = 0
+        self.highest = self.peak_altitude = self.peak_rate = self.peak_error = None
+
+    #---------------------------------------
+
+    def smoothed(self):
+
+        """Mean of each bin and its two neighbours weighted by readings,
+           NaN for bins with fewer than min_samples readings"""
+
+        return self._rate.copy(), self._weight.copy()
+
+    def _update_peak(self, i, cps):
+
+        """Adds a reading of cps in bin i to the averages around it, and
+           updates the maximum if one of them is, or was, the highest"""
+
+        touched = range(max(i-1, 0), min(i+2, len(self.n)))
+        self._total[touched.start:touched.stop] += cps
+        self._weight[touched.start:touched.stop] += 1
+        rate = self._rate
+        for j in touched:
+            if self.n[j] >= self.min_samples:
+                rate[j] = self._total[j]/self._weight[j]
+
+        peak = self._peak
+        if peak is None or (peak in touched and not rate[peak] >= self.peak_rate):
+            #the highest bin has dropped, so all are searched
+            if np.all(np.isnan(rate)):
+                return
+            peak = int(np.nanargmax(rate))
+        else:
+            for j in touched:
+                #the lowest bin wins a tie, as with nanargmax
+                if rate[j] > rate[peak] or (rate[j] == rate[peak] and j < peak):
+                    peak = j
+        self._peak = peak
+        self._locate_peak()
+
+    def _locate_peak(self):
+        rate, weight = self._rate, self._weight
+        i = self._peak
+        offset = 0.0
+        if 0 < i < len(rate) - 1 and not np.isnan(rate[i-1]) and not np.isnan(rate[i+1]):
+            curvature = rate[i-1] - 2*rate[i] + rate[i+1]
+            if curvature < 0:
+                offset = float(0.5*(rate[i-1] - rate[i+1])/curvature)
+
+        self.peak_altitude = float((i + 0.5 + offset)*self.bin_size)
+        self.peak_rate = float(rate[i])
+        variance = np.sum(self.m2[max(i-1, 0):i+2])/max(weight[i] - 1, 1)
+        self.peak_error = float(np.sqrt(variance/weight[i]))
+
+    @property
+    def passed(self):
+
+        """True once readings have been made confirm_margin above the
+           current maximum"""
+
+        if self.peak_altitude is None:
+            return False
+        return bool((self.highest + 1)*self.bin_size >= self.peak_altitude + self.confirm_margin)
+
+    def profile(self):
+
+        """Returns (altitude, readings, mean, standard deviation) for the
+           bins with readings, altitude being the centre of the bin"""
+
+        idx = np.flatnonzero(self.n)
+        n = self.n[idx]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(self.m2[idx]/(n - 1))
+        return (idx + 0.5)*self.bin_size, n, self.mean[idx], std
+
+    def summary(self):
+
+        """Compact summary of the maximum for the payload"""
+
+        return {
+            'pfotzer_alt': self.peak_altitude,
+            'pfotzer_cps': self.peak_rate,
+            'pfotzer_err': self.peak_error,
+            'pfotzer_passed': self.passed,
+            'profile_bins': int(np.count_nonzero(self.n)),
+        }
@@ -1,17 +1,31 @@
 from threading import Event
 from .thread_utils import start_threads, stop_threads, sensor_thread, process_thread
+from .scheduler import scheduler_thread
 import time
 
 
 
 class RunSensor: 
+
+    """Runs the sensors in the background
+
+       INPUTS:
+       sensor_dict: dict, a dictionary of sensor objects
+       backend: str, 'threads' runs one thread per sensor, 'scheduler'
+                runs every sensor from a single SensorScheduler thread
+       scheduler_kwargs: passed to the SensorScheduler, e.g. periods"""
     
-    def __init__(self, sensor_dict):
+    def __init__(self, sensor_dict, backend='threads', **scheduler_kwargs):
 
         self._sensor_dict = sensor_dict
 
         self._stop_event = Event()
-        self.threads = [sensor_thread(self._sensor_dict[k], self._stop_event) for k in self._sensor_dict]
+        if backend == 'scheduler':
+            self.threads = [scheduler_thread(self._sensor_dict, self._stop_event, **scheduler_kwargs)]
+        elif backend == 'threads':
+            self.threads = [sensor_thread(self._sensor_dict[k], self._stop_event) for k in self._sensor_dict]
+        else:
+            raise ValueError(f'Unknown sensor backend: {backend}')
         self.pause = 1
 
 
@@ -55,6 +69,15 @@ class RunProcesses:
     def teardown(self): 
         stop_threads(self._stop_event,self.threads)
 
+    def schedule_stats(self):
+
+        """FixedRate stats of each process run at a fixed rate, by class
+           name"""
+
+        return {type(process).__name__: thread.schedule.stats()
+                for process, thread in zip(self._processes, self.threads)
+                if thread.schedule is not None}
+
     def loop(self):
         pass
 
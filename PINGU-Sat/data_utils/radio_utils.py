@@ -6,17 +6,21 @@ class RunRadio:
 
     """Thread safe radio process class"""
 
-    def __init__(self, port):
+    def __init__(self, port, serial_factory=serial.Serial, radio_factory=SatRadio):
 
         """Initialiser.
         
         Input:
-            Serial port address of the radio"""
+            Serial port address of the radio
+            Callables creating the serial port and the radio, which can
+            be replaced by simulated ones"""
 
         self._port = {
             'port': port,
             'baudrate': 38400,
-            'timeout':2
+            'timeout':2,
+            #a write held up longer raises SerialTimeoutException
+            'write_timeout':2
         }
 
         self.radio_settings={
@@ -26,6 +30,8 @@ class RunRadio:
         
         self._serial=None
         self.radio = None
+        self._serial_factory = serial_factory
+        self._radio_factory = radio_factory
 
 
     def __enter__(self):
@@ -41,8 +47,8 @@ class RunRadio:
             -Opens the serial port provided as an argument
             -Creates the radio object using the serial port
             - """
-        self._serial=serial.Serial(**self._port)
-        self.radio = SatRadio(self._serial,**self.radio_settings)
+        self._serial=self._serial_factory(**self._port)
+        self.radio = self._radio_factory(self._serial,**self.radio_settings)
         self.radio.start()
 
     def send_data(self,msg):
@@ -57,3 +63,15 @@ class RunRadio:
 
     def loop(self):
         pass
+
+
+class AsyncRunRadio(RunRadio):
+
+    """Async context manager equivalent to RunRadio"""
+
+    async def __aenter__(self):
+        self.setup()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.teardown()
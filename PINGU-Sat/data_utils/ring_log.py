@@ -0,0 +1,265 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+
+#-------------------------------------------
+#File layout
+#
+#A ring log is a preallocated file made of a fixed header followed by a
+#circular data area. The header holds the offsets of the oldest record
+#(head) and of the next write (tail). Each record is a small header
+#(magic, length, sequence number, CRC32 of the payload) and its payload.
+#A wrap marker is written when a record does not fit before the end of
+#the data area, and the oldest records are overwritten as the log wraps.
+
+MAGIC = b'PNGR'
+VERSION = 1
+
+HEADER = struct.Struct('<4sIIIIQQ')
+HEADER_SIZE = 64
+
+RECORD = struct.Struct('<HHQI')
+RECORD_MAGIC = 0xA55A
+WRAP = 0xFFFF
+
+
+def record_crc(seq, payload):
+    return zlib.crc32(payload, seq & 0xFFFFFFFF)
+
+
+#-------------------------------------------
+
+class RingLogFile:
+
+    """A crash-safe, preallocated circular log written through mmap
+
+       Has the same interface as OutputFile so it can be used wherever an
+       OutputFile is, e.g. StoreData(file_factory=RingLogFile). Each write
+       is a memory store into the mapped file, and the header is updated
+       after every record so a reader can recover every complete record
+       after a power cut.
+
+       INPUTS:
+       filename: str, path of the log
+       capacity: int, size in bytes of the circular data area
+       sync_every: int [optional], msync the map every N records
+       encoding: str, used to encode str messages"""
+
+    def __init__(self, filename, capacity=16*1024*1024, sync_every=None, encoding='utf-8'):
+
+        if capacity > 0xFFFFFFFF or capacity < RECORD.size:
+            raise ValueError(f'Invalid ring log capacity: {capacity}')
+
+        self._filename = filename
+        self._capacity = capacity
+        self._sync_every = sync_every
+        self._encoding = encoding
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+
+        self._head = 0
+        self._tail = 0
+        self._seq = 0
+        self._count = 0
+        self._unsynced = 0
+
+    def __repr__(self):
+        return f'RingLogFile({self._filename}, capacity={self._capacity})'
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def open(self):
+
+        """Preallocates the file, maps it and writes an empty header"""
+
+        size = HEADER_SIZE + self._capacity
+        self._file = open(self._filename, 'w+b')
+        try:
+            os.posix_fallocate(self._file.fileno(), 0, size)
+        except (AttributeError, OSError):
+            self._file.truncate(size)
+
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._head = self._tail = self._seq = self._count = 0
+        self._write_header()
+        self._map.flush()
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+
+    def write(self, msg):
+
+        """Appends a message to the log as a single record"""
+
+        payload = msg.encode(self._encoding) if isinstance(msg, str) else bytes(msg)
+        with self._lock:
+            self._append(payload)
+
+    def writeline(self, msg, newline='\n'):
+        self.write(msg+newline)
+
+    def _append(self, payload):
+        size = RECORD.size + len(payload)
+        if size > self._capacity:
+            raise ValueError(f'Record of {size} bytes does not fit in {self}')
+
+        tail = self._tail
+        if tail + size > self._capacity:
+            self._evict(tail, self._capacity)
+            if self._capacity - tail >= RECORD.size:
+                RECORD.pack_into(self._map, HEADER_SIZE + tail, RECORD_MAGIC, WRAP, 0, 0)
+            tail = 0
+
+        self._evict(tail, tail + size)
+        if not self._count:
+            self._head = tail
+
+        seq = self._seq + 1
+        offset = HEADER_SIZE + tail
+        RECORD.pack_into(self._map, offset, RECORD_MAGIC, len(payload), seq, record_crc(seq, payload))
+        self._map[offset + RECORD.size:offset + size] = payload
+
+        self._tail = tail + size
+        self._seq = seq
+        self._count += 1
+        self._write_header()
+
+        self._unsynced += 1
+        if self._sync_every and self._unsynced >= self._sync_every:
+            self._map.flush()
+            self._unsynced = 0
+
+    def _evict(self, start, end):
+
+        """Drops the oldest records while they start inside [start, end)"""
+
+        while self._count and start <= self._head < end:
+            self._head = self._next(self._head)
+            self._count -= 1
+
+    def _next(self, offset):
+
+        """Returns the offset of the record after the one at offset"""
+
+        _, length, _, _ = RECORD.unpack_from(self._map, HEADER_SIZE + offset)
+        offset += RECORD.size + length
+        return wrapped(self._map, offset, self._capacity)
+
+    def _write_header(self):
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, self._capacity,
+                         self._head, self._tail, self._seq, self._count)
+
+
+def wrapped(buffer, offset, capacity):
+
+    """Moves an offset back to the start of the data area if it points at a
+       wrap marker or there is no room for a record before the end"""
+
+    if offset + RECORD.size > capacity:
+        return 0
+    magic, length, _, _ = RECORD.unpack_from(buffer, HEADER_SIZE + offset)
+    if magic == RECORD_MAGIC and length == WRAP:
+        return 0
+    return offset
+
+
+#-------------------------------------------
+
+def read_records(buffer, capacity, offset, seq=None):
+
+    """Reads consecutive valid records starting at offset. Stops at the
+       first record that is not valid or whose sequence number does not
+       follow on from the previous one"""
+
+    records = []
+    read = 0
+    while read < capacity:
+        offset = wrapped(buffer, offset, capacity)
+        magic, length, rec_seq, crc = RECORD.unpack_from(buffer, HEADER_SIZE + offset)
+        start = HEADER_SIZE + offset + RECORD.size
+        if magic != RECORD_MAGIC or offset + RECORD.size + length > capacity:
+            break
+        if seq is not None and rec_seq != seq + 1:
+            break
+        payload = bytes(buffer[start:start + length])
+        if record_crc(rec_seq, payload) != crc:
+            break
+        records.append((rec_seq, payload))
+        seq = rec_seq
+        offset += RECORD.size + length
+        read += RECORD.size + length
+    return records
+
+
+def scan_records(buffer, capacity):
+
+    """Finds every valid record in the data area regardless of the header,
+       used when the header itself cannot be trusted"""
+
+    records = {}
+    pattern = struct.pack('<H', RECORD_MAGIC)
+    data = bytes(buffer[HEADER_SIZE:HEADER_SIZE + capacity])
+    offset = data.find(pattern)
+    while offset != -1:
+        if offset + RECORD.size <= capacity:
+            _, length, seq, crc = RECORD.unpack_from(data, offset)
+            start = offset + RECORD.size
+            if length != WRAP and start + length <= capacity:
+                payload = data[start:start + length]
+                if record_crc(seq, payload) == crc:
+                    records[seq] = payload
+        offset = data.find(pattern, offset + 1)
+
+    #keep the newest run of consecutive sequence numbers
+    run = []
+    for seq in sorted(records, reverse=True):
+        if run and seq != run[-1][0] - 1:
+            break
+        run.append((seq, records[seq]))
+    return run[::-1]
+
+
+def read_ring_log(filename):
+
+    """Recovers every complete record from a ring log, oldest first
+
+       Records are read from the head offset in the header. Records written
+       after the last header update are picked up as long as their sequence
+       numbers carry on, and if the header is damaged the whole data area is
+       scanned instead. Returns a list of payload bytes"""
+
+    with open(filename, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, _, capacity, head, _, _, count = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or capacity + HEADER_SIZE > len(buffer):
+            return [payload for _, payload in scan_records(buffer, len(buffer) - HEADER_SIZE)]
+
+        records = read_records(buffer, capacity, head) if count else []
+        if count and not records:
+            records = scan_records(buffer, capacity)
+        return [payload for _, payload in records]
+
+    finally:
+        buffer.close()
+
+
+def read_ring_lines(filename, encoding='utf-8'):
+
+    """Recovers the lines written to a ring log with writeline"""
+
+    return [payload.decode(encoding).rstrip('\n') for payload in read_ring_log(filename)]
@@ -0,0 +1,381 @@
+import glob
+import logging
+import lzma
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+from .thread_utils import OutputFile, ConsumerThread
+
+
+#-------------------------------------------
+#Compression
+#
+#Each compressed frame is a complete gzip member (zlib) or xz stream
+#(lzma). Concatenated members and streams are themselves valid .gz and .xz
+#files, so a log can be read with zcat or xzcat, and read_segment recovers
+#every complete frame of a file cut short by a power loss.
+
+#compression: file extension, default level
+COMPRESSIONS = {
+    'zlib': ('.gz', 6),
+    'lzma': ('.xz', 1),
+}
+
+#bytes read at a time when compressing a closed segment
+CHUNK = 256*1024
+
+
+def compressor(kind, level=None):
+
+    """Compressor producing one gzip member (zlib) or xz stream (lzma)"""
+
+    if kind not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression: {kind}')
+    level = COMPRESSIONS[kind][1] if level is None else level
+    if kind == 'zlib':
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    return lzma.LZMACompressor(preset=level)
+
+
+def decompressor(kind):
+    if kind == 'zlib':
+        return zlib.decompressobj(31)
+    return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+
+def decode_frames(data, kind):
+
+    """Decompresses consecutive frames until the data ends or a frame is
+       truncated or damaged. Returns the list of decompressed frames and
+       the bytes that could not be decoded"""
+
+    frames = []
+    while data:
+        frame = decompressor(kind)
+        try:
+            out = frame.decompress(data)
+        except (zlib.error, lzma.LZMAError):
+            break
+        if not frame.eof:
+            break
+        frames.append(out)
+        data = frame.unused_data
+    return frames, data
+
+
+def compression_of(path):
+
+    """The compression of a file from its extension, None if plain"""
+
+    for kind, (extension, _) in COMPRESSIONS.items():
+        if path.endswith(extension):
+            return kind
+    return None
+
+
+#-------------------------------------------
+
+class RotatingFile(OutputFile):
+
+    """OutputFile writing a series of segments, each closed and replaced
+       by the next after max_bytes of records or interval seconds
+
+       Segments are named after the file, {base}.0001{ext}, {base}.0002{ext}
+       and so on. With compress, each closed segment is compressed to .gz
+       or .xz by a background thread and the text removed; a compression
+       still running when the file is closed is abandoned and the text kept.
+       With stream, records are compressed as they are written, in frames
+       of up to frame_bytes of records or frame_interval seconds, so the card
+       only sees the compressed frames and a truncated segment loses at most
+       the frame being written. It has the same interface as OutputFile,
+       e.g. StoreData(file_factory=RotatingFile, file_options={...}).
+
+       Stream mode trades durability for storage: the records of the frame
+       being written are only in memory, so a power loss loses up to
+       frame_interval seconds of them, and shortening frame_interval makes
+       smaller frames that compress poorly. With compress the open segment
+       is text, written like an OutputFile's.
+
+       INPUTS:
+       filename: str, path the segments are named after
+       max_bytes: int [optional], bytes of records per segment, before
+                  compression
+       interval: float [optional], seconds per segment
+       compress: str [optional], 'zlib' or 'lzma', compresses the closed
+                 segments in the background
+       stream: str [optional], 'zlib' or 'lzma', writes the segments as
+               independently decodable compressed frames
+       frame_bytes: int, bytes of records per frame in stream mode
+       frame_interval: float, longest time a record is held before its
+                       frame is written in stream mode, checked as records
+                       arrive
+       level: int [optional], compression level (preset for lzma)
+       kwargs: passed to OutputFile, e.g. group_commit, fsync_interval"""
+
+    def __init__(self, filename, max_bytes=None, interval=None, compress=None, stream=None,
+                 frame_bytes=64*1024, frame_interval=60.0, level=None, **kwargs):
+
+        for kind in (compress, stream):
+            if kind is not None and kind not in COMPRESSIONS:
+                raise ValueError(f'Unknown compression: {kind}')
+        if compress and stream:
+            raise ValueError('A RotatingFile either compresses closed segments or streams, not both')
+
+        self._encoding_name = kwargs.get('encoding') or 'utf-8'
+        if stream:
+            kwargs.update(mode='wb', buffering=-1, encoding=None)
+        super().__init__(filename, **kwargs)
+
+        self._max_bytes = max_bytes
+        self._interval = interval
+        self._compress = compress
+        self._stream = stream
+        self._frame_bytes = frame_bytes
+        self._frame_interval = frame_interval
+        self._level = level
+
+        self.path = None
+        self.segments = []
+        self._index = 0
+        self._segment_bytes = 0
+        self._segment_started = None
+
+        self._frame = None
+        self._frame_parts = []
+        self._frame_in = 0
+        self._frame_records = 0
+        self._frame_started = None
+
+        self._pending = queue.Queue()
+        self._compressor = None
+        self._stopping = threading.Event()
+
+        self.rotations = 0
+        self.frames = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compressed = 0
+        self.bytes_compressed = 0
+
+    def __repr__(self):
+        return (f'RotatingFile({self._filename}, max_bytes={self._max_bytes}, interval={self._interval}, '
+                f'compress={self._compress}, stream={self._stream})')
+
+    def segment_path(self, index):
+        base, ext = os.path.splitext(self._filename)
+        path = f'{base}.{index:04d}{ext}'
+        if self._stream:
+            path += COMPRESSIONS[self._stream][0]
+        return path
+
+    def open(self):
+        self._stopping.clear()
+        if self._compress:
+            self._compressor = ConsumerThread(self._pending, self._compress_segment, timeout=1)
+            self._compressor.start()
+        super().open()
+
+    #---------------------------------------
+    #Segments, written from the consumer thread
+
+    def _open_file(self):
+        self._index += 1
+        self.path = self.segment_path(self._index)
+        self._segment_bytes = 0
+        self._segment_started = time.monotonic()
+        if self._stream:
+            self._start_frame()
+        return open(self.path, mode=self._mode, buffering=self._buffering, encoding=self._encoding)
+
+    def _close_file(self):
+        self._end_segment()
+        if self._fsync_every or self._fsync_interval:
+            self._fsync()
+        self._file.close()
+
+        if self._compressor is not None:
+            self._stopping.set()
+            self._compressor.stop()
+            self._compressor = None
+            left = self._pending.qsize()
+            if left:
+                logging.info(f'Rotating File - {left} segments left uncompressed')
+
+    def _end_segment(self):
+        if self._stream:
+            self._end_frame()
+        self.segments.append(self.path)
+
+    def _rotation_due(self):
+        if not self._segment_bytes:
+            return False
+        if self._max_bytes and self._segment_bytes >= self._max_bytes:
+            return True
+        if self._interval and time.monotonic() - self._segment_started >= self._interval:
+            return True
+        return False
+
+    def _rotate(self):
+        self._end_segment()
+        self._file.close()
+        if self._compress:
+            self._pending.put(self.path)
+        self._file = self._open_file()
+        self.rotations += 1
+
+    def _write_batch(self, msgs):
+        """Writes a list of records to the current segment, rotating it
+        first if it is due."""
+        if self._rotation_due():
+            self._rotate()
+
+        size = sum(len(m) for m in msgs)
+        self._segment_bytes += size
+        self.bytes_in += size
+        if not self._stream:
+            super()._write_batch(msgs)
+            self.bytes_out += size
+            return
+
+        start = time.perf_counter()
+        data = msgs[0][:0].join(msgs)
+        if isinstance(data, str):
+            data = data.encode(self._encoding_name)
+        self._frame_parts.append(self._frame.compress(data))
+        self._frame_in += len(data)
+        self._frame_records += len(msgs)
+        if (self._frame_in >= self._frame_bytes or
+                time.monotonic() - self._frame_started >= self._frame_interval):
+            self._end_frame()
+        self.stats.record_batch(len(msgs), time.perf_counter() - start)
+
+    #---------------------------------------
+    #Stream mode frames
+
+    def _start_frame(self):
+        self._frame = compressor(self._stream, self._level)
+        self._frame_parts = []
+        self._frame_in = 0
+        self._frame_records = 0
+        self._frame_started = time.monotonic()
+
+    def _end_frame(self):
+
+        """Completes the current frame and writes it in one call"""
+
+        if not self._frame_records:
+            return
+        self._frame_parts.append(self._frame.flush())
+        frame = b''.join(self._frame_parts)
+        self._file.write(frame)
+        self._file.flush()
+        self.frames += 1
+        self.bytes_out += len(frame)
+
+        self._unsynced += self._frame_records
+        if self._fsync_due():
+            self._fsync()
+        self._start_frame()
+
+    #---------------------------------------
+    #Background compression of closed segments
+
+    def _compress_segment(self, path):
+        target = path + COMPRESSIONS[self._compress][0]
+        tmp = f'{target}.tmp'
+        frame = compressor(self._compress, self._level)
+        try:
+            with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+                while True:
+                    if self._stopping.is_set():
+                        break
+                    chunk = src.read(CHUNK)
+                    if not chunk:
+                        dst.write(frame.flush())
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                        break
+                    dst.write(frame.compress(chunk))
+
+            if self._stopping.is_set():
+                os.remove(tmp)
+                logging.info(f'Rotating File - compression of {os.path.basename(path)} abandoned')
+                return
+            size = os.path.getsize(tmp)
+            os.replace(tmp, target)
+            os.remove(path)
+
+        except OSError as exc:
+            logging.info(f'Rotating File - compress {type(exc).__name__}')
+            return
+
+        self.compressed += 1
+        self.bytes_compressed += size
+
+    def summary(self):
+
+        """Segments and frames written, bytes of records in, bytes written
+           to the segments and bytes of the compressed closed segments"""
+
+        return {
+            'segments': self._index,
+            'rotations': self.rotations,
+            'frames': self.frames,
+            'compressed': self.compressed,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_compressed': self.bytes_compressed,
+        }
+
+
+#-------------------------------------------
+#Reading logs after recovery
+
+def read_segment(path):
+
+    """Returns the records of one segment as bytes. A compressed segment
+       is decoded frame by frame, and a truncated or damaged last frame is
+       dropped with a log message"""
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    kind = compression_of(path)
+    if kind is None:
+        return data
+
+    frames, rest = decode_frames(data, kind)
+    if rest:
+        logging.info(f'Rotating File - {len(rest)} undecodable bytes at the end of {os.path.basename(path)}')
+    return b''.join(frames)
+
+
+def segment_paths(filename):
+
+    """Paths of every segment of a RotatingFile in order. A segment found
+       both compressed and as text (the compression finished but the text
+       was not yet removed) is given once, compressed"""
+
+    base, ext = os.path.splitext(filename)
+    pattern = re.compile(re.escape(base) + r'\.(\d{4})' + re.escape(ext) + r'(\.gz|\.xz)?$')
+    segments = {}
+    for path in glob.glob(f'{glob.escape(base)}.*{glob.escape(ext)}*'):
+        match = pattern.match(path)
+        if match is None:
+            continue
+        index = int(match.group(1))
+        if index not in segments or match.group(2):
+            segments[index] = path
+    return [segments[i] for i in sorted(segments)]
+
+
+def read_rotated_lines(filename, encoding='utf-8'):
+
+    """Every line written to a RotatingFile, across all its segments"""
+
+    lines = []
+    for path in segment_paths(filename):
+        lines.extend(read_segment(path).decode(encoding, 'replace').splitlines())
+    return lines
@@ -0,0 +1,277 @@
+import heapq
+import logging
+import os
+import selectors
+import threading
+import time
+from .thread_utils import loop_thread, bind_stop_event, cancel_wait
+
+
+#-------------------------------------------
+
+def sensor_fileno(sensor):
+
+    """Returns the file descriptor of a sensor's serial port, or None
+       if the sensor is not read through a serial port"""
+
+    port = getattr(sensor, 'serial', None)
+    if port is None:
+        return None
+    try:
+        return port.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def sensor_delay(sensor, now):
+
+    """Returns the seconds until a polled sensor can give its next
+       reading, or None if it does not say and is read at a fixed period"""
+
+    delay = getattr(sensor, 'delay', None)
+    if delay is None:
+        return None
+    return delay(now)
+
+
+def service(sensor, readable=False):
+
+    """Performs a single read of a sensor.
+
+       Serial sensors that provide an on_readable method are given the
+       chance to consume whatever is waiting on the port without blocking
+       for a full sentence, and sensors that provide a poll method take
+       their latest result without waiting for the next one. Everything
+       else falls back to update. Returns False if on_readable found the
+       port failed or at EOF, when it would stay readable with nothing to
+       read"""
+
+    if readable and hasattr(sensor, 'on_readable'):
+        return sensor.on_readable()
+    if hasattr(sensor, 'poll'):
+        sensor.poll()
+        return
+    sensor.update()
+
+
+#-------------------------------------------
+
+class SensorScheduler:
+
+    """Single-threaded reactor that services every sensor from one loop
+
+       Serial sensors (GPS, Geiger) are multiplexed with selectors and read
+       as soon as their port has data. Sensors without a file descriptor
+       (w1 temperature probes, I2C pressure sensor) are read from a timer
+       heap: polled when their delay says the next reading is ready, or at
+       a fixed period if they have no delay or one is given in periods.
+       Nothing in the loop waits on a sensor. A serial port that fails or reaches EOF
+       stays readable, so it is unregistered and registered again after
+       backoff seconds rather than read in a busy loop.
+
+       INPUTS:
+       sensor_dict: dict, a dictionary of sensor objects
+       periods: dict [optional], read period in seconds per sensor key
+       default_period: float, read period for timer sensors not in periods
+       tick: float, longest time the loop blocks in select
+       backoff: float, seconds a failed serial port is left before it is
+                read again"""
+
+    def __init__(self, sensor_dict, periods=None, default_period=1, tick=0.1, backoff=5):
+
+        self._sensor_dict = sensor_dict
+        self._periods = periods if periods else {}
+        self._default_period = default_period
+        self._tick = tick
+        self._backoff = backoff
+
+        self._selector = None
+        self._timers = []
+        #(deadline, key) of the serial sensors waiting out a back-off
+        self._suspended = []
+        #self-pipe that wakes the select when the scheduler is stopped
+        self._wake_fds = None
+        self._wake_lock = threading.Lock()
+
+        #number of timer reads that started after their deadline had passed
+        self.overruns = 0
+        #largest delay between a timer deadline and the read starting
+        self.max_lateness = 0.0
+
+
+    def __enter__(self):
+        self.setup()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.teardown()
+
+    def period(self, key):
+        return self._periods.get(key, self._default_period)
+
+    def setup(self):
+
+        """Setup step which starts every sensor and registers it either
+           with the selector or on the timer heap"""
+
+        self._selector = selectors.DefaultSelector()
+        self._timers = []
+        self._suspended = []
+        now = time.monotonic()
+
+        with self._wake_lock:
+            self._wake_fds = os.pipe()
+        for fd in self._wake_fds:
+            os.set_blocking(fd, False)
+        self._selector.register(self._wake_fds[0], selectors.EVENT_READ, None)
+
+        for k, sensor in self._sensor_dict.items():
+            sensor.setup()
+            fd = sensor_fileno(sensor)
+            if fd is None:
+                heapq.heappush(self._timers, (now, k))
+            else:
+                self._selector.register(fd, selectors.EVENT_READ, k)
+
+    def teardown(self):
+
+        """Teardown step which closes the selector and every sensor"""
+
+        self._selector.close()
+        with self._wake_lock:
+            for fd in self._wake_fds:
+                os.close(fd)
+            self._wake_fds = None
+        for sensor in self._sensor_dict.values():
+            sensor.teardown()
+
+    def cancel(self):
+
+        """Wakes the loop from select and every sensor from a blocking
+           wait, once the stop event is set"""
+
+        with self._wake_lock:
+            if self._wake_fds is not None:
+                try:
+                    os.write(self._wake_fds[1], b'\0')
+                except BlockingIOError:
+                    pass
+        for sensor in self._sensor_dict.values():
+            cancel = cancel_wait(sensor)
+            if cancel is not None:
+                cancel()
+
+    def timeout(self):
+
+        """Time until the next timer or back-off deadline, capped at the
+           tick"""
+
+        deadlines = [heap[0][0] for heap in (self._timers, self._suspended) if heap]
+        if not deadlines:
+            return self._tick
+        return min(self._tick, max(0.0, min(deadlines) - time.monotonic()))
+
+    def step(self):
+
+        """Runs one iteration of the loop: waits for serial data or the next
+           timer deadline and services every sensor that is due"""
+
+        for key, _ in self._selector.select(self.timeout()):
+            if key.data is None:
+                self._drain_wake()
+                return
+            if self._service(key.data, readable=True) is False:
+                self._suspend(key.data, key.fd)
+
+        now = time.monotonic()
+        while self._suspended and self._suspended[0][0] <= now:
+            _, k = heapq.heappop(self._suspended)
+            self._resume(k)
+
+        while self._timers and self._timers[0][0] <= now:
+            deadline, k = heapq.heappop(self._timers)
+
+            lateness = now - deadline
+            self.max_lateness = max(self.max_lateness, lateness)
+
+            self._service(k)
+
+            now = time.monotonic()
+            delay = None if k in self._periods else self._delay(k, now)
+            if delay is not None:
+                heapq.heappush(self._timers, (now + delay, k))
+                continue
+
+            #schedule against the deadline so the period does not drift,
+            #skipping any slots that were missed entirely
+            period = self.period(k)
+            deadline += period
+            now = time.monotonic()
+            if deadline <= now:
+                self.overruns += 1
+                deadline += period*((now - deadline)//period + 1)
+            heapq.heappush(self._timers, (deadline, k))
+
+    def _drain_wake(self):
+        try:
+            while os.read(self._wake_fds[0], 64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _service(self, k, readable=False):
+        try:
+            return service(self._sensor_dict[k], readable)
+        except Exception as exc:
+            #one failing sensor should not stop the others being read
+            logging.info(f'Scheduler - {k} {type(exc).__name__}')
+            return False
+
+    def _delay(self, k, now):
+        try:
+            return sensor_delay(self._sensor_dict[k], now)
+        except Exception as exc:
+            logging.info(f'Scheduler - {k} delay {type(exc).__name__}')
+            return None
+
+    def _suspend(self, k, fd):
+
+        """Stops selecting a failed port until the back-off has passed"""
+
+        self._selector.unregister(fd)
+        heapq.heappush(self._suspended, (time.monotonic() + self._backoff, k))
+
+    def _resume(self, k):
+
+        """Selects a suspended port again, or waits another back-off if
+           it cannot be"""
+
+        fd = sensor_fileno(self._sensor_dict[k])
+        try:
+            if fd is None:
+                raise ValueError('no file descriptor')
+            self._selector.register(fd, selectors.EVENT_READ, k)
+        except (KeyError, OSError, ValueError) as exc:
+            logging.info(f'Scheduler - {k} {type(exc).__name__}')
+            heapq.heappush(self._suspended, (time.monotonic() + self._backoff, k))
+
+
+#--------------------------------------------------------
+
+def scheduler_thread(sensor_dict, stop_event, **kwargs):
+
+    """Creates a single thread that runs a SensorScheduler for every sensor"""
+
+    for sensor in sensor_dict.values():
+        bind_stop_event(sensor, stop_event)
+    scheduler = SensorScheduler(sensor_dict, **kwargs)
+
+    thread = loop_thread(
+        loop=scheduler.step,
+        setup=scheduler.setup,
+        teardown=scheduler.teardown,
+        stop_event=stop_event,
+        cancel=scheduler.cancel
+    )
+    thread.scheduler = scheduler
+    return thread
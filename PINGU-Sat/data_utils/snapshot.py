@@ -0,0 +1,196 @@
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+
+#-------------------------------------------
+
+Sample = namedtuple('Sample', ['value', 'timestamp', 'seq'])
+Sample.__doc__ = """A published sensor value with its monotonic timestamp and sequence number"""
+
+
+def freeze(value):
+
+    """Returns an immutable copy of list values so a published sample
+       cannot be changed by the sensor that produced it"""
+
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+class Frame:
+
+    """Immutable view of the latest sample from every sensor
+
+       seq: int, sequence number of the newest sample in the frame
+       timestamp: float, monotonic time of the newest sample
+       samples: mapping of sensor key to Sample
+       data: mapping of sensor key to value, as from generate_data_dict"""
+
+    __slots__ = ('seq', 'timestamp', 'samples', 'data')
+
+    def __init__(self, seq, timestamp, samples):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.samples = MappingProxyType(samples)
+        self.data = MappingProxyType({k: samples[k].value for k in samples})
+
+    def __repr__(self):
+        return f'Frame(seq={self.seq}, data={dict(self.data)})'
+
+
+#-------------------------------------------
+
+class SnapshotBus:
+
+    """Versioned store that every sensor publishes its samples into
+
+       Each publish builds a new immutable Frame and swaps it in, so readers
+       take the current frame without locking and always see values from a
+       single consistent point in time. Writers are serialised by a lock
+       whose condition wakes readers waiting for a newer frame. Subscribers
+       are called with every sample after it is published."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = Frame(0, None, {})
+        self._subscribers = []
+
+    def __repr__(self):
+        return f'SnapshotBus(seq={self._frame.seq})'
+
+    def publish(self, key, value, timestamp=None):
+
+        """Publishes a sensor value and returns its sequence number"""
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        with self._cond:
+            seq = self._frame.seq + 1
+            samples = dict(self._frame.samples)
+            samples[key] = Sample(freeze(value), timestamp, seq)
+            self._frame = Frame(seq, timestamp, samples)
+            self._cond.notify_all()
+
+        for callback in self._subscribers:
+            callback(key, value, timestamp)
+        return seq
+
+    def subscribe(self, callback):
+
+        """Calls callback(key, value, timestamp) after each publish, in the
+           publishing thread and outside the lock, so a subscriber can
+           publish derived values itself"""
+
+        self._subscribers = self._subscribers + [callback]
+
+    def frame(self):
+
+        """Returns the latest frame without blocking"""
+
+        return self._frame
+
+    def wait_newer(self, seq, timeout=None):
+
+        """Waits until a frame newer than seq is published and returns the
+           latest frame. Returns the current frame if timeout expires"""
+
+        with self._cond:
+            self._cond.wait_for(lambda: self._frame.seq > seq, timeout)
+            return self._frame
+
+    @property
+    def seq(self):
+        return self._frame.seq
+
+    @property
+    def data(self):
+        return self._frame.data
+
+    def attach(self, sensor_dict):
+
+        """Wraps every sensor in a dictionary so that it publishes to the bus
+           after each read. The initial value of each sensor is published so
+           the first frame already has every key"""
+
+        for k in sensor_dict:
+            self.publish(k, sensor_dict[k].data)
+        return {k: PublishedSensor(sensor_dict[k], k, self) for k in sensor_dict}
+
+
+#-------------------------------------------
+
+class PublishedSensor:
+
+    """Wraps a sensor so each read is published to a SnapshotBus
+
+       The wrapper keeps the sensor setup/update/teardown/data protocol and
+       forwards any other attribute (e.g. serial) to the wrapped sensor, so
+       it can be used by RunSensor, the SensorScheduler and AsyncRunSensor.
+       A sensor with an acquired attribute (monotonic time of its last read)
+       is published with that timestamp, otherwise with the publish time"""
+
+    def __init__(self, sensor, key, bus):
+
+        self._sensor = sensor
+        self._key = key
+        self._snapshot_bus = bus
+        self._last = sensor.data
+
+        if hasattr(sensor, 'on_readable'):
+            self.on_readable = self._on_readable
+        if hasattr(sensor, 'poll'):
+            self.poll = self._poll
+
+    def __getattr__(self, name):
+        return getattr(self._sensor, name)
+
+    def __repr__(self):
+        return f'PublishedSensor({self._sensor!r}, key={self._key!r})'
+
+    def setup(self):
+        self._sensor.setup()
+
+    def teardown(self):
+        self._sensor.teardown()
+
+    def update(self):
+        self._sensor.update()
+        #reads that did not produce a new value are not published
+        if self._sensor.data is not self._last:
+            self.publish()
+
+    def _on_readable(self):
+        readable = self._sensor.on_readable()
+        #serial reads that did not produce a new sentence are not published
+        if self._sensor.data is not self._last:
+            self.publish()
+        return readable
+
+    def _poll(self):
+        updated = self._sensor.poll()
+        if self._sensor.data is not self._last:
+            self.publish()
+        return updated
+
+    def publish(self):
+        self._last = self._sensor.data
+        #sensors that sleep after reading give the time of the read
+        acquired = getattr(self._sensor, 'acquired', None)
+        self._snapshot_bus.publish(self._key, self._last, acquired)
+
+    @property
+    def data(self):
+        return self._sensor.data
+
+    @property
+    def stop_event(self):
+        return self._sensor.stop_event
+
+    @stop_event.setter
+    def stop_event(self, stop_event):
+        #bound to the wrapped sensor, whose waits use it
+        self._sensor.stop_event = stop_event
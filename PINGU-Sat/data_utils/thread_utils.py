@@ -1,8 +1,11 @@
+import logging
+import os
 import queue
 import threading
 import time
 from queue import Queue
 import contextlib
+from .latency import LatencyHistogram
 
 
 #-------------------------------------------
@@ -20,7 +23,95 @@ def catch_and_suppress(*exc,callback=None):
     return
 #--------------------------------------------
 
-def repeat(target, condition = None): 
+class FixedRate:
+
+    """Schedules loop iterations against absolute time.monotonic() deadlines
+
+       Each iteration starts one period after the deadline of the last, not
+       one period after it finished, so the work time does not add to the
+       period and the loop does not drift. An iteration that starts after
+       its deadline is an overrun and runs at once. If whole periods have
+       been missed they are skipped rather than run in a burst, keeping the
+       original phase. The lateness of every iteration is recorded in a
+       LatencyHistogram as its jitter.
+
+       INPUTS:
+       period: float, seconds between iterations
+       stop_event: threading.Event [optional], ends a wait early when set"""
+
+    def __init__(self, period, stop_event=None):
+
+        if not period > 0:
+            raise ValueError(f'Period must be positive: {period}')
+
+        self.period = period
+        self._stop_event = stop_event
+        self.deadline = None
+
+        self.iterations = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter = LatencyHistogram(highest=max(60.0, 10*period))
+
+    def __repr__(self):
+        return f'FixedRate(period={self.period}, iterations={self.iterations}, overruns={self.overruns})'
+
+    def delay(self, now=None):
+
+        """Seconds to wait until the next deadline. Counts an overrun, and
+           skips missed periods, if the deadline has already passed"""
+
+        now = time.monotonic() if now is None else now
+        if self.deadline is None:
+            self.deadline = now
+        if now <= self.deadline:
+            return self.deadline - now
+
+        self.overruns += 1
+        missed = int((now - self.deadline)//self.period)
+        if missed:
+            self.skipped += missed
+            self.deadline += missed*self.period
+        return 0.0
+
+    def start(self, now=None):
+
+        """Records the jitter of an iteration starting now and moves the
+           deadline on by one period"""
+
+        now = time.monotonic() if now is None else now
+        self.jitter.record(now - self.deadline)
+        self.iterations += 1
+        self.deadline += self.period
+
+    def wait(self):
+
+        """Waits for the next deadline. Returns False if the stop event was
+           set while waiting"""
+
+        delay = self.delay()
+        if delay > 0:
+            if self._stop_event is not None:
+                if self._stop_event.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+        self.start()
+        return True
+
+    def stats(self):
+        return {
+            'period': self.period,
+            'iterations': self.iterations,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'jitter': self.jitter.summary(),
+        }
+
+
+#--------------------------------------------
+
+def repeat(target, condition = None, schedule = None): 
     
     """Repeat target indefinitely, or until condition met
     
@@ -31,20 +122,25 @@ def repeat(target, condition = None):
         condition: callable [optional]
             a function whose result is used to determine if the next
             iteration of the loop continues.
+
+        schedule: FixedRate [optional]
+            runs target at a fixed rate instead of back to back
     """
 
     while (True if condition is None else condition()):
+        if schedule is not None and not schedule.wait():
+            break
         target()
         
 
-def run(loop, setup=None, teardown=None, keep_running=None): 
+def run(loop, setup=None, teardown=None, keep_running=None, schedule=None): 
     
     """Initialises a sensor class with setup, loop, teardown steps"""
     
     if setup:
         setup()
     try: 
-        repeat(loop, keep_running)
+        repeat(loop, keep_running, schedule)
         
     finally:
         if teardown: 
@@ -54,25 +150,52 @@ def run(loop, setup=None, teardown=None, keep_running=None):
 
 def loop(sensor):
     
-    """Updates a sensor class attribute when included in a loop"""
+    """Updates a sensor class attribute when included in a loop. Run it
+       with a FixedRate schedule to set the period"""
     
     def _loop():
         sensor.update()
         print(f"{time.time(): .6f} : {sensor._data}")
-        time.sleep(2)
     return _loop 
 
 #------------------------------------------
 
+def bind_stop_event(target, stop_event):
+
+    """Gives a sensor or process the stop event of the thread running it,
+       so that its waits (Event.wait in place of time.sleep) end as soon as
+       the thread is stopped"""
+
+    target.stop_event = stop_event
+    return target
+
+
+def cancel_wait(target):
+
+    """The cancel method of a sensor or process, which wakes it from a
+       blocking call (e.g. a serial read) once its stop event is set, or
+       None if it has none"""
+
+    return getattr(target, 'cancel', None)
+
+
+#------------------------------------------
+
 class LoopThread(threading.Thread):
-    """Execute function in an infinite loop with optional setup/teardown"""
-    def __init__(self, loop, setup=None, teardown=None):
+    """Execute function in an infinite loop with optional setup/teardown.
+    Given a rate (iterations per second) the loop runs at a fixed rate
+    from a FixedRate schedule, kept in the schedule attribute. cancel is
+    called by stop after the stop event is set, to wake a loop blocked
+    waiting on something other than the event"""
+    def __init__(self, loop, setup=None, teardown=None, rate=None, cancel=None):
 
         self._stop_event = threading.Event()
 
         self._loop = loop 
         self._setup = setup 
         self._teardown = teardown
+        self._cancel = cancel
+        self.schedule = FixedRate(1/rate, self._stop_event) if rate else None
 
         super().__init__() #allows us to use the properties of this class in subclasses
 
@@ -80,6 +203,8 @@ class LoopThread(threading.Thread):
         self.setup()
         try: 
             while self.is_running():
+                if self.schedule is not None and not self.schedule.wait():
+                    break
                 self.loop()
 
         finally: 
@@ -102,8 +227,13 @@ class LoopThread(threading.Thread):
     def stop(self):
         """Terminate the looped thread's execution."""
         self._stop_event.set()
+        self.cancel()
         self.join()
 
+    def cancel(self):
+        if self._cancel:
+            self._cancel()
+
     def __enter__(self): 
         self.start()
         return self
@@ -114,6 +244,10 @@ class LoopThread(threading.Thread):
 
 #----------------------------------------------
 
+#put on a consumer's queue to wake it when it is stopped, never consumed
+WAKE = object()
+
+
 class ConsumerThread(LoopThread):
     """Waits for item in a queue and consumes them"""
     def __init__(self, queue, func, timeout): 
@@ -126,6 +260,12 @@ class ConsumerThread(LoopThread):
     def loop(self):
         consume(self.queue, self._func, self._timeout)
 
+    def cancel(self):
+        """Wakes the consumer from its wait on the queue. A full queue
+        wakes it anyway"""
+        with contextlib.suppress(queue.Full):
+            self.queue.put_nowait(WAKE)
+
 def consume(q, func, timeout=None):
 
     try:
@@ -135,7 +275,31 @@ def consume(q, func, timeout=None):
         pass
 
     else:
-        func(item)
+        if item is not WAKE:
+            func(item)
+
+
+class BatchConsumerThread(ConsumerThread):
+    """Waits for items in a queue and consumes everything queued at once"""
+    def loop(self):
+        consume_batch(self.queue, self._func, self._timeout)
+
+def consume_batch(q, func, timeout=None):
+    """Waits for an item then drains the queue, passing func a list"""
+    try:
+        items = [q.get(timeout=timeout)]
+
+    except queue.Empty:
+        return
+
+    while True:
+        try:
+            items.append(q.get_nowait())
+        except queue.Empty:
+            break
+    items = [item for item in items if item is not WAKE]
+    if items:
+        func(items)
 
 
 #--------------------------------------------
@@ -162,17 +326,63 @@ def produce(q, func):
 
 #----------------------------------------------
 
+class WriteStats:
+    """Counters kept by an OutputFile's consumer thread"""
+    def __init__(self):
+        self.records        = 0
+        self.batches        = 0
+        self.max_batch      = 0
+        self.fsyncs         = 0
+        self.dropped        = 0
+        self.max_queue      = 0
+        self.write_time     = 0.0
+        self.max_write_time = 0.0
+
+    def record_batch(self, size, elapsed):
+        self.records        += size
+        self.batches        += 1
+        self.max_batch       = max(self.max_batch, size)
+        self.write_time     += elapsed
+        self.max_write_time  = max(self.max_write_time, elapsed)
+
+    def summary(self):
+        batches = max(self.batches, 1)
+        return {
+            'records'           : self.records,
+            'batches'           : self.batches,
+            'mean_batch'        : self.records/batches,
+            'max_batch'         : self.max_batch,
+            'mean_write_latency': self.write_time/batches,
+            'max_write_latency' : self.max_write_time,
+            'fsyncs'            : self.fsyncs,
+            'dropped'           : self.dropped,
+            'max_queue_depth'   : self.max_queue,
+        }
+
+
 class OutputFile:
     """A thread-safe file output."""
     def __init__(self, filename, mode='w', buffering=1, encoding=None,
-                 timeout=1):
+                 timeout=1, group_commit=False, fsync_every=None,
+                 fsync_interval=None, maxsize=0, overflow='block'):
         """Initialiser.
         ==========
         Parameters
         ==========
         filename, mode, buffering, encoding are passed to the built-in open.
         timeout is passed to ConsumerThread
+        group_commit: drain everything queued and write it with one write
+            call and one flush, instead of one write per message
+        fsync_every: fsync after this many records [optional]
+        fsync_interval: fsync when this many seconds have passed since the
+            last fsync [optional]. With neither set the file is never fsynced
+        maxsize: bound on queued messages, 0 for unbounded
+        overflow: 'block' makes write wait for space in a full queue,
+            'drop' discards the message and counts it in stats
         """
+        if overflow not in ('block', 'drop'):
+            raise ValueError(f'Unknown overflow policy: {overflow}')
+
         # file arguments
         self._filename  = filename
         self._mode      = mode
@@ -181,8 +391,17 @@ class OutputFile:
         
         # consumer thread arguments
         self._timeout  = timeout
-        
-        self._queue = Queue()
+        self._group_commit = group_commit
+
+        # durability policy
+        self._fsync_every    = fsync_every
+        self._fsync_interval = fsync_interval
+        self._unsynced       = 0
+        self._last_fsync     = time.monotonic()
+
+        self._overflow = overflow
+        self._queue = Queue(maxsize)
+        self.stats = WriteStats()
 
     def __repr__(self):
         return f'OutputFile({self._filename}, mode={self._mode})'        
@@ -196,34 +415,92 @@ class OutputFile:
         return False
         
     def open(self):
-        self._file = open(
-            self._filename             ,
-            mode      = self._mode     ,
-            buffering = self._buffering,
-            encoding  = self._encoding ,
-        )
+        self._file = self._open_file()
 
-        self._thread = ConsumerThread(
+        consumer = BatchConsumerThread if self._group_commit else ConsumerThread
+        self._thread = consumer(
             queue   = self._queue        ,
-            func    = self._write_to_file,
+            func    = self._write_batch if self._group_commit else self._write_to_file,
             timeout = self._timeout      ,
         )
         self._thread.start()
 
     def close(self):
         self._thread.stop()
-        self._file.close()
+        #write anything still queued when the consumer thread stopped
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get()
+            if item is not WAKE:
+                remaining.append(item)
+        if remaining:
+            self._write_batch(remaining)
+        if self._fsync_every or self._fsync_interval:
+            self._fsync()
+        self._close_file()
+
+    def _open_file(self):
+        """Internal method opening the file, replaced by subclasses that
+        write somewhere else (e.g. RotatingFile's segments)."""
+        return open(
+            self._filename             ,
+            mode      = self._mode     ,
+            buffering = self._buffering,
+            encoding  = self._encoding ,
+        )
 
+    def _close_file(self):
+        """Internal method closing the file once the queue is written."""
+        self._file.close()
 
     def _write_to_file(self, msg):
         """Internal method to write to file."""
-        self._file.write(msg)
+        self._write_batch([msg])
+
+    def _write_batch(self, msgs):
+        """Internal method to write a list of messages with one write call
+        and apply the fsync policy."""
+        start = time.perf_counter()
+        self._file.write(msgs[0][:0].join(msgs))
+        if self._group_commit:
+            self._file.flush()
+
+        self._unsynced += len(msgs)
+        if self._fsync_due():
+            self._fsync()
+        self.stats.record_batch(len(msgs), time.perf_counter() - start)
+
+    def _fsync_due(self):
+        if self._fsync_every and self._unsynced >= self._fsync_every:
+            return True
+        if self._fsync_interval and time.monotonic() - self._last_fsync >= self._fsync_interval:
+            return True
+        return False
+
+    def _fsync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+        self.stats.fsyncs += 1
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
 
     def write(self, msg):
         """Write string to file.
         Internally, this uses a Queue to ensure thread-safety.
         """
-        self._queue.put(msg)
+        if self._overflow == 'drop':
+            try:
+                self._queue.put_nowait(msg)
+            except queue.Full:
+                self.stats.dropped += 1
+                return
+        else:
+            self._queue.put(msg)
+        self.stats.max_queue = max(self.stats.max_queue, self._queue.qsize())
 
     def writeline(self, msg, newline='\n'):
         """Write string to file with newline termination.
@@ -234,31 +511,49 @@ class OutputFile:
 
 #--------------------------------------------------------
 
-def loop_thread(loop, stop_event, setup=None, teardown=None):
+def loop_thread(loop, stop_event, setup=None, teardown=None, rate=None, cancel=None):
+
+    """Thread running loop until stop_event is set, back to back or at a
+       fixed rate (iterations per second). The FixedRate schedule is kept
+       in the thread's schedule attribute, and cancel in its cancel
+       attribute for stop_threads"""
 
     def keep_running():
         return not stop_event.is_set()
 
-    return threading.Thread(
+    schedule = FixedRate(1/rate, stop_event) if rate else None
+    thread = threading.Thread(
         target=run,
-        args=(loop, setup, teardown, keep_running)
+        args=(loop, setup, teardown, keep_running, schedule)
     )
+    thread.schedule = schedule
+    thread.cancel = cancel
+    return thread
 
 def sensor_thread(sensor,stop_event):
     
+    bind_stop_event(sensor, stop_event)
     return loop_thread(
         loop=sensor.update,
         setup=sensor.setup,
         teardown=sensor.teardown, 
-        stop_event=stop_event
+        stop_event=stop_event,
+        rate=getattr(sensor, 'rate', None),
+        cancel=cancel_wait(sensor)
     )
 
 def process_thread(process, stop_event): 
+
+    """Thread running a process, at the rate it declares if it has one"""
+
+    bind_stop_event(process, stop_event)
     return loop_thread(
         loop = process.update,
         setup = process.setup, 
         teardown = process.teardown,
-        stop_event = stop_event
+        stop_event = stop_event,
+        rate = getattr(process, 'rate', None),
+        cancel = cancel_wait(process)
     )
 
 
@@ -284,8 +579,19 @@ def start_threads(threads):
 
 def stop_threads(event,threads): 
 
+    """Sets the stop event, wakes every thread blocked in a call that
+       does not wait on it, and joins them"""
+
     event.set()
 
+    for thread in threads:
+        cancel = getattr(thread, 'cancel', None)
+        if cancel is not None:
+            try:
+                cancel()
+            except Exception as exc:
+                logging.info(f'Stop threads - cancel {type(exc).__name__}')
+
     for thread in threads:
         thread.join()
 
@@ -1,13 +1,31 @@
 #PINGU-Sat Main Script
 
-from data_utils.radio_utils import RunRadio
+from data_utils.radio_utils import RunRadio, AsyncRunRadio
 from data_utils.thread_utils import catch_and_suppress
 from data_utils.process_handling import RunSensor, RunProcesses
+from data_utils.async_handling import AsyncRunSensor, AsyncRunProcesses
+from data_utils.async_handling import AsyncHandleTelemetry, AsyncStoreData, AsyncHandleData
+from data_utils.async_handling import AsyncReportLatency, AsyncTrackProfile
+from data_utils.snapshot import SnapshotBus
+from data_utils.link_scheduler import LinkScheduler
+from data_utils.backlog import PayloadBacklog
+from data_utils.altitude import AltitudeEstimator
 from sensors.pressure_sensor import PressureSensor
-from data_utils.data_handling import HandleTelemetry, StoreData, HandleData
+from data_utils.data_handling import HandleTelemetry, StoreData, HandleData, ReportLatency
+from data_utils.data_handling import TrackProfile
+from data_utils.pfotzer import PfotzerProfile
+from data_utils.latency import LatencyTracker
+from data_utils.offload import SharedRing, RingPublisher, RingReader, RunWorker, wait_for_stop
+from data_utils.rotating_log import RotatingFile
 from sensors.temperature_sensor import TemperatureSensor
+from sensors.temperature_sensor.w1_bus import W1BusManager, W1_DEVICES
 from sensors.gps import GPSSensor
+from sensors.geiger import RadiationSensor
+import serial
+import asyncio
 import logging
+import signal
+import sys
 import time
 from datetime import datetime as dt
 from tuppersat.airborne import set_airborne
@@ -24,6 +42,20 @@ LOG_FILE_test=f'{LOG_DIR}spicylog.log'
 
 FILE_DIR = '/home/pi/logs/' 
 
+#records are written as text, each line flushed as it is stored, and each
+#file starts a new segment every hour, the closed one compressed in the
+#background. A power loss loses no more than with plain text; streaming
+#('stream': 'zlib') compresses better but loses the frame being written,
+#up to frame_interval seconds of records
+STORE_FACTORY = RotatingFile
+STORE_OPTIONS = {'compress': 'zlib', 'interval': 3600}
+
+#sample age histograms, appended at shutdown and on SIGUSR1
+LATENCY_FILE = f'{LOG_DIR}latency.txt'
+
+#payload frames the radio could not send, resent when the link has room
+BACKLOG_FILE = f'{LOG_DIR}backlog.bin'
+
 
 #-------------------------------
 #Port details
@@ -33,40 +65,212 @@ GPS_PORT=r'/dev/ttyACM0'
 EXT_ADDRESS=r'/sys/bus/w1/devices/28-00000de90790/w1_slave'
 INT_ADDRESS=r'/sys/bus/w1/devices/28-0213132359aa/w1_slave'
 BUS_ADDRESS=0x77
+#the Geiger counter is not flown in the current configuration
+GEIGER_PORT=None
 
 #---------------------------------
 #Sensor details 
 
-set_airborne(GPS_PORT)
+def build_sensors(serial_factory=serial.Serial, smbus=None, w1_root=W1_DEVICES,
+                  geiger_port=GEIGER_PORT, w1_period=1.0, raw=False):
+
+    """Creates the dictionary of sensors. The hardware can be replaced by
+       simulated ports, bus and w1 tree (see the simulation package). With
+       raw the serial and pressure sensors only read, for the offloaded
+       runtime, and the sensors of build_raw_processors process what they
+       read"""
+
+    #both probes are converted together by one bulk conversion
+    w1_bus = W1BusManager(w1_root, period=w1_period)
+
+    sensors={
+	'gps':GPSSensor(GPS_PORT, serial_factory=serial_factory, raw=raw),
+	't_internal':TemperatureSensor(INT_ADDRESS, manager=w1_bus),
+	't_external':TemperatureSensor(EXT_ADDRESS, manager=w1_bus), 
+	'pressure':PressureSensor(BUS_ADDRESS, bus=smbus, raw=raw)
+    }
+    if geiger_port is not None:
+        sensors['geiger'] = RadiationSensor(geiger_port, serial_factory=serial_factory, raw=raw)
+    return sensors
 
 
-sensors={
+def build_raw_processors(geiger_port=GEIGER_PORT):
+
+    """Creates the sensors that parse, compensate and keep the statistics
+       of the samples of the raw sensors in the offload worker. They are
+       never set up, so no hardware is opened"""
+
+    processors = {
 	'gps':GPSSensor(GPS_PORT),
-	't_internal':TemperatureSensor(INT_ADDRESS),
-	't_external':TemperatureSensor(EXT_ADDRESS), 
 	'pressure':PressureSensor(BUS_ADDRESS)
-}
+    }
+    if geiger_port is not None:
+        processors['geiger'] = RadiationSensor(geiger_port)
+    return processors
+
+
+def build_processes(bus, link, file_dir, asynchronous=False, time_scale=1.0,
+                    latency=None, latency_file=None, file_factory=STORE_FACTORY,
+                    file_options=STORE_OPTIONS, geiger=False):
+
+    """Creates the data handling processes. time_scale divides their
+       pauses, to run them faster than real time in a replay. Given a
+       LatencyTracker the sinks record the age of the data they emit and
+       it is summarised in the log every 5 minutes. file_factory and
+       file_options are given to StoreData for its files. With geiger the
+       Pfotzer profile is built from the Geiger readings and its maximum
+       added to the payload"""
+
+    profile = PfotzerProfile() if geiger else None
+
+    if asynchronous:
+        processes = [
+			AsyncHandleData(bus, link, pause=10/time_scale, profile=profile, latency=latency),
+			AsyncHandleTelemetry(bus, link, pause=20/time_scale, latency=latency),
+			AsyncStoreData(bus, file_dir, pause=1/time_scale, latency=latency,
+						   file_factory=file_factory, file_options=file_options)
+			]
+        if profile is not None:
+            processes.append(AsyncTrackProfile(bus, profile, pause=1/time_scale))
+        if latency is not None:
+            processes.append(AsyncReportLatency(latency, pause=300/time_scale, dump_file=latency_file))
+    else:
+        processes = [
+			HandleData(bus, link, pause=10/time_scale, profile=profile, latency=latency),
+			HandleTelemetry(bus, link, pause=20/time_scale, latency=latency),
+			StoreData(bus, file_dir, pause=1/time_scale, latency=latency,
+					  file_factory=file_factory, file_options=file_options)
+			]
+        if profile is not None:
+            processes.append(TrackProfile(bus, profile, pause=1/time_scale))
+        if latency is not None:
+            processes.append(ReportLatency(latency, pause=300/time_scale, dump_file=latency_file))
+    return processes
+
+
+def dump_on_signal(latency):
+
+    """Appends the latency histograms to LATENCY_FILE on SIGUSR1"""
+
+    signal.signal(signal.SIGUSR1, lambda signum, frame: latency.dump(LATENCY_FILE))
+
+
+def stop_on_sigterm():
+
+    """Raises KeyboardInterrupt on SIGTERM (sent by sudo shutdown or
+       systemd), so the threads are stopped and the files closed as on
+       Ctrl-C instead of the process being killed"""
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
 
 
 #---------------------------------
 
-def main():
-    
+def configure_logging():
     logging.basicConfig(filename=LOG_FILE, level = logging.INFO,
 			format='%(asctime)s %(levelname)s: %(message)s')
 
 
+def main():
+    
+    configure_logging()
+    stop_on_sigterm()
+
+    set_airborne(GPS_PORT)
+    sensors = build_sensors()
+    bus = SnapshotBus()
+    AltitudeEstimator().attach(bus)
+    latency = LatencyTracker()
+    dump_on_signal(latency)
+
     with catch_and_suppress(KeyboardInterrupt):
-        with RunSensor(sensors):
+        with RunSensor(bus.attach(sensors)):
             with RunRadio(RADIO_PORT) as radio:
-                processes = [
-			HandleData(sensors, radio),
-			HandleTelemetry(sensors, radio),
-			StoreData(sensors,FILE_DIR)
-			]
+                with LinkScheduler(radio, backlog=PayloadBacklog(BACKLOG_FILE)) as link:
+                    processes = build_processes(bus, link, FILE_DIR, latency=latency,
+                                                latency_file=LATENCY_FILE,
+                                                geiger='geiger' in sensors)
+                    with RunProcesses(processes):
+                        while True: time.sleep(0.1) 
+
+
+def offload_worker(ring, stop_event):
+
+    """Worker process of the offloaded runtime: republishes the samples from
+       the acquisition process and runs the radio and the data handling
+       processes. It is stopped through stop_event by the acquisition
+       process, which gets the Ctrl-C or SIGTERM"""
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    configure_logging()
+
+    bus = SnapshotBus()
+    AltitudeEstimator().attach(bus)
+    latency = LatencyTracker()
+    dump_on_signal(latency)
+
+    try:
+        with RunRadio(RADIO_PORT) as radio:
+            with LinkScheduler(radio, backlog=PayloadBacklog(BACKLOG_FILE)) as link:
+                processes = [RingReader(ring, bus, build_raw_processors())] + build_processes(
+                    bus, link, FILE_DIR, latency=latency, latency_file=LATENCY_FILE,
+                    geiger=GEIGER_PORT is not None)
                 with RunProcesses(processes):
-                    while True: time.sleep(0.1) 
+                    wait_for_stop(stop_event)
+    finally:
+        ring.close()
+
+
+def offload_main():
+
+    """Runs only the raw sensors in this process, which pass the lines and
+       ADC words they read through a SharedRing to a worker process doing
+       the parsing, compensation, statistics, formatting, storage and
+       radio, so that the sensor reads do not compete with them for the
+       GIL"""
+
+    configure_logging()
+    stop_on_sigterm()
+
+    set_airborne(GPS_PORT)
+    sensors = build_sensors(raw=True)
+
+    with SharedRing() as ring, catch_and_suppress(KeyboardInterrupt):
+        #the worker is started before any thread of this process
+        with RunWorker(offload_worker, ring):
+            with RunSensor(RingPublisher(ring).attach(sensors)):
+                while True: time.sleep(0.1) 
+
+
+async def async_main():
+
+    """Runs the sensors and processes as tasks on a single event loop"""
+
+    set_airborne(GPS_PORT)
+    sensors = build_sensors()
+    bus = SnapshotBus()
+    AltitudeEstimator().attach(bus)
+    latency = LatencyTracker()
+    dump_on_signal(latency)
+
+    async with AsyncRunSensor(bus.attach(sensors)):
+        async with AsyncRunRadio(RADIO_PORT) as radio:
+            with LinkScheduler(radio, backlog=PayloadBacklog(BACKLOG_FILE)) as link:
+                processes = build_processes(bus, link, FILE_DIR, asynchronous=True,
+                                            latency=latency, latency_file=LATENCY_FILE,
+                                            geiger='geiger' in sensors)
+                async with AsyncRunProcesses(processes):
+                    await asyncio.Event().wait()
 
 
 if __name__=="__main__":
-    main()
+    if '--offload' in sys.argv:
+        offload_main()
+    elif '--asyncio' in sys.argv:
+        configure_logging()
+        stop_on_sigterm()
+        with catch_and_suppress(KeyboardInterrupt):
+            asyncio.run(async_main())
+    else:
+        main()
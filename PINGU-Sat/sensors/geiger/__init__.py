@@ -1,4 +1,11 @@
 import serial
+import logging
+import threading
+import math
+from collections import namedtuple
+from sensors.history import TimeSeriesRing
+from .count_stats import RadiationStats
+from sensors.serial_framer import LineFramer
 
 
 def create_geiger_dict(data_list):
@@ -27,25 +34,48 @@ def parse_geiger(data_string):
     return create_geiger_dict(sep_vals)
 
 
-def sum_queue(_queue):
-    sum_list =[_queue.pop() for _ in range(10)]
-    return sum(sum_list)
+#data of the RadiationSensor: the latest CPS, the counts over the last 10 s
+#and the dead-time corrected count rates (counts/s) over 10 s, 60 s and
+#5 min, with the Poisson uncertainty of the 60 s rate
+RadiationReading = namedtuple('RadiationReading',
+                              ['cps', 'counts', 'rate_10s', 'rate_60s', 'rate_300s', 'error_60s'])
+
+
+def _value(x):
+    return None if math.isnan(x) else x
 
 
 class RadiationSensor: 
 
-    """Sensor class for the onboard Geiger Counter"""
+    """Sensor class for the onboard Geiger Counter
+
+       With raw set the sensor only reads: its data is the tuple of CPS
+       lines of the last read, as bytes, and a RadiationSensor in another
+       process parses them and keeps the statistics with process_raw"""
 
-    def __init__(self, port): 
+    def __init__(self, port, history_size=3600, dead_time=190e-6, serial_factory=serial.Serial,
+                 raw=False): 
 
         """Initializer
         
         Input: 
-            Serial port address of sensor"""
+            Serial port address of sensor
+            Number of CPS readings kept in the history
+            Dead time of the tube in seconds
+            Callable opening the port, serial.Serial or a simulated port
+            Whether only the raw lines are read"""
 
         self.serial = None
-        self._data = [None, 0]
-        self._queue = [],
+        self.serial_factory = serial_factory
+        self.framer = None
+        self._data = RadiationReading(None, 0, None, None, None, None)
+        self.history = TimeSeriesRing(history_size, ('cps',))
+        self.stats = RadiationStats((10, 60, 300), dead_time=dead_time)
+        self.raw = raw
+        if raw:
+            self._data = ()
+        #replaced by the stop event of the thread running the sensor
+        self.stop_event = threading.Event()
         self.serial_details = {
             'baud':9600,
             'port': port,
@@ -54,26 +84,110 @@ class RadiationSensor:
         }
 
     def update(self):
-        val=self.read()
-        self._data[0]=val
-        self._queue.append(val)
-        if len(self._queue) >= 10:
-            self._data[1] = sum(self._queue)
-            self._queue = []
+        if self.raw:
+            line = self.framer.readline()
+            if line is not None:
+                self._data = (line,)
+            return
+
+        val = self.read()
+        if val is not None:
+            self.record(val)
+
+    def process_raw(self, lines):
+
+        """Parses and records the lines read by a raw RadiationSensor.
+           Returns the data values to publish"""
+
+        readings = []
+        for line in lines:
+            val = self.parse(line.decode('ascii', 'replace'))
+            if val is not None:
+                self.record(val)
+                readings.append(self._data)
+        return readings
+
+    def record(self, val):
+
+        """Keeps a CPS reading in the history and the rolling statistics
+           and publishes the rates in the data"""
+
+        self.history.append(val)
+        self.stats.add(val)
+        rate_60s, error_60s = self.stats.rate(60)
+        self._data = RadiationReading(
+            val,
+            self.stats.counts(10),
+            _value(self.stats.rate(10)[0]),
+            _value(rate_60s),
+            _value(self.stats.rate(300)[0]),
+            _value(error_60s),
+        )
         
         
     def setup(self):
 
         """Setup step that creates and opens serial port"""
 
-        self.serial = serial.Serial(self.serial_details['port'],
-                                    self.serial_details['baud'])
+        self.serial = self.serial_factory(self.serial_details['port'],
+                                          self.serial_details['baud'])
+        self.framer = LineFramer(self.serial, match=[b'CPS'], stop_event=self.stop_event,
+                                 encoding=None if self.raw else 'ascii')
 
     
     def read(self): 
         while True:
-            sentence = self.serial.readline().decode('ascii')
+            sentence = self.framer.readline()
+            if sentence is None:
+                #stopped while waiting for a reading
+                return None
+            val = self.parse(sentence)
+            if val is not None:
+                return val
+
+    def parse(self, sentence):
+
+        """Returns the CPS of a sentence, or None if it is garbled"""
+
+        try:
             return parse_geiger(sentence)['CPS']
+        except (ValueError, IndexError):
+            return None
+
+    def on_readable(self):
+
+        """Records every complete reading waiting on the port without
+           blocking for the next one. Used by the SensorScheduler. Returns
+           False if the port failed, or was readable with nothing to read
+           (EOF)"""
+
+        start = self.framer.bytes_read
+        lines = []
+        try:
+            sentence = self.framer.readline(block=False)
+            while sentence is not None:
+                if self.raw:
+                    lines.append(sentence)
+                else:
+                    val = self.parse(sentence)
+                    if val is not None:
+                        self.record(val)
+                sentence = self.framer.readline(block=False)
+
+        except serial.SerialException:
+            logging.info('SerialException for Geiger')
+            return False
+        if lines:
+            self._data = tuple(lines)
+        return self.framer.bytes_read > start
+
+    def cancel(self):
+
+        """Wakes a read blocked on the port once the stop event is set"""
+
+        cancel_read = getattr(self.serial, 'cancel_read', None)
+        if cancel_read is not None:
+            cancel_read()
 
           
     def teardown(self):
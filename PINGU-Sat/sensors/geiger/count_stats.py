@@ -0,0 +1,172 @@
+import math
+import time
+from array import array
+
+
+#-------------------------------------------
+
+def poisson_rate(counts, live_time):
+
+    """Returns (rate, 1 sigma uncertainty) in counts per second for a number
+       of counts in live_time seconds, using the Poisson sqrt(N) error"""
+
+    if live_time <= 0:
+        return math.nan, math.nan
+    return counts/live_time, math.sqrt(counts)/live_time
+
+
+def dead_time_correct(rate, error, dead_time):
+
+    """Non-paralyzable dead-time correction, n = m/(1 - m*tau), with the
+       uncertainty propagated through dn/dm = 1/(1 - m*tau)**2. Returns NaN
+       once the measured rate saturates the tube"""
+
+    loss = 1 - rate*dead_time
+    if not loss > 0:
+        return math.nan, math.nan
+    return rate/loss, error/loss**2
+
+
+class CountWindow:
+
+    """Running totals of the readings inside one sliding window"""
+
+    __slots__ = ('length', 'tail', 'samples', 'counts')
+
+    def __init__(self, length):
+        self.length = length
+        self.tail = 0
+        self.samples = 0
+        self.counts = 0
+
+
+#-------------------------------------------
+
+class RadiationStats:
+
+    """Streaming count statistics over several sliding windows
+
+       Each reading is the number of counts the detector saw in one interval
+       (the CPS line of the Geiger counter). Readings are kept in
+       preallocated arrays shared by every window, and each window keeps a
+       running count and its oldest reading, so an update only adds the new
+       reading and drops the readings that have left each window. Nothing is
+       allocated per reading.
+
+       INPUTS:
+       windows: tuple of float, window lengths in seconds
+       interval: float, seconds of counting behind each reading
+       dead_time: float, dead time of the tube in seconds
+       capacity: int [optional], readings kept, by default enough for the
+                 longest window at twice the reading rate"""
+
+    def __init__(self, windows=(10, 60, 300), interval=1.0, dead_time=190e-6, capacity=None):
+
+        self.interval = interval
+        self.dead_time = dead_time
+        self.capacity = capacity or int(2*max(windows)/interval) + 1
+        self.windows = tuple(CountWindow(w) for w in sorted(windows))
+
+        self._times = array('d', bytes(8*self.capacity))
+        self._counts = array('q', bytes(8*self.capacity))
+        self._next = 0
+        self._size = 0
+        self.total = 0
+        self.readings = 0
+
+    def __repr__(self):
+        return f'RadiationStats(windows={tuple(w.length for w in self.windows)}, dead_time={self.dead_time})'
+
+    def add(self, counts, timestamp=None):
+
+        """Records a reading of counts ending at timestamp (monotonic)"""
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        i = self._next
+        if self._size == self.capacity:
+            #the oldest reading is overwritten, drop it from every window
+            for w in self.windows:
+                if w.samples and w.tail == i:
+                    self._drop(w)
+        else:
+            self._size += 1
+
+        self._times[i] = timestamp
+        self._counts[i] = counts
+        self._next = (i + 1) % self.capacity
+        self.total += counts
+        self.readings += 1
+
+        for w in self.windows:
+            if not w.samples:
+                w.tail = i
+            w.samples += 1
+            w.counts += counts
+        self.expire(timestamp)
+
+    def expire(self, now=None):
+
+        """Drops the readings older than each window"""
+
+        if now is None:
+            now = time.monotonic()
+        for w in self.windows:
+            start = now - w.length
+            while w.samples and self._times[w.tail] <= start:
+                self._drop(w)
+
+    def _drop(self, w):
+        w.counts -= self._counts[w.tail]
+        w.samples -= 1
+        w.tail = (w.tail + 1) % self.capacity
+
+    def clear(self):
+        for w in self.windows:
+            w.tail = w.samples = w.counts = 0
+        self._next = self._size = 0
+
+    #---------------------------------------
+
+    def window(self, length):
+
+        """Returns the CountWindow with the given length"""
+
+        for w in self.windows:
+            if w.length == length:
+                return w
+        raise KeyError(length)
+
+    def counts(self, length):
+        return self.window(length).counts
+
+    def rate(self, length, corrected=True):
+
+        """Returns (rate, uncertainty) in counts per second over a window,
+           dead-time corrected unless corrected is False"""
+
+        w = self.window(length)
+        rate, error = poisson_rate(w.counts, w.samples*self.interval)
+        if corrected:
+            return dead_time_correct(rate, error, self.dead_time)
+        return rate, error
+
+    def summary(self):
+
+        """Returns the statistics of every window, keyed by window length"""
+
+        result = {}
+        for w in self.windows:
+            live_time = w.samples*self.interval
+            rate, error = poisson_rate(w.counts, live_time)
+            corrected, corrected_error = dead_time_correct(rate, error, self.dead_time)
+            result[w.length] = {
+                'counts': w.counts,
+                'live_time': live_time,
+                'rate': rate,
+                'rate_error': error,
+                'corrected_rate': corrected,
+                'corrected_error': corrected_error,
+            }
+        return result
@@ -1,6 +1,9 @@
 import serial
-import time
+import threading
 import logging
+from .nmea import FixTracker, PARSERS
+from sensors.history import TimeSeriesRing
+from sensors.serial_framer import LineFramer
 
 
 ############################
@@ -12,19 +15,47 @@ def check_sentence(sentence, gps_id):
     if sentence[3:6] == gps_id:
         return True
 
+
+def fix_fields(fix):
+
+    """Returns the values of a GGA fix that are kept in the history"""
+
+    if fix is None:
+        return None
+    return [fix.latitude, fix.longitude, fix.altitude, fix.hdop]
+
 #############################
 
 class GPSSensor:
 
-    """Sensor class for the GPS sensor"""
+    """Sensor class for the GPS sensor
+
+       With raw set the sensor only reads: its data is the tuple of GGA,
+       RMC, GSA and VTG sentences of the last read, as bytes (None once
+       the port fails), and a GPSSensor in another process tracks them with process_raw"""
     
-    def __init__(self, port):
+    def __init__(self, port, history_size=3600, serial_factory=serial.Serial, raw=False):
 
-        """Initializer"""
+        """Initializer
+        
+        Input: 
+            Serial port address of sensor
+            Number of GGA fixes kept in the history
+            Callable opening the port, serial.Serial or a simulated port
+            Whether only the raw sentences are read"""
 
         self.serial = None
+        self.serial_factory = serial_factory
+        self.framer = None
         self._data = None
+        self.history = TimeSeriesRing(history_size, ('latitude', 'longitude', 'altitude', 'hdop'))
+        self.fix = FixTracker()
         self.id = 'GGA'
+        self.raw = raw
+        if raw:
+            self._data = ()
+        #replaced by the stop event of the thread running the sensor
+        self.stop_event = threading.Event()
         self.serial_details = {
             'baud':9600,
             'port': port,
@@ -33,26 +64,111 @@ class GPSSensor:
         
     def update(self):
         try: 
-            self._data = self.read()
+            if self.raw:
+                sentence = self.framer.readline()
+                if sentence is not None:
+                    self._data = (sentence,)
+                return
+
+            sentence = self.read()
+            if sentence is not None:
+                self._data = sentence
         
         except serial.SerialException:
             self._data = None
             logging.info('SerialException for GPS')
-            time.sleep(5)
+            self.stop_event.wait(5)
             pass
         
     def setup(self):
-        self.serial = serial.Serial(self.serial_details['port'],
-                                    self.serial_details['baud'])
+        self.serial = self.serial_factory(self.serial_details['port'],
+                                          self.serial_details['baud'])
+        #only the sentences the FixTracker parses are decoded
+        self.framer = LineFramer(self.serial, match=[s.encode() for s in PARSERS],
+                                 offset=3, start=b'$', stop_event=self.stop_event,
+                                 encoding=None if self.raw else 'ascii')
         
     def read(self): 
         while True:
-            sentence = self.serial.readline().decode('ascii')
-     
-            if check_sentence(sentence, self.id):
+            sentence = self.framer.readline()
+            if sentence is None:
+                #stopped while waiting for a sentence
+                return None
+            if self.process(sentence):
+                return sentence
+
+    def process(self, sentence):
+
+        """Tracks a sentence, and keeps a GGA sentence as the data and its
+           fix in the history. Returns True for a GGA sentence"""
+
+        fix = self.track(sentence)
+        if check_sentence(sentence, self.id):
+            self._data = sentence
+            self.history.append(fix_fields(fix))
+            return True
+        return False
+
+    def process_raw(self, sentences):
+
+        """Tracks the sentences read by a raw GPSSensor. Returns the GGA
+           sentences, the data values to publish, or [None] if the port of
+           the raw sensor failed"""
+
+        if sentences is None:
+            self._data = None
+            return [None]
+        ggas = []
+        for sentence in sentences:
+            sentence = sentence.decode('ascii', 'replace')
+            if self.process(sentence):
+                ggas.append(sentence)
+        return ggas
+
+    def track(self, sentence):
+
+        """Passes GGA, RMC, GSA and VTG sentences to the FixTracker, which
+           keeps ground speed and fix quality. Returns the parsed GPSFix,
+           or None for other sentences and failed checksums"""
+
+        if sentence[3:6] in PARSERS:
+            return self.fix.update(sentence)
+        return None
+
+    def on_readable(self):
+
+        """Reads the waiting bytes and keeps the sentences that match the
+           sentence ID. Used by the SensorScheduler so that the loop is not
+           held up waiting for the next GGA sentence. Returns False if the
+           port failed, or was readable with nothing to read (EOF)"""
+
+        start = self.framer.bytes_read
+        sentences = []
+        try:
+            sentence = self.framer.readline(block=False)
+            while sentence is not None:
+                if self.raw:
+                    sentences.append(sentence)
+                else:
+                    self.process(sentence)
+                sentence = self.framer.readline(block=False)
+
+        except serial.SerialException:
+            self._data = None
+            logging.info('SerialException for GPS')
+            return False
+        if sentences:
+            self._data = tuple(sentences)
+        return self.framer.bytes_read > start
+
+    def cancel(self):
+
+        """Wakes a read blocked on the port once the stop event is set"""
+
+        cancel_read = getattr(self.serial, 'cancel_read', None)
+        if cancel_read is not None:
+            cancel_read()
 
-                return sentence.strip('\r\n')
-    
           
     def teardown(self):
         self.serial.close()
@@ -0,0 +1,202 @@
+import numpy as np
+
+
+#-------------------------------------------
+#Bulk decoder for the _gps.txt files written by StoreData, which hold one
+#GGA sentence or the literal "No GPS" per line. The whole file is decoded
+#with array operations on its bytes instead of a parse_gga call per line.
+
+NEWLINE, COMMA, DOT, MINUS, DOLLAR, STAR = (ord(c) for c in '\n,.-$*')
+
+HEX = np.full(256, -1, dtype=np.int16)
+for _i, _c in enumerate(b'0123456789ABCDEF'):
+    HEX[_c] = _i
+for _i, _c in enumerate(b'abcdef'):
+    HEX[_c] = 10 + _i
+
+
+def _gather(data, start, width):
+
+    """Returns an (n, width) array of the bytes from each start, zero past
+       the end of the data"""
+
+    idx = start[:, None] + np.arange(width)
+    return np.where(idx < len(data), data[np.minimum(idx, len(data) - 1)], 0)
+
+
+def parse_fixed(data, start, end, valid, width=12):
+
+    """Parses the decimal numbers held in data[start:end] for every row at
+       once as exact integers, one character column at a time
+
+       Returns (mantissa, places, bad): the digits as an int64 with the
+       decimal point removed, the number of digits after the point, and
+       True for rows that are not valid, empty, longer than width or not
+       numbers"""
+
+    length = np.where(valid, end - start, 0)
+    mantissa = np.zeros(len(start), dtype=np.int64)
+    places = np.zeros(len(start), dtype=np.int64)
+    seen_dot = np.zeros(len(start), dtype=bool)
+    neg = np.zeros(len(start), dtype=bool)
+    bad = (length <= 0) | (length > width)
+
+    last = len(data) - 1
+    for j in range(width):
+        inside = j < length
+        c = data[np.minimum(start + j, last)]
+        digit = c - 48
+        is_digit = inside & (digit <= 9)
+        is_dot = inside & (c == DOT)
+        if j == 0:
+            neg = inside & (c == MINUS)
+            bad |= neg & (length == 1)
+        bad |= inside & ~is_digit & ~is_dot & ~neg
+        bad |= is_dot & seen_dot
+        mantissa = np.where(is_digit, mantissa*10 + digit, mantissa)
+        places += is_digit & seen_dot
+        seen_dot |= is_dot
+
+    return np.where(neg, -mantissa, mantissa), places, bad
+
+
+def parse_decimals(data, start, end, valid, width=16):
+
+    """As parse_fixed but returns floats, NaN where the field is bad. Like
+       float() the result is the nearest float to the decimal"""
+
+    mantissa, places, bad = parse_fixed(data, start, end, valid, width)
+    value = mantissa/10.0**places
+    value[bad] = np.nan
+    return value
+
+
+def ddmm_to_degrees(mantissa, places, bad):
+
+    """Vectorised gps_utils.ddmm2deg on the output of parse_fixed:
+       ddmm.mmmm to decimal degrees rounded to 5 places"""
+
+    scale = 10**places
+    degrees = mantissa//(100*scale)
+    minutes = (mantissa - degrees*100*scale)/scale
+    value = np.round(degrees + minutes/60, 5)
+    value[bad] = np.nan
+    return value
+
+
+#-------------------------------------------
+
+def decode_gga_bytes(raw, check=True, chunk_size=1 << 22):
+
+    """Decodes the bytes of a GGA log, one sentence or "No GPS" per line
+
+       Returns a dictionary of columnar arrays, one row per line:
+           time: seconds since midnight (UTC) of the fix
+           latitude, longitude: decimal degrees, the longitude negative for
+                                W as in check_long_sign (an S latitude is
+                                not negated, as in parse_gga)
+           altitude: m
+           hdop
+           has_fix: True where the line is a GGA sentence that passed its
+                    checksum (if check is set)
+       Values that are missing are NaN. Coordinates can differ from
+       parse_gga in the 5th decimal place where the rounding is half-way,
+       as np.round and round() break those differently. The bytes are decoded in chunks of
+       about chunk_size bytes to bound the size of the work arrays."""
+
+    if raw and not raw.endswith(b'\n'):
+        raw += b'\n'
+
+    chunks = []
+    start = 0
+    while start < len(raw):
+        end = raw.find(b'\n', start + chunk_size) + 1 or len(raw)
+        chunks.append(_decode_chunk(np.frombuffer(raw, dtype=np.uint8, count=end - start, offset=start), check))
+        start = end
+    if not chunks:
+        chunks.append(_decode_chunk(np.frombuffer(b'', dtype=np.uint8), check))
+    return {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0]}
+
+
+def _decode_chunk(data, check):
+
+    """Decodes a run of complete lines"""
+
+    ends = np.flatnonzero(data == NEWLINE)
+    starts = np.concatenate(([0], ends[:-1] + 1))[:len(ends)]
+
+    #lines of the form $xxGGA,...
+    head = _gather(data, starts, 7)
+    has_fix = ((ends - starts >= 7) & (head[:, 0] == DOLLAR) & (head[:, 3] == ord('G'))
+               & (head[:, 4] == ord('G')) & (head[:, 5] == ord('A')) & (head[:, 6] == COMMA))
+
+    #position of the k-th comma of each line, for the first 10 commas
+    commas = np.flatnonzero(data == COMMA)
+    if len(commas) == 0:
+        commas = np.array([len(data)])
+    first = np.searchsorted(commas, starts)
+    idx = first[:, None] + np.arange(10)
+    pos = commas[np.minimum(idx, len(commas) - 1)]
+    has_fix &= (idx[:, -1] < len(commas)) & (pos[:, -1] < ends)
+
+    if check:
+        has_fix &= checksums_ok(data, starts, ends, has_fix)
+
+    def field(k, parse=parse_decimals):
+        return parse(data, pos[:, k-1] + 1, pos[:, k], has_fix)
+
+    def letter(k):
+        single = has_fix & (pos[:, k] - pos[:, k-1] == 2)
+        return np.where(single, data[np.minimum(pos[:, k-1] + 1, len(data) - 1)], 0)
+
+    hhmmss, places, bad = field(1, parse_fixed)
+    scale = 10**places
+    hhmm = hhmmss//(100*scale)
+    seconds = (hhmmss - hhmm*100*scale)/scale
+    time = (hhmm//100)*3600 + (hhmm % 100)*60 + seconds
+    time[bad] = np.nan
+
+    latitude = ddmm_to_degrees(*field(2, parse_fixed))
+    longitude = ddmm_to_degrees(*field(4, parse_fixed))
+
+    return {
+        'time': time,
+        'latitude': latitude,
+        'longitude': np.where(letter(5) == ord('W'), -longitude, longitude),
+        'altitude': field(9),
+        'hdop': field(8),
+        'has_fix': has_fix,
+    }
+
+
+def checksums_ok(data, starts, ends, rows):
+
+    """Verifies the XOR checksum of every row at once"""
+
+    stars = np.flatnonzero(data == STAR)
+    ok = np.zeros(len(starts), dtype=bool)
+    if len(stars) == 0:
+        return ok
+
+    first = np.minimum(np.searchsorted(stars, starts), len(stars) - 1)
+    star = stars[first]
+    rows = rows & (star > starts) & (star + 2 < ends + 1)
+    if not rows.any():
+        return ok
+
+    bounds = np.column_stack((starts[rows] + 1, star[rows])).ravel()
+    xor = np.bitwise_xor.reduceat(data, bounds)[::2]
+
+    digits = _gather(data, star[rows] + 1, 2)
+    high, low = HEX[digits[:, 0]], HEX[digits[:, 1]]
+    ok[rows] = (high >= 0) & (low >= 0) & (xor == high*16 + low)
+    return ok
+
+
+def load_gga_log(filename, check=True):
+
+    """Reads a _gps.txt log written by write_gps_data in one go and decodes
+       it with decode_gga_bytes"""
+
+    with open(filename, 'rb') as f:
+        return decode_gga_bytes(f.read(), check)
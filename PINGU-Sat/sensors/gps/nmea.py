@@ -0,0 +1,237 @@
+from datetime import time, date
+
+
+#-------------------------------------------
+
+class GPSFix:
+
+    """Fields parsed from an NMEA sentence. Fields a sentence does not
+       carry are None"""
+
+    __slots__ = (
+        'sentence_id', 'timestamp', 'date', 'latitude', 'longitude',
+        'altitude', 'hdop', 'pdop', 'vdop', 'fix_quality', 'fix_type',
+        'satellites', 'status', 'speed_knots', 'speed_kmh', 'course',
+        'checksum', 'sentence',
+    )
+
+    def __init__(self, sentence_id, sentence, checksum):
+        for field in self.__slots__:
+            setattr(self, field, None)
+        self.sentence_id = sentence_id
+        self.sentence = sentence
+        self.checksum = checksum
+
+    def __repr__(self):
+        fields = ', '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__[:-1]
+                           if getattr(self, k) is not None)
+        return f'GPSFix({fields})'
+
+    def gga_dict(self):
+
+        """Returns the dictionary produced by gps_utils.parse_gga"""
+
+        return {
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'altitude': self.altitude,
+            'hdop': self.hdop,
+            'checksum': f'*{self.checksum}',
+            'sentence': self.sentence,
+            'timestamp': self.timestamp,
+        }
+
+
+#-------------------------------------------
+
+def checksum_ok(body, checksum):
+
+    """Returns True if the XOR of the characters between $ and * matches
+       the hex checksum"""
+
+    value = 0
+    for c in body.encode('ascii', 'replace'):
+        value ^= c
+    try:
+        return value == int(checksum, 16)
+    except ValueError:
+        return False
+
+
+def _float(s):
+    return float(s) if s else None
+
+
+def _int(s):
+    return int(s) if s else None
+
+
+def _coord(raw, hemisphere):
+
+    """Converts ddmm.mmmm / dddmm.mmmm to decimal degrees, rounded as in
+       gps_utils.ddmm2deg. As in parse_gga only W is negated
+       (check_long_sign), an S latitude keeps its positive value"""
+
+    if not raw:
+        return None
+    idx = raw.find('.')
+    if idx < 0:
+        idx = len(raw)
+    value = round(float(raw[:idx-2] or 0) + float(raw[idx-2:])/60, 5)
+    if hemisphere == 'W':
+        return -value
+    return value
+
+
+def _time(raw):
+    if len(raw) < 6:
+        return None
+    return time(int(raw[0:2]), int(raw[2:4]), int(raw[4:6]))
+
+
+def _date(raw):
+    if len(raw) < 6:
+        return None
+    return date(2000 + int(raw[4:6]), int(raw[2:4]), int(raw[0:2]))
+
+
+def _field(f, i):
+    return f[i] if i < len(f) else ''
+
+
+#-------------------------------------------
+
+def _gga(fix, f):
+    fix.timestamp = _time(_field(f, 1))
+    fix.latitude = _coord(_field(f, 2), _field(f, 3))
+    fix.longitude = _coord(_field(f, 4), _field(f, 5))
+    fix.fix_quality = _int(_field(f, 6))
+    fix.satellites = _int(_field(f, 7))
+    fix.hdop = _float(_field(f, 8))
+    fix.altitude = _float(_field(f, 9))
+
+
+def _rmc(fix, f):
+    fix.timestamp = _time(_field(f, 1))
+    fix.status = _field(f, 2) or None
+    fix.latitude = _coord(_field(f, 3), _field(f, 4))
+    fix.longitude = _coord(_field(f, 5), _field(f, 6))
+    fix.speed_knots = _float(_field(f, 7))
+    fix.course = _float(_field(f, 8))
+    fix.date = _date(_field(f, 9))
+
+
+def _gsa(fix, f):
+    fix.fix_type = _int(_field(f, 2))
+    fix.satellites = sum(1 for s in f[3:15] if s)
+    fix.pdop = _float(_field(f, 15))
+    fix.hdop = _float(_field(f, 16))
+    fix.vdop = _float(_field(f, 17))
+
+
+def _vtg(fix, f):
+    fix.course = _float(_field(f, 1))
+    fix.speed_knots = _float(_field(f, 5))
+    fix.speed_kmh = _float(_field(f, 7))
+
+
+PARSERS = {
+    'GGA': _gga,
+    'RMC': _rmc,
+    'GSA': _gsa,
+    'VTG': _vtg,
+}
+
+
+def parse_nmea(sentence):
+
+    """Parses a GGA, RMC, GSA or VTG sentence in a single pass
+
+       The sentence is split once and its XOR checksum verified. Returns a
+       GPSFix, or None if the sentence is malformed, fails its checksum or
+       is of an unsupported type"""
+
+    if not sentence:
+        return None
+    sentence = sentence.strip('\r\n')
+    if sentence[:1] != '$':
+        return None
+
+    body, sep, checksum = sentence[1:].partition('*')
+    if not sep or not checksum_ok(body, checksum):
+        return None
+
+    fields = body.split(',')
+    sentence_id = fields[0][2:]
+    parser = PARSERS.get(sentence_id)
+    if parser is None:
+        return None
+
+    fix = GPSFix(sentence_id, sentence, checksum)
+    try:
+        parser(fix, fields)
+    except ValueError:
+        return None
+    return fix
+
+
+def parse_gga_dict(sentence):
+
+    """Drop-in replacement for gps_utils.parse_gga which validates the
+       checksum. Invalid sentences give the same all-None dictionary as a
+       missing sentence"""
+
+    fix = parse_nmea(sentence) if sentence is not None else None
+    if fix is None or fix.sentence_id != 'GGA':
+        return dict.fromkeys(('latitude', 'longitude', 'altitude', 'hdop',
+                              'checksum', 'sentence', 'timestamp'))
+    return fix.gga_dict()
+
+
+#-------------------------------------------
+
+class FixTracker:
+
+    """Merges the latest GGA, RMC, GSA and VTG sentences into one view, so
+       ground speed and fix type are available alongside the GGA position"""
+
+    def __init__(self):
+        self.fixes = {}
+
+    def update(self, sentence):
+
+        """Parses a sentence and keeps it if valid, returns the GPSFix"""
+
+        fix = parse_nmea(sentence)
+        if fix is not None:
+            self.fixes[fix.sentence_id] = fix
+        return fix
+
+    def get(self, field):
+
+        """Returns a field from the first sentence type that has it, in the
+           order GGA, RMC, VTG, GSA"""
+
+        for sentence_id in ('GGA', 'RMC', 'VTG', 'GSA'):
+            fix = self.fixes.get(sentence_id)
+            if fix is not None:
+                value = getattr(fix, field)
+                if value is not None:
+                    return value
+        return None
+
+    def summary(self):
+        speed_knots = self.get('speed_knots')
+        speed_kmh = self.get('speed_kmh')
+        if speed_kmh is None and speed_knots is not None:
+            speed_kmh = speed_knots*1.852
+        return {
+            'fix_quality': self.get('fix_quality'),
+            'fix_type': self.get('fix_type'),
+            'satellites': self.get('satellites'),
+            'speed_kmh': speed_kmh,
+            'speed_knots': speed_knots,
+            'course': self.get('course'),
+            'pdop': self.get('pdop'),
+            'vdop': self.get('vdop'),
+        }
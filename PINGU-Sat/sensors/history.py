@@ -0,0 +1,173 @@
+import time
+import numpy as np
+
+
+class TimeSeriesRing:
+
+    """Fixed-capacity, preallocated ring of timestamped sensor samples
+
+       Appends are O(1) writes into NumPy arrays and the oldest sample is
+       overwritten once the ring is full. Window queries work on views of
+       the arrays, so aggregates (mean, min, max, sum, rate) over the last N
+       samples or since a time do not copy or resample anything.
+
+       INPUTS:
+       capacity: int, number of samples kept
+       fields: tuple of str, names of the values in each sample. None
+               values are stored as NaN"""
+
+    def __init__(self, capacity, fields=('value',)):
+
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self._times = np.full(capacity, np.nan)
+        self._values = np.full((capacity, len(self.fields)), np.nan)
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return f'TimeSeriesRing(capacity={self.capacity}, fields={self.fields}, size={self._size})'
+
+    def append(self, value, timestamp=None):
+
+        """Records a sample, a scalar or a sequence with one value per field"""
+
+        if timestamp is None:
+            timestamp = time.monotonic()
+        if value is None:
+            value = (None,)*len(self.fields)
+        elif np.ndim(value) == 0:
+            value = (value,)
+
+        i = self._next
+        self._times[i] = timestamp
+        self._values[i] = [np.nan if v is None else v for v in value]
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def clear(self):
+        self._next = 0
+        self._size = 0
+
+    #---------------------------------------
+
+    def _count(self, n=None, since=None):
+
+        """Number of newest samples in the window"""
+
+        count = self._size if n is None else min(n, self._size)
+        if since is not None:
+            count = min(count, self.count_since(since))
+        return count
+
+    def count_since(self, t):
+
+        """Number of samples with a timestamp at or after t"""
+
+        return int(np.count_nonzero(self._times[:self._size] >= t))
+
+    def _segments(self, count):
+
+        """Returns the slices of the arrays holding the newest count samples,
+           oldest first. There are two when the window wraps, unless the
+           newest sample is the last slot of the arrays"""
+
+        if count == 0:
+            return []
+        start = self._next - count
+        if start >= 0:
+            return [slice(start, self._next)]
+        if self._next == 0:
+            return [slice(start + self.capacity, self.capacity)]
+        return [slice(start + self.capacity, self.capacity), slice(0, self._next)]
+
+    def last(self, n=None, since=None):
+
+        """Returns (times, values) of the newest n samples, or of those since a
+           time, oldest first. Values has one column per field"""
+
+        segments = self._segments(self._count(n, since))
+        if len(segments) == 1:
+            s = segments[0]
+            return self._times[s], self._values[s]
+        if not segments:
+            return self._times[:0], self._values[:0]
+        return (np.concatenate([self._times[s] for s in segments]),
+                np.concatenate([self._values[s] for s in segments]))
+
+    def latest(self):
+
+        """Returns (time, values) of the newest sample, or None if empty"""
+
+        if not self._size:
+            return None
+        i = self._next - 1
+        return self._times[i], self._values[i]
+
+    #---------------------------------------
+
+    def _reduce(self, func, n, since, field):
+        segments = self._segments(self._count(n, since))
+        col = self._column(field)
+        parts = [func(self._values[s, col], axis=0) for s in segments]
+        if not parts:
+            return np.nan
+        return parts[0] if len(parts) == 1 else parts
+
+    def _column(self, field):
+        if field is None:
+            return slice(None)
+        return self.fields.index(field)
+
+    def sum(self, n=None, since=None, field=None):
+
+        """Sum of the window, ignoring NaN"""
+
+        result = self._reduce(np.nansum, n, since, field)
+        return np.sum(result, axis=0) if isinstance(result, list) else result
+
+    def valid(self, n=None, since=None, field=None):
+
+        """Number of non-NaN samples in the window"""
+
+        func = lambda v, axis: np.count_nonzero(~np.isnan(v), axis=axis)
+        result = self._reduce(func, n, since, field)
+        return np.sum(result, axis=0) if isinstance(result, list) else result
+
+    def mean(self, n=None, since=None, field=None):
+
+        """Mean of the window, ignoring NaN"""
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum(n, since, field)/self.valid(n, since, field)
+
+    def min(self, n=None, since=None, field=None):
+
+        """Minimum of the window, ignoring NaN"""
+
+        result = self._reduce(np.fmin.reduce, n, since, field)
+        return np.fmin(*result) if isinstance(result, list) else result
+
+    def max(self, n=None, since=None, field=None):
+
+        """Maximum of the window, ignoring NaN"""
+
+        result = self._reduce(np.fmax.reduce, n, since, field)
+        return np.fmax(*result) if isinstance(result, list) else result
+
+    def rate(self, n=None, since=None, field=None):
+
+        """Average rate of change per second across the window, from the
+           first and last samples"""
+
+        count = self._count(n, since)
+        if count < 2:
+            return np.nan
+        first = (self._next - count) % self.capacity
+        last = self._next - 1
+        col = self._column(field)
+        dt = self._times[last] - self._times[first]
+        return (self._values[last, col] - self._values[first, col])/dt
@@ -1,26 +1,60 @@
-from .pressure_utils import ms5611_temp_and_pressure
 from .pressure_utils import unpack_constants
+from .conversion import MS5611Converter
+from .compensation import compensate, write_raw_header, format_raw_line
 import smbus
+import threading
+import time
+from sensors.history import TimeSeriesRing
 
 
 class PressureSensor: 
 
-    """Sensor class for the pressure sensor"""
+    """Sensor class for the pressure sensor
 
-    def __init__(self, addr):
+       With raw set the sensor only runs the conversions: its data is the
+       raw (D1, D2, C1, ..., C6) of each reading, the ADC words with the
+       PROM words they are compensated with, and a PressureSensor in
+       another process compensates them with process_raw"""
+
+    def __init__(self, addr, history_size=3600, osr=4096, temperature_every=10, period=0.1,
+                 raw_log=None, bus=None, raw=False):
 
         """Initialiser
         
         Input:
-            address of smbus e.g. 0x77"""
+            address of smbus e.g. 0x77
+            number of readings kept in the history
+            oversampling ratio of the conversions, 256 to 4096
+            number of pressure conversions per temperature conversion
+            shortest time in seconds between readings, 0 for as fast as
+            the conversions allow (about 100 Hz at OSR 4096, each one
+            published and kept in the history)
+            OutputFile [optional] that the calibration constants and the
+            raw D1/D2 conversions are written to, for reprocessing with
+            compensation.reprocess_raw_log
+            SMBus [optional] to use in place of smbus.SMBus(1), e.g. a
+            simulated bus, which is opened by setup
+            whether only the raw conversions are read"""
 
         self._addr = addr
         
-        self._bus = smbus.SMBus(1)
+        self._bus = bus
 
         self._calibration_constants = None
         #tuple with two values for temperature and pressure
         self._data = (None,None)
+        self.history = TimeSeriesRing(history_size, ('temperature', 'pressure'))
+        self.converter = MS5611Converter(osr, temperature_every)
+        self.period = period
+        self._last = 0.0
+        #monotonic time of the latest reading, its timestamp on a SnapshotBus
+        self.acquired = None
+        self.raw_log = raw_log
+        self.raw = raw
+        if raw:
+            self._data = None
+        #replaced by the stop event of the thread running the sensor
+        self.stop_event = threading.Event()
 
         self.buffers = {
             'calibration':[0xA2, 0xA4, 0xA6, 0xA8, 0xAA, 0xAC],
@@ -30,35 +64,84 @@ class PressureSensor:
 
 
     def update(self): 
-        """Read and update the stored data value"""
-        self._data =self.read()
+        """Steps the conversions and waits until the next one is ready"""
+        self.poll()
+        self.stop_event.wait(self.delay())
+
+    def delay(self, now=None):
+        """Seconds until poll can give the next reading, used by the
+           SensorScheduler and AsyncRunSensor timers in place of a wait"""
+        if now is None:
+            now = time.monotonic()
+        return max(self.converter.remaining(now), self._last + self.period - now)
+
+    def poll(self):
+        """Collects a finished conversion and starts the next without
+           waiting. Returns True when the stored data value was updated.
+           The SensorScheduler and AsyncRunSensor call this instead of
+           update, so their single thread never waits"""
+        now = time.monotonic()
+        if self.converter.pending is None and now < self._last + self.period:
+            return False
+        if not self.converter.step(self._bus, self._addr, now, start_next=not self.period):
+            return False
+
+        self._last = self.acquired = time.monotonic()
+        if self.raw:
+            self._data = (self.converter.d1, self.converter.d2, *self._calibration_constants[1:])
+        else:
+            self.record(self.converter.d1, self.converter.d2)
+        if self.raw_log is not None:
+            self.raw_log.writeline(format_raw_line(time.time(), self.converter.d1, self.converter.d2))
+        return True
+
+    def record(self, d1, d2):
+        """Compensates a pair of raw conversions into the data and keeps
+           it in the history"""
+        self._data = compensate(self._calibration_constants, d1, d2)
+        self.history.append(self._data)
+
+    def process_raw(self, raw):
+        """Compensates a reading of a raw PressureSensor. Returns the data
+           values to publish"""
+        if raw is None:
+            return []
+        d1, d2, *constants = raw
+        self._calibration_constants = [None, *constants]
+        self.record(d1, d2)
+        return [self._data]
 
     def read(self): 
-        """Read the pressure and temperature values from the sensor"""
+        """Read the pressure and temperature values from the sensor,
+           waiting for the conversions to finish. None if stopped while
+           waiting"""
 
-        p, t = ms5611_temp_and_pressure(
-            self._bus,
-            self._addr,
-            self._calibration_constants,
-            self.buffers['pressure'],
-            self.buffers['temperature'])
+        while not self.converter.step(self._bus, self._addr):
+            if self.stop_event.wait(self.converter.remaining()):
+                return None
 
-        return(p,t)
+        return compensate(self._calibration_constants, self.converter.d1, self.converter.d2)
 
     def setup(self):
 
         """Setup step which requests and unpacks the 
            calibration constants from the sensor"""
 
+        if self._bus is None:
+            self._bus = smbus.SMBus(1)
         self._calibration_constants = unpack_constants(
             self._bus,
             self._addr,
             self.buffers['calibration'] 
         )
+        if self.raw_log is not None:
+            self.raw_log.open()
+            write_raw_header(self.raw_log, self._calibration_constants)
 
     def teardown(self):
         #no teardown step for sensor
-        pass
+        if self.raw_log is not None:
+            self.raw_log.close()
 
     @property
     def data(self):
@@ -0,0 +1,113 @@
+import numpy as np
+
+
+#-------------------------------------------
+#MS5611 compensation from the datasheet, in exact integer arithmetic.
+#
+#constants is the list from unpack_constants, [None, C1, ..., C6], D1 the
+#raw pressure and D2 the raw temperature conversion. TEMP is returned in
+#0.01 C and P in 0.01 mbar. Below 20 C the second-order terms (T2, OFF2,
+#SENS2) are applied, with the extra terms below -15 C, which matter in
+#the stratosphere. Divisions by powers of two are done as arithmetic
+#shifts, so the scalar and array versions agree exactly.
+
+def compensate_raw(constants, d1, d2):
+
+    """Returns (TEMP, P) as integers for one pair of raw conversions"""
+
+    c = constants
+    dT = d2 - (c[5] << 8)
+    temp = 2000 + (dT*c[6] >> 23)
+    off = (c[2] << 16) + (c[4]*dT >> 7)
+    sens = (c[1] << 15) + (c[3]*dT >> 8)
+
+    if temp < 2000:
+        t2 = dT*dT >> 31
+        cold = (temp - 2000)**2
+        off2 = 5*cold >> 1
+        sens2 = 5*cold >> 2
+        if temp < -1500:
+            very_cold = (temp + 1500)**2
+            off2 += 7*very_cold
+            sens2 += 11*very_cold >> 1
+        temp -= t2
+        off -= off2
+        sens -= sens2
+
+    return temp, (d1*sens >> 21) - off >> 15
+
+
+def compensate(constants, d1, d2):
+
+    """Returns (temperature in C, pressure in mbar) for one pair of raw
+       conversions"""
+
+    temp, p = compensate_raw(constants, d1, d2)
+    return temp/100, p/100
+
+
+def compensate_arrays(constants, d1, d2):
+
+    """Vectorised compensate_raw for arrays of raw conversions. Returns
+       (TEMP, P) as int64 arrays"""
+
+    c = [0] + [np.int64(v) for v in constants[1:]]
+    d1 = np.asarray(d1, dtype=np.int64)
+    d2 = np.asarray(d2, dtype=np.int64)
+
+    dT = d2 - (c[5] << 8)
+    temp = 2000 + (dT*c[6] >> 23)
+    off = (c[2] << 16) + (c[4]*dT >> 7)
+    sens = (c[1] << 15) + (c[3]*dT >> 8)
+
+    cold = np.where(temp < 2000, (temp - 2000)**2, 0)
+    very_cold = np.where(temp < -1500, (temp + 1500)**2, 0)
+    t2 = np.where(temp < 2000, dT*dT >> 31, 0)
+    off2 = (5*cold >> 1) + 7*very_cold
+    sens2 = (5*cold >> 2) + (11*very_cold >> 1)
+
+    temp = temp - t2
+    off = off - off2
+    sens = sens - sens2
+    return temp, (d1*sens >> 21) - off >> 15
+
+
+#-------------------------------------------
+
+def write_raw_header(file, constants):
+
+    """Writes the calibration constants as the first line of a raw log"""
+
+    file.writeline('# C1-C6: ' + ','.join(str(v) for v in constants[1:]))
+
+
+def format_raw_line(timestamp, d1, d2):
+    return f'{timestamp:.6f},{d1},{d2}'
+
+
+def load_raw_log(filename):
+
+    """Reads a raw pressure log written by PressureSensor with raw_log set
+
+       Returns (constants, timestamps, d1, d2), the arrays being NumPy"""
+
+    with open(filename) as f:
+        header = f.readline()
+        if not header.startswith('# C1-C6:'):
+            raise ValueError(f'{filename} is not a raw pressure log')
+        constants = [None] + [int(v) for v in header.split(':', 1)[1].split(',')]
+        data = np.loadtxt(f, delimiter=',', dtype=np.float64, ndmin=2)
+
+    if not len(data):
+        data = np.empty((0, 3))
+    return constants, data[:, 0], data[:, 1].astype(np.int64), data[:, 2].astype(np.int64)
+
+
+def reprocess_raw_log(filename):
+
+    """Compensates a whole raw pressure log. Returns (timestamps,
+       temperature in C, pressure in mbar)"""
+
+    constants, timestamps, d1, d2 = load_raw_log(filename)
+    temp, p = compensate_arrays(constants, d1, d2)
+    return timestamps, temp/100, p/100
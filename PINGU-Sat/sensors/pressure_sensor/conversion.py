@@ -0,0 +1,139 @@
+import time
+
+
+#-------------------------------------------
+#MS5611 commands. A conversion is started by writing CONVERT_D1 (pressure)
+#or CONVERT_D2 (temperature) plus the oversampling offset, and its 24 bit
+#result is read with ADC_READ once the conversion time has passed. Reading
+#early returns 0.
+
+CONVERT_D1 = 0x40
+CONVERT_D2 = 0x50
+ADC_READ = 0x00
+
+#oversampling ratio: (command offset, maximum conversion time in s)
+OSR = {
+    256: (0x00, 0.00060),
+    512: (0x02, 0.00117),
+    1024: (0x04, 0.00228),
+    2048: (0x06, 0.00454),
+    4096: (0x08, 0.00904),
+}
+
+D1 = 'D1'
+D2 = 'D2'
+
+
+def conversion_command(kind, osr):
+    base = CONVERT_D1 if kind == D1 else CONVERT_D2
+    return base + OSR[osr][0]
+
+
+#-------------------------------------------
+
+class MS5611Converter:
+
+    """Non-blocking conversion state machine for the MS5611
+
+       Each step collects the conversion started on the previous step, if
+       its conversion time has passed, and starts the next one, so the
+       caller never sleeps on the sensor. A temperature conversion (D2) is
+       made before the first pressure conversion (D1) and then once every
+       temperature_every pressure conversions, the latest D2 being used to
+       compensate the D1 results in between.
+
+       INPUTS:
+       osr: int, oversampling ratio, 256, 512, 1024, 2048 or 4096
+       temperature_every: int, D1 conversions per D2 conversion
+       margin: float, s added to the datasheet conversion time"""
+
+    def __init__(self, osr=4096, temperature_every=10, margin=0.0002):
+
+        if osr not in OSR:
+            raise ValueError(f'Unsupported oversampling ratio: {osr}')
+
+        self.osr = osr
+        self.temperature_every = temperature_every
+        self.conversion_time = OSR[osr][1] + margin
+
+        self.d1 = None
+        self.d2 = None
+        self.pending = None
+        self._ready_at = 0.0
+        self._since_d2 = 0
+
+        self.conversions = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return f'MS5611Converter(osr={self.osr}, temperature_every={self.temperature_every})'
+
+    def next_kind(self):
+        if self.d2 is None or self._since_d2 >= self.temperature_every:
+            return D2
+        return D1
+
+    def remaining(self, now=None):
+
+        """Seconds until the pending conversion can be read"""
+
+        if self.pending is None:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, self._ready_at - now)
+
+    def start(self, bus, addr, now=None):
+
+        """Starts the next conversion"""
+
+        kind = self.next_kind()
+        bus.write_byte(addr, conversion_command(kind, self.osr))
+        self.pending = kind
+        self._ready_at = (time.monotonic() if now is None else now) + self.conversion_time
+
+    def step(self, bus, addr, now=None, start_next=True):
+
+        """Collects a finished conversion and starts the next. Returns True
+           when a new D1 result is available (with a D2 to compensate it).
+           With start_next False the sensor is left idle after a D1 result
+           until the next step"""
+
+        if now is None:
+            now = time.monotonic()
+        if self.pending is not None and now < self._ready_at:
+            return False
+
+        new_d1 = False
+        if self.pending is not None:
+            raw = read_conversion(bus, addr)
+            if raw == 0:
+                #read before the conversion finished, it is started again
+                self.failed += 1
+            elif self.pending == D1:
+                self.d1 = raw
+                self._since_d2 += 1
+                self.conversions += 1
+                new_d1 = True
+            else:
+                self.d2 = raw
+                self._since_d2 = 0
+                self.conversions += 1
+
+        if new_d1 and not start_next:
+            self.pending = None
+        else:
+            self.start(bus, addr, now)
+        return new_d1
+
+    def reset(self):
+        self.d1 = self.d2 = self.pending = None
+        self._since_d2 = 0
+
+
+def read_conversion(bus, addr):
+
+    """Reads the 24 bit result of the last conversion"""
+
+    b = bus.read_i2c_block_data(addr, ADC_READ, 3)
+    return b[0] << 16 | b[1] << 8 | b[2]
@@ -0,0 +1,138 @@
+class LineFramer:
+
+    """Incremental line framer shared by the serial sensors
+
+       Whatever bytes the port has waiting are read in one call and appended
+       to a reusable bytearray. Complete lines are split out of it in place,
+       and only lines whose prefix matches are decoded, so unwanted sentences
+       never become strings. Partial lines stay in the buffer until the rest
+       arrives, and garbage before the start character or a line that grows
+       past max_line bytes is dropped.
+
+       INPUTS:
+       serial: object, an open serial port (read, in_waiting)
+       match: tuple of bytes [optional], prefixes of the lines to keep,
+              every line is kept if not given
+       offset: int, position of the prefix after the start of the line,
+               e.g. 3 for the sentence ID of $GPGGA
+       start: bytes [optional], character that starts a line. Anything
+              before its last occurrence in a line is dropped
+       max_line: int, longest line kept before the buffer is discarded
+       encoding: str, that matching lines are decoded with, None to keep
+                 them as bytes
+       stop_event: threading.Event [optional], ends a blocking readline,
+                   which returns None, once set. The port's cancel_read
+                   (or timeout) wakes the read it is blocked in"""
+
+    def __init__(self, serial=None, match=None, offset=0, start=None, max_line=512,
+                 encoding='ascii', stop_event=None):
+
+        self.serial = serial
+        self.stop_event = stop_event
+        self._match = tuple(match) if match else None
+        self._offset = offset
+        self._start = start
+        self._max_line = max_line
+        self._encoding = encoding
+
+        self._buffer = bytearray()
+        self._pos = 0
+
+        self.bytes_read = 0
+        self.lines = 0
+        self.matched = 0
+        self.discarded = 0
+
+    def __repr__(self):
+        return f'LineFramer(match={self._match}, offset={self._offset}, start={self._start})'
+
+    def feed(self, data):
+
+        """Appends bytes to the buffer"""
+
+        self._buffer += data
+        self.bytes_read += len(data)
+
+    def fill(self, block=True):
+
+        """Reads the bytes waiting on the port. With block set and nothing
+           waiting it waits for one byte (up to the port timeout). Returns
+           the number of bytes read"""
+
+        waiting = self.serial.in_waiting
+        if not waiting and not block:
+            return 0
+        data = self.serial.read(waiting or 1)
+        self.feed(data)
+        return len(data)
+
+    def readline(self, block=True):
+
+        """Returns the next matching line without its line ending, reading
+           from the port as needed. Without block, returns None once the
+           buffered and waiting bytes hold no more matching lines. With
+           block, returns None once the stop event is set"""
+
+        while True:
+            line = self.next_line()
+            if line is not None:
+                return line
+            if self.stop_event is not None and self.stop_event.is_set():
+                return None
+            if not self.fill(block) and not block:
+                return None
+
+    def next_line(self):
+
+        """Returns the next matching line already in the buffer, or None"""
+
+        buffer = self._buffer
+        while True:
+            end = buffer.find(b'\n', self._pos)
+            if end < 0:
+                self._compact()
+                return None
+
+            start = self._pos
+            self._pos = end + 1
+            self.lines += 1
+
+            if self._start is not None:
+                start = buffer.rfind(self._start, start, end)
+                if start < 0:
+                    continue
+            stop = end
+            if stop > start and buffer[stop - 1] == 13:
+                stop -= 1
+
+            if self._match and not buffer.startswith(self._match, start + self._offset, stop):
+                continue
+            self.matched += 1
+            with memoryview(buffer) as view:
+                if self._encoding is None:
+                    return bytes(view[start:stop])
+                return str(view[start:stop], self._encoding, 'replace')
+
+    def _compact(self):
+
+        """Moves the partial line to the front of the buffer"""
+
+        if self._pos:
+            del self._buffer[:self._pos]
+            self._pos = 0
+        if len(self._buffer) > self._max_line:
+            self.discarded += len(self._buffer)
+            self._buffer.clear()
+
+    def reset(self):
+        self._buffer.clear()
+        self._pos = 0
+
+    def stats(self):
+        return {
+            'bytes_read': self.bytes_read,
+            'lines': self.lines,
+            'matched': self.matched,
+            'discarded': self.discarded,
+            'buffered': len(self._buffer) - self._pos,
+        }
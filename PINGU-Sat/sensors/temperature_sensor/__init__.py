@@ -1,5 +1,6 @@
 import logging
-import time
+import threading
+from sensors.history import TimeSeriesRing
 
 def check_sign(temp_float):
     
@@ -24,43 +25,104 @@ def read_ds18b20(filepath):
 
 class TemperatureSensor:
 
-    """Class for the DS18B20 sensor"""
+    """Class for the DS18B20 sensor
 
-    def __init__(self, filepath):
+       With a W1BusManager the probe is converted together with the other
+       probes on the bus, and update waits for the manager's next result
+       instead of reading the w1_slave file itself. The SensorScheduler and
+       AsyncRunSensor call poll instead, which takes the latest result
+       without waiting, at the times given by delay"""
+
+    def __init__(self, filepath, history_size=3600, manager=None):
 
         self.filepath = filepath
 
         self._data = None 
+        self.history = TimeSeriesRing(history_size, ('temperature',))
+        self.manager = manager
+        self._seq = 0
+        #replaced by the stop event of the thread running the sensor
+        self.stop_event = threading.Event()
+        if manager is not None:
+            self.device = manager.register(filepath)
 
     def update(self):
 
         """Update the class data attribute by calling the read function"""
 
+        if self.manager is not None:
+            self.collect()
+            return
+
         try:
             self._data = self.read()
+            self.history.append(self._data)
 
         except (FileNotFoundError, IndexError) as exc:
             logging.info(f'Temperature Sensor - {type(exc).__name__}')
             self._data = None
-            #pause for 5 seconds before trying again
-            time.sleep(1)
+            #pause for 1 second before trying again
+            self.stop_event.wait(1)
             pass
 
+    def collect(self):
+        """Waits for the next bulk conversion of the W1BusManager"""
+        timeout = self.manager.period + 2*self.manager.conversion_time
+        self._take(*self.manager.wait(self.device, self._seq, timeout, self.stop_event))
+
+    def poll(self):
+        """Takes the latest result of the W1BusManager, or reads the file,
+           without waiting. Returns True when the data value was updated"""
+        if self.manager is not None:
+            return self._take(*self.manager.latest(self.device))
+
+        try:
+            self._data = self.read()
+            self.history.append(self._data)
+            return True
+        except (FileNotFoundError, IndexError) as exc:
+            logging.info(f'Temperature Sensor - {type(exc).__name__}')
+            self._data = None
+            return False
+
+    def delay(self, now=None):
+        """Seconds until the W1BusManager's next result is due, None
+           without a manager (the sensor is then read at a fixed period)"""
+        if self.manager is None:
+            return None
+        return self.manager.until_next(now)
+
+    def _take(self, seq, temperature):
+        if seq == self._seq:
+            return False
+        self._seq = seq
+        self._data = temperature
+        if temperature is not None:
+            self.history.append(temperature)
+        return True
+
     def read(self): 
         """Read temperature values from specific file"""
         temperature = read_ds18b20(self.filepath)
         return temperature
 
+    def cancel(self):
+        """Wakes a wait for the W1BusManager once the stop event is set"""
+        if self.manager is not None:
+            self.manager.wake()
+
     #no setup needed, the file constantly updates
     def setup(self):
         #log the startup
         logging.info('Temperature Sensor Started')
-        pass
+        if self.manager is not None:
+            self.manager.start()
 
     #no teardown needed
     def teardown(self):
         logging.info('Temperature Sensor Shutdown')
-        pass
+        if self.manager is not None:
+            self.manager.stop()
 
     @property
     def data(self):
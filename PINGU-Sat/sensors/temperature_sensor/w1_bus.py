@@ -0,0 +1,245 @@
+import logging
+import os
+import threading
+import time
+
+
+#-------------------------------------------
+#Kernel w1_therm sysfs interface. Writing 'trigger' to the master's
+#therm_bulk_read starts a conversion on every probe at once. Reading it
+#gives -1 while a probe is still converting, and each probe's temperature
+#file then returns its result (in millidegrees C) without a new conversion.
+
+W1_DEVICES = '/sys/bus/w1/devices'
+MASTER = 'w1_bus_master1'
+
+#DS18B20 resolution in bits: maximum conversion time in s
+CONVERSION_TIME = {
+    9: 0.09375,
+    10: 0.1875,
+    11: 0.375,
+    12: 0.75,
+}
+
+
+def read_millidegrees(path):
+
+    """Reads a w1_therm temperature file, returns degrees C"""
+
+    with open(path) as f:
+        return int(f.read().strip())/1000.0
+
+
+def read_w1_slave(path):
+
+    """Reads a legacy w1_slave file, returns degrees C or None if the CRC
+       check failed"""
+
+    with open(path) as f:
+        lines = f.readlines()
+    if not lines[0].strip().endswith('YES'):
+        return None
+    return int(lines[1][lines[1].find('t=') + 2:])/1000.0
+
+
+#-------------------------------------------
+
+class W1BusManager:
+
+    """Owns every DS18B20 probe on a w1 bus and converts them together
+
+       One thread triggers a simultaneous conversion through the master's
+       therm_bulk_read, waits for the conversion time of the configured
+       resolution, reads each probe's result and hands it to the
+       TemperatureSensors waiting on it. Without therm_bulk_read (older
+       kernels) each probe's w1_slave file is read in turn instead.
+
+       INPUTS:
+       root: str, directory holding the w1 devices (a fake tree in tests)
+       master: str, name of the bus master directory
+       resolution: int [optional], 9 to 12 bits, written to each probe
+       period: float, seconds between bulk conversions"""
+
+    def __init__(self, root=W1_DEVICES, master=MASTER, resolution=None, period=1.0):
+
+        if resolution is not None and resolution not in CONVERSION_TIME:
+            raise ValueError(f'Unsupported DS18B20 resolution: {resolution}')
+
+        self.root = root
+        self.master = os.path.join(root, master)
+        self.resolution = resolution
+        self.period = period
+        self.devices = []
+
+        self._cond = threading.Condition()
+        self._results = {}
+        self.seq = 0
+        #monotonic time the latest conversion finished
+        self.finished = None
+        self.conversions = 0
+        self.errors = 0
+
+        self._users = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return f'W1BusManager({self.master!r}, devices={self.devices}, resolution={self.resolution})'
+
+    def device_id(self, filepath):
+
+        """Device ID of a probe given by ID or by its w1_slave path"""
+
+        if os.sep in filepath:
+            return os.path.basename(os.path.dirname(filepath))
+        return filepath
+
+    def register(self, filepath):
+
+        """Adds a probe to the bus, returns its device ID"""
+
+        device = self.device_id(filepath)
+        if device not in self.devices:
+            self.devices.append(device)
+        return device
+
+    @property
+    def bulk(self):
+        return os.path.exists(os.path.join(self.master, 'therm_bulk_read'))
+
+    @property
+    def conversion_time(self):
+        return CONVERSION_TIME[self.resolution or 12]
+
+    #---------------------------------------
+    #The bus thread runs while any TemperatureSensor using it is set up
+
+    def start(self):
+        with self._cond:
+            self._users += 1
+            if self._users > 1:
+                return
+        self.setup()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._users -= 1
+            if self._users > 0:
+                return
+            self._cond.notify_all()
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            start = time.monotonic()
+            self.update()
+            self._stop_event.wait(max(0.0, start + self.period - time.monotonic()))
+
+    def setup(self):
+
+        """Writes the resolution to every probe"""
+
+        if self.resolution is None:
+            return
+        for device in self.devices:
+            try:
+                with open(os.path.join(self.root, device, 'resolution'), 'w') as f:
+                    f.write(f'{self.resolution}\n')
+            except OSError as exc:
+                logging.info(f'W1 Bus - resolution {device} {type(exc).__name__}')
+
+    def update(self):
+
+        """Runs one conversion of every probe and publishes the results"""
+
+        if self.bulk:
+            results = self.bulk_read()
+        else:
+            results = {device: self.read_device(device, 'w1_slave') for device in self.devices}
+
+        with self._cond:
+            self._results.update(results)
+            self.seq += 1
+            self.finished = time.monotonic()
+            self.conversions += 1
+            self._cond.notify_all()
+
+    def bulk_read(self):
+        path = os.path.join(self.master, 'therm_bulk_read')
+        try:
+            with open(path, 'w') as f:
+                f.write('trigger\n')
+        except OSError as exc:
+            logging.info(f'W1 Bus - trigger {type(exc).__name__}')
+            return dict.fromkeys(self.devices)
+
+        #wait the conversion time, then for any probe still converting
+        deadline = time.monotonic() + 2*self.conversion_time
+        self._stop_event.wait(self.conversion_time)
+        while time.monotonic() < deadline and self._converting(path):
+            self._stop_event.wait(0.01)
+
+        return {device: self.read_device(device, 'temperature') for device in self.devices}
+
+    def _converting(self, path):
+        try:
+            with open(path) as f:
+                return f.read().strip() == '-1'
+        except (OSError, ValueError):
+            return False
+
+    def read_device(self, device, name):
+        path = os.path.join(self.root, device, name)
+        try:
+            if name == 'temperature':
+                return read_millidegrees(path)
+            return read_w1_slave(path)
+        except (OSError, ValueError, IndexError) as exc:
+            self.errors += 1
+            logging.info(f'W1 Bus - {device} {type(exc).__name__}')
+            return None
+
+    #---------------------------------------
+
+    def wait(self, device, seq, timeout=None, stop_event=None):
+
+        """Waits until a conversion newer than seq has finished, or the
+           stop event is set and wake is called. Returns (seq, temperature
+           of the device)"""
+
+        def ready():
+            stopped = stop_event is not None and stop_event.is_set()
+            return self.seq > seq or self._users == 0 or stopped
+
+        with self._cond:
+            self._cond.wait_for(ready, timeout)
+            return self.seq, self._results.get(device)
+
+    def wake(self):
+
+        """Wakes every sensor waiting for a conversion to check its stop
+           event"""
+
+        with self._cond:
+            self._cond.notify_all()
+
+    def latest(self, device):
+        with self._cond:
+            return self.seq, self._results.get(device)
+
+    def until_next(self, now=None):
+
+        """Seconds until the next conversion is due to finish, for sensors
+           that poll for it. A late conversion is checked for every
+           hundredth of a second"""
+
+        if now is None:
+            now = time.monotonic()
+        with self._cond:
+            if self.finished is None:
+                return self.conversion_time
+            return max(0.01, self.finished + self.period - now)
@@ -0,0 +1,55 @@
+import time
+
+
+#-------------------------------------------
+
+class ReplayClock:
+
+    """Maps replay time (seconds into the recorded flight) to the monotonic
+       clock, so every simulated device follows the same timeline at the
+       same speed-up
+
+       INPUTS:
+       speed: float, replay seconds per wall-clock second, e.g. 10 for 10x
+       start: float, replay time the replay starts from"""
+
+    def __init__(self, speed=1.0, start=0.0):
+
+        if not speed > 0:
+            raise ValueError(f'Replay speed must be positive: {speed}')
+
+        self.speed = speed
+        self.start_time = start
+        self._origin = None
+
+    def __repr__(self):
+        return f'ReplayClock(speed={self.speed}, start={self.start_time})'
+
+    def start(self):
+
+        """Starts the replay timeline at the current monotonic time"""
+
+        self._origin = time.monotonic()
+        return self
+
+    @property
+    def started(self):
+        return self._origin is not None
+
+    def now(self):
+
+        """Current replay time in seconds"""
+
+        return self.start_time + (time.monotonic() - self._origin)*self.speed
+
+    def wall(self, replay_time):
+
+        """Monotonic time at which replay_time is reached"""
+
+        return self._origin + (replay_time - self.start_time)/self.speed
+
+    def until(self, replay_time):
+
+        """Wall-clock seconds until replay_time, 0 if it has passed"""
+
+        return max(0.0, self.wall(replay_time) - time.monotonic())
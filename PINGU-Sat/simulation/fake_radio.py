@@ -0,0 +1,81 @@
+"""Simulated TupperSat radio.
+
+FakeSatRadio has the methods RunRadio uses on tuppersat.radio.SatRadio.
+Every packet is written to the serial port it was given (a SinkSerial in a
+replay) and recorded with its size and send time. A link outage can be
+simulated, during which every send fails as a serial write timeout would,
+and so can a stall, during which every send blocks.
+"""
+import threading
+import time
+import serial
+
+
+#-------------------------------------------
+
+class FakeSatRadio:
+
+    """SatRadio stand-in recording the packets sent
+
+       INPUTS:
+       serial: object, port the packets are written to
+       address, callsign: as for SatRadio, kept for the record
+       down: callable [optional], returning True while the link is down
+       stall: callable [optional], returning True while a send blocks"""
+
+    def __init__(self, serial, address=None, callsign=None, down=None, stall=None):
+        self.serial = serial
+        self.down = down
+        self.stall = stall
+        self.failed = 0
+        self.stalled = 0
+        self.address = address
+        self.callsign = callsign
+        self.running = False
+        self.packets = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'FakeSatRadio(callsign={self.callsign!r}, packets={len(self.packets)})'
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def _send(self, kind, data):
+        if self.stall is not None and self.stall():
+            with self._lock:
+                self.stalled += 1
+            while self.running and self.stall():
+                time.sleep(0.01)
+            if not self.running:
+                raise serial.SerialException('Port closed during a blocked write')
+        if self.down is not None and self.down():
+            with self._lock:
+                self.failed += 1
+            raise serial.SerialTimeoutException('Write timeout')
+        if isinstance(data, str):
+            data = data.encode('ascii', 'replace')
+        self.serial.write(data)
+        with self._lock:
+            self.packets.append((time.monotonic(), kind, len(data)))
+
+    def send_data_packet(self, msg):
+        self._send('data', msg)
+
+    def send_telemetry(self, **fields):
+        self._send('telemetry', ','.join(str(fields[k]) for k in fields))
+
+    def summary(self):
+
+        """Number of packets and bytes sent of each kind"""
+
+        with self._lock:
+            packets = list(self.packets)
+        summary = {}
+        for _, kind, size in packets:
+            count, total = summary.get(kind, (0, 0))
+            summary[kind] = (count + 1, total + size)
+        return {kind: {'packets': n, 'bytes': b} for kind, (n, b) in summary.items()}
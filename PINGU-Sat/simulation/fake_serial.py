@@ -0,0 +1,275 @@
+"""Simulated serial ports.
+
+A ReplaySerial writes a recorded stream of lines into a pipe at the times
+the ReplayClock gives them, so the sensor reading it sees real blocking
+reads, in_waiting counts and a file descriptor that works with selectors.
+A SinkSerial takes whatever the radio writes. ReplayPorts is passed as the
+serial_factory of the sensors and RunRadio and opens one or the other by
+port name.
+"""
+import array
+import bisect
+import fcntl
+import os
+import select
+import termios
+import threading
+import time
+from collections import OrderedDict
+import serial
+
+
+#-------------------------------------------
+
+def load_stream(filename, interval=1.0):
+
+    """Reads a recorded serial capture (e.g. a _gps.txt log or a Geiger
+       capture), one line per interval s. Returns a list of (replay time,
+       bytes)"""
+
+    stream = []
+    with open(filename, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line == b'No GPS':
+                continue
+            stream.append((len(stream)*interval, line + b'\r\n'))
+    return stream
+
+
+#-------------------------------------------
+
+class ReplaySerial:
+
+    """Read-only serial port replaying a stream of lines on a ReplayClock
+
+       INPUTS:
+       clock: ReplayClock, started before the port is opened
+       stream: list of (replay time, bytes), in time order
+       port, baudrate, timeout: as for serial.Serial. A read waits up to
+                                timeout s for data (forever if None)
+       loop: bool, start the stream again when it runs out. Otherwise the
+             port raises SerialException, as if it was unplugged
+       keep: int, number of written lines whose write times are kept"""
+
+    def __init__(self, clock, stream, port=None, baudrate=9600, timeout=None, loop=True, keep=1024):
+
+        if not stream:
+            raise ValueError(f'Empty replay stream for {port}')
+
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.loop = loop
+
+        self._clock = clock
+        self._times = [t for t, _ in stream]
+        self._lines = [line for _, line in stream]
+        #one stream period, so a looped stream keeps its line spacing
+        self._period = self._times[-1] - self._times[0] + (
+            self._times[-1] - self._times[-2] if len(stream) > 1 else 1.0)
+
+        self._keep = keep
+        self.sent = OrderedDict()
+        self.last_write = None
+        self.lines_written = 0
+        self.bytes_written = 0
+
+        self._read_fd, self._write_fd = os.pipe()
+        #written by cancel_read to wake a blocked read, as in pyserial
+        self._cancel_fds = os.pipe()
+        for fd in self._cancel_fds:
+            os.set_blocking(fd, False)
+        self._cancel_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._feed, daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return f'ReplaySerial({self.port!r}, lines={len(self._lines)}, loop={self.loop})'
+
+    def _feed(self):
+
+        """Writes each line into the pipe when the clock reaches its time"""
+
+        #join the stream where the clock is, for a replay started mid-flight
+        now = self._clock.now()
+        offset = 0.0
+        if self.loop and now > self._times[-1]:
+            offset = (now - self._times[0])//self._period*self._period
+        start = bisect.bisect_left(self._times, now - offset)
+        try:
+            while True:
+                for i in range(start, len(self._lines)):
+                    if self._closed.wait(self._clock.until(offset + self._times[i])):
+                        return
+                    self._write(self._lines[i])
+                if not self.loop:
+                    break
+                offset += self._period
+                start = 0
+        except OSError:
+            #the reader closed the port
+            return
+        finally:
+            os.close(self._write_fd)
+
+    def _write(self, line):
+        #recorded first, the reader can have the line as soon as it is written
+        now = time.monotonic()
+        for sentence in line.split(b'\r\n'):
+            if sentence:
+                self.sent[sentence] = now
+        while len(self.sent) > self._keep:
+            self.sent.popitem(last=False)
+        self.last_write = now
+        os.write(self._write_fd, line)
+        self.lines_written += 1
+        self.bytes_written += len(line)
+
+    def written_at(self, line):
+
+        """Monotonic time a line (without its line ending) was written, or
+           None if it is not among the last keep lines"""
+
+        if isinstance(line, str):
+            line = line.encode('ascii', 'replace')
+        return self.sent.get(line)
+
+    #---------------------------------------
+    #the part of the serial.Serial interface the sensors use
+
+    @property
+    def is_open(self):
+        return not self._closed.is_set()
+
+    @property
+    def in_waiting(self):
+        buf = array.array('i', [0])
+        fcntl.ioctl(self._read_fd, termios.FIONREAD, buf)
+        return buf[0]
+
+    def fileno(self):
+        return self._read_fd
+
+    def read(self, size=1):
+        if self._closed.is_set():
+            raise serial.SerialException('Attempting to use a port that is not open')
+        readable, _, _ = select.select([self._read_fd, self._cancel_fds[0]], [], [], self.timeout)
+        if self._cancel_fds[0] in readable:
+            while self._drain_cancel():
+                pass
+            return b''
+        if not readable:
+            return b''
+        data = os.read(self._read_fd, size)
+        if not data:
+            raise serial.SerialException(f'{self.port} replay finished')
+        return data
+
+    def _drain_cancel(self):
+        try:
+            return os.read(self._cancel_fds[0], 64)
+        except BlockingIOError:
+            return b''
+
+    def cancel_read(self):
+
+        """Ends a blocked read, which returns no data"""
+
+        with self._cancel_lock:
+            if self._closed.is_set():
+                return
+            try:
+                os.write(self._cancel_fds[1], b'x')
+            except BlockingIOError:
+                pass
+
+    def readline(self):
+        line = bytearray()
+        while not line.endswith(b'\n'):
+            c = self.read(1)
+            if not c:
+                break
+            line += c
+        return bytes(line)
+
+    def write(self, data):
+        return len(data)
+
+    def close(self):
+        with self._cancel_lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+        os.close(self._read_fd)
+        self._thread.join()
+        for fd in self._cancel_fds:
+            os.close(fd)
+
+
+#-------------------------------------------
+
+class SinkSerial:
+
+    """Write-only serial port that counts what is written to it"""
+
+    def __init__(self, port=None, baudrate=9600, timeout=None, write_timeout=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.is_open = True
+        self.bytes_written = 0
+        self.writes = 0
+
+    def __repr__(self):
+        return f'SinkSerial({self.port!r}, bytes_written={self.bytes_written})'
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        self.writes += 1
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+#-------------------------------------------
+
+class ReplayPorts:
+
+    """serial_factory opening a ReplaySerial for each port with a stream
+       and a SinkSerial for any other port (the radio)
+
+       INPUTS:
+       clock: ReplayClock
+       streams: dict, port name: list of (replay time, bytes)
+       loop: bool, passed to each ReplaySerial"""
+
+    def __init__(self, clock, streams, loop=True):
+        self.clock = clock
+        self.streams = streams
+        self.loop = loop
+        self.opened = {}
+
+    def __repr__(self):
+        return f'ReplayPorts({list(self.streams)})'
+
+    def __call__(self, port, baudrate=9600, timeout=None, write_timeout=None):
+        if port in self.streams:
+            opened = ReplaySerial(self.clock, self.streams[port], port, baudrate, timeout, self.loop)
+        else:
+            opened = SinkSerial(port, baudrate, timeout, write_timeout)
+        self.opened[port] = opened
+        return opened
+
+    def close(self):
+
+        """Closes any port the sensors left open"""
+
+        for opened in self.opened.values():
+            opened.close()
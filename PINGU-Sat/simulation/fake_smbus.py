@@ -0,0 +1,109 @@
+"""Simulated I2C bus with an MS5611 on it.
+
+The FakeMS5611 answers the commands PressureSensor and MS5611Converter send:
+PROM reads return the calibration constants, a conversion command starts a
+conversion that takes the datasheet time for its oversampling ratio, and an
+ADC read returns the recorded D1 or D2 value at the current replay time, or
+0 if the conversion has not finished, as the sensor does.
+"""
+import bisect
+import threading
+import time
+from sensors.pressure_sensor.conversion import CONVERT_D1, CONVERT_D2, ADC_READ, OSR
+from sensors.pressure_sensor.compensation import load_raw_log
+
+
+PROM_READ = 0xA0
+RESET = 0x1E
+
+#command offset: conversion time in s
+CONVERSION_TIME = {offset: t for offset, t in OSR.values()}
+
+
+#-------------------------------------------
+
+class FakeMS5611:
+
+    """smbus.SMBus stand-in replaying raw MS5611 conversions
+
+       INPUTS:
+       clock: ReplayClock
+       constants: list, [None, C1, ..., C6] as from unpack_constants
+       times: sequence of replay times of the recorded conversions
+       d1, d2: sequences of the recorded raw conversions
+       loop: bool, start the recording again when it runs out"""
+
+    def __init__(self, clock, constants, times, d1, d2, loop=True):
+
+        if not len(times):
+            raise ValueError('Empty pressure recording')
+
+        self.clock = clock
+        self.constants = constants
+        self._times = [float(t) - float(times[0]) for t in times]
+        self._d1 = [int(v) for v in d1]
+        self._d2 = [int(v) for v in d2]
+        self._period = self._times[-1] + (self._times[-1] - self._times[-2] if len(times) > 1 else 1.0)
+        self.loop = loop
+
+        self._lock = threading.Lock()
+        self._pending = None
+        self._ready_at = 0.0
+
+        self.conversions = 0
+        self.early_reads = 0
+        self.last_ready = None
+
+    def __repr__(self):
+        return f'FakeMS5611(samples={len(self._times)}, conversions={self.conversions})'
+
+    @classmethod
+    def from_raw_log(cls, clock, filename, loop=True):
+
+        """Replays a raw log written by PressureSensor with raw_log set"""
+
+        constants, times, d1, d2 = load_raw_log(filename)
+        return cls(clock, constants, times, d1, d2, loop)
+
+    def sample(self, replay_time):
+
+        """Recorded (D1, D2) at a replay time"""
+
+        if self.loop:
+            replay_time %= self._period
+        i = max(bisect.bisect_right(self._times, replay_time) - 1, 0)
+        return self._d1[i], self._d2[i]
+
+    #---------------------------------------
+    #the part of the smbus.SMBus interface PressureSensor uses
+
+    def write_byte(self, addr, cmd):
+        with self._lock:
+            if cmd == RESET:
+                self._pending = None
+            elif CONVERT_D1 <= cmd < CONVERT_D1 + 0x10 or CONVERT_D2 <= cmd < CONVERT_D2 + 0x10:
+                kind = 0 if cmd < CONVERT_D2 else 1
+                self._pending = kind
+                self._ready_at = time.monotonic() + CONVERSION_TIME.get(cmd & 0x0F, OSR[4096][1])
+
+    def read_i2c_block_data(self, addr, cmd, length):
+        if PROM_READ < cmd <= PROM_READ + 12:
+            value = self.constants[(cmd - PROM_READ)//2]
+            return [value >> 8 & 0xFF, value & 0xFF][:length]
+        if cmd != ADC_READ:
+            return [0]*length
+
+        with self._lock:
+            now = time.monotonic()
+            if self._pending is None or now < self._ready_at:
+                self.early_reads += 1
+                self._pending = None
+                return [0]*length
+            value = self.sample(self.clock.now())[self._pending]
+            self._pending = None
+            self.conversions += 1
+            self.last_ready = self._ready_at
+        return [value >> 16 & 0xFF, value >> 8 & 0xFF, value & 0xFF][:length]
+
+    def close(self):
+        pass
@@ -0,0 +1,106 @@
+"""Simulated w1 sysfs tree.
+
+A FakeW1Tree lays out a temporary directory the way the w1_therm driver
+does (w1_bus_master1/therm_bulk_read and, for each probe, temperature,
+w1_slave and resolution files) and rewrites the temperature files as the
+replay goes on. A W1BusManager given its root reads it like the real tree.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from sensors.temperature_sensor.w1_bus import MASTER
+
+
+#-------------------------------------------
+
+class FakeW1Tree:
+
+    """Temporary directory standing in for /sys/bus/w1/devices
+
+       INPUTS:
+       clock: ReplayClock
+       probes: dict, device ID (e.g. 28-00000de90790): callable giving the
+               temperature in C at a replay time
+       period: float, replay seconds between updates of the files
+       crc_errors: float, fraction of w1_slave files written with a failed
+                   CRC check"""
+
+    def __init__(self, clock, probes, period=1.0, crc_errors=0.0):
+
+        self.clock = clock
+        self.probes = probes
+        self.period = period
+        self.crc_errors = crc_errors
+
+        self.root = tempfile.mkdtemp(prefix='w1_')
+        self.updates = 0
+        self.last_write = None
+        self._crc_due = 0.0
+
+        os.mkdir(os.path.join(self.root, MASTER))
+        self._write(os.path.join(self.root, MASTER, 'therm_bulk_read'), '0\n')
+        for device in probes:
+            os.mkdir(os.path.join(self.root, device))
+            self._write(os.path.join(self.root, device, 'resolution'), '12\n')
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        return f'FakeW1Tree({self.root!r}, probes={list(self.probes)})'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def device_path(self, device, name='w1_slave'):
+        return os.path.join(self.root, device, name)
+
+    def _write(self, path, text):
+
+        """Replaces a file in one step so a reader never sees half of it"""
+
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def update(self, replay_time):
+
+        """Writes every probe's temperature at a replay time"""
+
+        for device, temperature in self.probes.items():
+            millidegrees = int(round(float(temperature(replay_time))*1000))
+            self._crc_due += self.crc_errors
+            crc = 'NO' if self._crc_due >= 1 else 'YES'
+            if self._crc_due >= 1:
+                self._crc_due -= 1
+            raw = f'{millidegrees*16//1000 & 0xFFFF:04x}'
+            raw = f'{raw[2:]} {raw[:2]} 4b 46 7f ff 0c 10 1c'
+            self._write(self.device_path(device, 'temperature'), f'{millidegrees}\n')
+            self._write(self.device_path(device),
+                        f'{raw} : crc=1c {crc}\n{raw} t={millidegrees}\n')
+        self.updates += 1
+        self.last_write = time.monotonic()
+
+    def start(self):
+        self.update(self.clock.now())
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        replay_time = self.clock.now()
+        while not self._stop_event.wait(self.clock.until(replay_time + self.period)):
+            replay_time = self.clock.now()
+            self.update(replay_time)
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        shutil.rmtree(self.root, ignore_errors=True)
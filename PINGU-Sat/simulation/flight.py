@@ -0,0 +1,193 @@
+"""Synthetic balloon flight used when no recording is replayed.
+
+The flight climbs at a constant rate to burst and falls back at a constant
+rate. The pressure follows the International Standard Atmosphere, the
+outside temperature its lapse rate, and the Geiger count rate a Pfotzer
+curve peaking near 18 km. Each generator returns the stream the matching
+simulated device replays.
+"""
+import numpy as np
+
+
+#MS5611 calibration constants from the datasheet example, [None, C1, ..., C6]
+DATASHEET_CONSTANTS = [None, 40127, 36924, 23317, 23282, 33464, 28312]
+
+
+#-------------------------------------------
+
+def isa_pressure(altitude, p0=1013.25):
+
+    """Pressure in mbar at an altitude in m in the International Standard
+       Atmosphere, the inverse of altitude.pressure_altitude"""
+
+    altitude = np.asarray(altitude, dtype=np.float64)
+    troposphere = p0*np.clip(1 - altitude/44330.8, 0, None)**(1/0.190263)
+    stratosphere = 226.32*np.exp(-(altitude - 11000)/6341.62)
+    return np.where(altitude < 11000, troposphere, stratosphere)
+
+
+def raw_conversions(constants, temperature, pressure):
+
+    """Raw MS5611 conversions (D1, D2) that compensate to a temperature in C
+       and a pressure in mbar, as int64 arrays. The second-order correction
+       of the temperature is ignored, so cold readings come back slightly
+       lower, as they would from the sensor"""
+
+    c = [0] + [np.int64(v) for v in constants[1:]]
+    temp = np.round(np.asarray(temperature)*100).astype(np.int64)
+    p = np.round(np.asarray(pressure)*100).astype(np.int64)
+
+    dT = ((temp - 2000) << 23)//c[6]
+    d2 = dT + (c[5] << 8)
+    temp = 2000 + (dT*c[6] >> 23)
+    off = (c[2] << 16) + (c[4]*dT >> 7)
+    sens = (c[1] << 15) + (c[3]*dT >> 8)
+
+    cold = np.where(temp < 2000, (temp - 2000)**2, 0)
+    very_cold = np.where(temp < -1500, (temp + 1500)**2, 0)
+    off = off - (5*cold >> 1) - 7*very_cold
+    sens = sens - (5*cold >> 2) - (11*very_cold >> 1)
+
+    d1 = (((p << 15) + off) << 21)//sens
+    return d1, d2
+
+
+def nmea_sentence(body):
+
+    """Adds the start character, checksum and line ending to a sentence"""
+
+    value = 0
+    for c in body.encode('ascii'):
+        value ^= c
+    return f'${body}*{value:02X}\r\n'.encode('ascii')
+
+
+def _ddmm(degrees, width):
+    minutes = abs(degrees)*60
+    return f'{int(minutes//60):0{width}d}{minutes % 60:07.4f}'
+
+
+#-------------------------------------------
+
+class SyntheticFlight:
+
+    """Altitude, atmosphere and radiation along a simple balloon flight
+
+       INPUTS:
+       ascent_rate: float, m/s
+       burst_altitude: float, m
+       descent_rate: float, m/s
+       launch_altitude: float, m
+       latitude, longitude: float, degrees at launch
+       drift: float, m/s the balloon drifts east
+       start: int, seconds after midnight UTC of the launch
+       seed: int, seed of the sensor noise"""
+
+    def __init__(self, ascent_rate=5.0, burst_altitude=30000, descent_rate=12.0,
+                 launch_altitude=50, latitude=53.3403, longitude=-6.2597, drift=8.0,
+                 start=36000, seed=1):
+
+        self.ascent_rate = ascent_rate
+        self.burst_altitude = burst_altitude
+        self.descent_rate = descent_rate
+        self.launch_altitude = launch_altitude
+        self.latitude = latitude
+        self.longitude = longitude
+        self.drift = drift
+        self.start = start
+        self.seed = seed
+
+    def __repr__(self):
+        return f'SyntheticFlight(burst_altitude={self.burst_altitude}, duration={self.duration:.0f})'
+
+    @property
+    def burst_time(self):
+        return (self.burst_altitude - self.launch_altitude)/self.ascent_rate
+
+    @property
+    def duration(self):
+        return self.burst_time + (self.burst_altitude - self.launch_altitude)/self.descent_rate
+
+    def altitude(self, t):
+        t = np.asarray(t, dtype=np.float64)
+        up = self.launch_altitude + self.ascent_rate*t
+        down = self.burst_altitude - self.descent_rate*(t - self.burst_time)
+        return np.clip(np.where(t < self.burst_time, up, down), self.launch_altitude, None)
+
+    def pressure(self, t):
+        return isa_pressure(self.altitude(t))
+
+    def temperature(self, t):
+
+        """Outside temperature in C"""
+
+        return np.maximum(15 - 0.0065*self.altitude(t), -56.5)
+
+    def internal_temperature(self, t):
+
+        """Inside the insulated box, which cools slowly with the air"""
+
+        return 20 + 0.2*(self.temperature(t) - 15)
+
+    def count_rate(self, t):
+
+        """Mean Geiger counts per second"""
+
+        altitude = self.altitude(t)
+        return 0.4 + 6.0*np.exp(-((altitude - 18000)/7000)**2)*np.clip(altitude/10000, 0, 1)
+
+    #---------------------------------------
+
+    def times(self, rate, duration=None):
+        duration = self.duration if duration is None else duration
+        return np.arange(0, duration, 1/rate)
+
+    def gps_stream(self, duration=None, rate=1.0):
+
+        """A burst of RMC, GGA and GSA sentences every 1/rate s. Returns a
+           list of (replay time, bytes)"""
+
+        rng = np.random.default_rng(self.seed)
+        times = self.times(rate, duration)
+        altitude = self.altitude(times) + rng.normal(0, 5, len(times))
+        east = self.drift*times/(111320*np.cos(np.radians(self.latitude)))
+        speed = self.drift*1.94384
+
+        stream = []
+        for t, alt, lon in zip(times, altitude, self.longitude + east):
+            s = int(self.start + t) % 86400
+            hhmmss = f'{s//3600:02d}{s//60 % 60:02d}{s % 60:02d}.00'
+            lat = f'{_ddmm(self.latitude, 2)},{"N" if self.latitude >= 0 else "S"}'
+            lon = f'{_ddmm(lon, 3)},{"E" if lon >= 0 else "W"}'
+            burst = (
+                nmea_sentence(f'GPRMC,{hhmmss},A,{lat},{lon},{speed:.1f},90.0,010122,,,A')
+                + nmea_sentence(f'GPGGA,{hhmmss},{lat},{lon},1,08,0.9,{alt:.1f},M,46.9,M,,')
+                + nmea_sentence('GPGSA,A,3,04,05,09,12,24,25,29,31,,,,,1.8,0.9,1.5')
+            )
+            stream.append((float(t), burst))
+        return stream
+
+    def geiger_stream(self, duration=None):
+
+        """One reading per second in the counter's serial format"""
+
+        rng = np.random.default_rng(self.seed + 1)
+        times = self.times(1.0, duration)
+        cps = rng.poisson(self.count_rate(times))
+        cpm = np.convolve(cps, np.ones(60, dtype=np.int64))[:len(cps)]
+        return [
+            (float(t), f'CPS, {n}, CPM, {m}, uSv/hr, {m*0.0057:.2f}, SLOW\r\n'.encode('ascii'))
+            for t, n, m in zip(times, cps, cpm)
+        ]
+
+    def pressure_recording(self, duration=None, rate=10.0, constants=DATASHEET_CONSTANTS):
+
+        """Raw MS5611 conversions every 1/rate s, in the layout returned by
+           compensation.load_raw_log: (constants, times, D1, D2). The
+           sensor sits in the box, at the internal temperature"""
+
+        rng = np.random.default_rng(self.seed + 2)
+        times = self.times(rate, duration)
+        pressure = self.pressure(times) + rng.normal(0, 0.02, len(times))
+        d1, d2 = raw_conversions(constants, self.internal_temperature(times), np.maximum(pressure, 1.0))
+        return constants, times, d1, d2
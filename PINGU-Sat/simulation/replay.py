@@ -0,0 +1,301 @@
+"""Replays a balloon flight through the full flight software, without any
+hardware, and reports throughput and latency.
+
+The sensors, processes and radio are built by pingu_main, exactly as on
+the Pi, with the hardware swapped for the simulated devices: the GPS (and
+Geiger counter) read ReplaySerial ports, the pressure sensor a FakeMS5611
+and the temperature probes a FakeW1Tree, while the radio is a FakeSatRadio
+on a SinkSerial. Every device follows one ReplayClock, so a replay at 10x
+runs the recorded flight ten times faster, with the process pauses scaled
+to match. By default a SyntheticFlight is replayed. A recorded _gps.txt
+log and raw pressure log can be given instead.
+
+For every sensor the report gives the samples that reached the SnapshotBus
+per replay second and their age when published: the time from the
+simulated device producing the sample (the line written to the port, the
+MS5611 conversion finishing, the w1 file being written) to the publish,
+and the age of the data when each sink (StoreData, HandleData and
+HandleTelemetry) wrote or sent it, with the overruns and start jitter of
+each fixed-rate process. With --outage the radio link is down between two
+replay times, and the report shows the payload frames stored in the
+PayloadBacklog and how far it has drained. With --stall every radio send
+blocks between two replay times, and the sends that time out are counted.
+Run from the PINGU-Sat directory:
+
+    python -m simulation.replay --speed 10 --duration 600
+    python -m simulation.replay --speed 20 --duration 1200 --outage 200 600
+    python -m simulation.replay --speed 20 --duration 1200 --stall 200 600
+"""
+import argparse
+import functools
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+import pingu_main
+from data_utils.process_handling import RunSensor, RunProcesses
+from data_utils.radio_utils import RunRadio
+from data_utils.snapshot import SnapshotBus
+from data_utils.link_scheduler import LinkScheduler
+from data_utils.backlog import PayloadBacklog
+from data_utils.altitude import AltitudeEstimator
+from data_utils.latency import LatencyTracker
+from data_utils.rotating_log import read_segment
+from simulation.clock import ReplayClock
+from simulation.fake_serial import ReplayPorts, load_stream
+from simulation.fake_smbus import FakeMS5611
+from simulation.fake_w1 import FakeW1Tree
+from simulation.fake_radio import FakeSatRadio
+from simulation.flight import SyntheticFlight
+
+
+#the Geiger counter is not in pingu_main's port list, it is given this one
+GEIGER_PORT = '/dev/ttyUSB0'
+
+
+#-------------------------------------------
+
+class ReplayMonitor:
+
+    """SnapshotBus subscriber counting the samples of each key and their
+       age when published
+
+       INPUTS:
+       sources: dict, key: callable taking the published value and giving
+                the monotonic time the simulated device produced it, or
+                None if unknown"""
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.counts = {}
+        self.ages = {}
+        self.recording = True
+
+    def attach(self, bus):
+        bus.subscribe(self.on_sample)
+        return self
+
+    def on_sample(self, key, value, timestamp):
+        if value is None or not self.recording:
+            return
+        self.counts[key] = self.counts.get(key, 0) + 1
+        source = self.sources.get(key)
+        produced = source(value) if source is not None else None
+        if produced is not None:
+            self.ages.setdefault(key, []).append(timestamp - produced)
+
+    def summary(self, replay_seconds):
+        summary = {}
+        for key, count in sorted(self.counts.items()):
+            summary[key] = {'samples': count, 'per_replay_s': count/replay_seconds}
+            ages = self.ages.get(key)
+            if ages:
+                ages = np.array(ages)*1000
+                summary[key]['age_ms'] = {
+                    'p50': float(np.percentile(ages, 50)),
+                    'p99': float(np.percentile(ages, 99)),
+                    'max': float(ages.max()),
+                }
+        return summary
+
+
+def device_id(path):
+    return os.path.basename(os.path.dirname(path))
+
+
+def count_records(directory):
+
+    """Lines in the _enviroment.txt files, or in their RotatingFile
+       segments"""
+
+    records = 0
+    for filename in glob.glob(os.path.join(directory, '*_enviroment*.txt*')):
+        records += read_segment(filename).count(b'\n')
+    return records
+
+
+#-------------------------------------------
+
+def run_replay(speed=10.0, duration=600.0, start=0.0, gps_log=None, raw_log=None, geiger=True,
+               backend='threads', output=None, flight=None, outage=None, stall=None):
+
+    """Runs the flight software on a replayed flight for duration replay
+       seconds, starting start seconds into the flight, with the radio
+       link down between the two replay times of outage if given, and the
+       radio sends blocking between those of stall. Returns the report as
+       a dictionary"""
+
+    flight = SyntheticFlight() if flight is None else flight
+    clock = ReplayClock(speed, start)
+
+    streams = {pingu_main.GPS_PORT: load_stream(gps_log) if gps_log else flight.gps_stream()}
+    if geiger:
+        streams[GEIGER_PORT] = flight.geiger_stream()
+    ports = ReplayPorts(clock, streams)
+
+    if raw_log:
+        smbus = FakeMS5611.from_raw_log(clock, raw_log)
+    else:
+        smbus = FakeMS5611(clock, *flight.pressure_recording())
+
+    probes = {
+        device_id(pingu_main.EXT_ADDRESS): flight.temperature,
+        device_id(pingu_main.INT_ADDRESS): flight.internal_temperature,
+    }
+
+    def port_source(port, exact):
+        def source(value):
+            opened = ports.opened.get(port)
+            if opened is None:
+                return None
+            return opened.written_at(value) if exact else opened.last_write
+        return source
+
+    clock.start()
+    with tempfile.TemporaryDirectory() as tmp, FakeW1Tree(clock, probes) as w1:
+        directory = os.path.join(output or tmp, '')
+        sensors = pingu_main.build_sensors(
+            serial_factory=ports,
+            smbus=smbus,
+            w1_root=w1.root,
+            geiger_port=GEIGER_PORT if geiger else None,
+            w1_period=1/speed,
+        )
+
+        bus = SnapshotBus()
+        AltitudeEstimator().attach(bus)
+        latency = LatencyTracker()
+        monitor = ReplayMonitor({
+            'gps': port_source(pingu_main.GPS_PORT, exact=True),
+            'geiger': port_source(GEIGER_PORT, exact=False),
+            'pressure': lambda value: smbus.last_ready,
+            't_internal': lambda value: w1.last_write,
+            't_external': lambda value: w1.last_write,
+        }).attach(bus)
+
+        down = None
+        if outage:
+            down = lambda: outage[0] <= clock.now() < outage[1]
+        blocked = None
+        if stall:
+            blocked = lambda: stall[0] <= clock.now() < stall[1]
+
+        wall = time.monotonic()
+        cpu = time.process_time()
+        try:
+            with RunSensor(bus.attach(sensors), backend=backend):
+                with RunRadio(pingu_main.RADIO_PORT, serial_factory=ports,
+                              radio_factory=functools.partial(FakeSatRadio, down=down,
+                                                              stall=blocked)) as radio:
+                    backlog = PayloadBacklog(os.path.join(directory, 'backlog.bin'))
+                    with LinkScheduler(radio, backlog=backlog, retry_interval=10/speed,
+                                       report_interval=300/speed,
+                                       send_timeout=5/speed) as link:
+                        processes = pingu_main.build_processes(bus, link, directory, time_scale=speed,
+                                                               latency=latency, geiger=geiger)
+                        with RunProcesses(processes) as running:
+                            time.sleep(duration/speed)
+                            #samples published while shutting down are not counted
+                            monitor.recording = False
+                            wall = time.monotonic() - wall
+                            cpu = time.process_time() - cpu
+                            schedules = running.schedule_stats()
+                            shutdown = time.monotonic()
+                        link_stats = link.stats()
+                        send_timeouts = link.timeouts
+        finally:
+            ports.close()
+        shutdown = time.monotonic() - shutdown
+
+        return {
+            'speed': speed,
+            'replay_s': duration,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'shutdown_s': shutdown,
+            'bus': monitor.summary(duration),
+            'sinks': latency.summary(),
+            'schedules': schedules,
+            'radio': radio.radio.summary(),
+            'link': link_stats,
+            'send_timeouts': send_timeouts,
+            'backlog': backlog.summary(),
+            'records_stored': count_records(directory),
+            'pressure_conversions': smbus.conversions,
+            'pressure_early_reads': smbus.early_reads,
+            'w1_conversions': sensors['t_internal'].manager.conversions,
+        }
+
+
+def print_report(report):
+    print(f"replayed {report['replay_s']:.0f} s at {report['speed']:g}x in "
+          f"{report['wall_s']:.1f} s wall, {report['cpu_s']:.2f} s CPU "
+          f"(shutdown {report['shutdown_s']:.1f} s)")
+    print(f"{'key':<12}{'samples':>9}{'per replay s':>14}{'age p50 ms':>12}{'p99 ms':>9}{'max ms':>9}")
+    for key, row in report['bus'].items():
+        age = row.get('age_ms')
+        ages = f"{age['p50']:>12.2f}{age['p99']:>9.2f}{age['max']:>9.2f}" if age else ''
+        print(f"{key:<12}{row['samples']:>9}{row['per_replay_s']:>14.3f}{ages}")
+    print(f"{'sink':<10}{'key':<12}{'count':>7}{'age p50 ms':>12}{'p99 ms':>9}{'max ms':>9}")
+    for sink, keys in report['sinks'].items():
+        for key, s in keys.items():
+            if s['count']:
+                print(f"{sink:<10}{key:<12}{s['count']:>7}{s['p50']*1000:>12.1f}"
+                      f"{s['p99']*1000:>9.1f}{s['max']*1000:>9.1f}")
+    print(f"{'process':<18}{'period s':>9}{'runs':>7}{'overruns':>9}{'jitter p50 ms':>15}{'p99 ms':>9}")
+    for name, s in report['schedules'].items():
+        jitter = s['jitter']
+        jitters = f"{jitter['p50']*1000:>15.2f}{jitter['p99']*1000:>9.2f}" if jitter['count'] else ''
+        print(f"{name:<18}{s['period']:>9.3f}{s['iterations']:>7}{s['overruns']:>9}{jitters}")
+    for kind, row in report['radio'].items():
+        print(f"radio {kind}: {row['packets']} packets, {row['bytes']} bytes")
+    for kind, s in report['link'].items():
+        latency = f", mean latency {s['mean_latency']:.1f} s" if s['sent'] else ''
+        print(f"link {kind}: {s['sent']} sent, {s['dropped']} dropped, {s['backlogged']} backlogged{latency}")
+    print(f"link send timeouts: {report['send_timeouts']}")
+    backlog = report['backlog']
+    age = f", oldest {backlog['oldest_age']:.1f} s" if backlog['frames'] else ''
+    print(f"backlog: {backlog['frames']} frames, {backlog['bytes']} bytes waiting{age}, "
+          f"{backlog['stored']} stored, {backlog['sent']} sent, {backlog['evicted']} evicted")
+    print(f"records stored: {report['records_stored']}, MS5611 conversions: "
+          f"{report['pressure_conversions']} ({report['pressure_early_reads']} early reads), "
+          f"w1 conversions: {report['w1_conversions']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--speed', type=float, default=10.0, help='speed-up, 1 to 100')
+    parser.add_argument('--duration', type=float, default=600.0, help='replay seconds to run')
+    parser.add_argument('--start', type=float, default=0.0, help='replay seconds into the flight to start at')
+    parser.add_argument('--gps-log', help='recorded _gps.txt log to replay')
+    parser.add_argument('--raw-log', help='raw pressure log to replay')
+    parser.add_argument('--no-geiger', action='store_true', help='fly without the Geiger counter')
+    parser.add_argument('--backend', choices=('threads', 'scheduler'), default='threads')
+    parser.add_argument('--outage', type=float, nargs=2, metavar=('START', 'END'),
+                        help='replay times between which the radio link is down')
+    parser.add_argument('--stall', type=float, nargs=2, metavar=('START', 'END'),
+                        help='replay times between which the radio sends block')
+    parser.add_argument('--output', help='directory the logs are written to, a temporary one if not given')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--verbose', action='store_true', help='show the flight software log')
+    args = parser.parse_args()
+
+    if not 1 <= args.speed <= 100:
+        parser.error('--speed must be between 1 and 100')
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s: %(message)s')
+
+    report = run_replay(args.speed, args.duration, args.start, args.gps_log, args.raw_log,
+                        not args.no_geiger, args.backend, args.output, outage=args.outage,
+                        stall=args.stall)
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
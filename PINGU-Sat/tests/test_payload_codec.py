@@ -0,0 +1,58 @@
+"""Round trips of the payload codec. Run from the PINGU-Sat directory:
+
+    python -m pytest tests
+"""
+import math
+import pytest
+from data_utils.payload_codec import (PayloadCodec, DEFAULT_FIELDS, COALESCED, join_frames,
+                                      split_frames)
+
+
+FIELDS = (('time', 0.1), ('pressure', 0.01))
+
+#packet 3 of two samples, the second without a pressure:
+#version, counter, samples, then mask and zigzag deltas of each sample
+VECTOR = bytes.fromhex('01' '03' '02' '03' '14' '9aaf0c' '01' '0a')
+SAMPLES = [{'time': 1.0, 'pressure': 1013.25}, {'time': 1.5, 'pressure': None}]
+
+
+#-------------------------------------------
+
+def test_fixed_vector():
+    codec = PayloadCodec(FIELDS)
+    assert codec.encode(3, SAMPLES) == VECTOR
+    assert codec.decode(VECTOR) == (3, SAMPLES)
+
+
+def test_missing_fields_are_masked():
+    codec = PayloadCodec()
+    names = [name for name, _ in DEFAULT_FIELDS]
+    samples = [
+        {'time': 1650000000.0, 'pressure': 1013.25, 't_external': -2.5, 'alt': 120.3},
+        {'time': 1650000010.0, 'pressure': None, 't_external': math.nan, 'alt': 180.7},
+        {},
+    ]
+
+    index, decoded = codec.decode(codec.encode(7, samples))
+
+    assert index == 7
+    for sample, row in zip(samples, decoded):
+        assert set(row) == set(names)
+        for name in names:
+            value = sample.get(name)
+            if value is None or math.isnan(value):
+                assert row[name] is None
+            else:
+                assert row[name] == pytest.approx(value)
+
+
+def test_coalesced_packets():
+    codec = PayloadCodec(FIELDS)
+    packet = join_frames([VECTOR, codec.encode(4, SAMPLES[:1])])
+
+    assert packet[0] == COALESCED
+    assert codec.decode_packets(packet) == [(3, SAMPLES), (4, SAMPLES[:1])]
+    assert codec.decode_packets(VECTOR) == [(3, SAMPLES)]
+    assert split_frames(b'0001;text') == [b'0001;text']
+    with pytest.raises(ValueError):
+        codec.decode(packet)
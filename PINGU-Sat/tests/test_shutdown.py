@@ -0,0 +1,28 @@
+"""Shutdown of the flight runtime on the simulated hardware, within the
+bound of the shutdown benchmark. Run from the PINGU-Sat directory:
+
+    python -m pytest tests
+"""
+import pytest
+
+pytest.importorskip('tuppersat')
+
+from benchmarks.shutdown_benchmark import shutdown_times, SCENARIOS
+
+
+#s for RunProcesses.__exit__, and for the whole shutdown
+BOUND = 0.2
+
+#s run before stopping, enough for every process to be in its pause
+RUN_TIME = 1.0
+
+
+#-------------------------------------------
+
+@pytest.mark.parametrize('backend', ['threads', 'scheduler'])
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_shutdown_within_bound(scenario, backend):
+    times = shutdown_times(scenario, backend, RUN_TIME)
+
+    assert times['RunProcesses'] < BOUND
+    assert sum(times.values()) < BOUND